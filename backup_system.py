@@ -3,10 +3,10 @@
 Backup System with Git
 Система резервного копирования с Git-версионированием
 """
-import git
 import os
 import logging
 import shutil
+import threading
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Dict, Any, List, Optional
@@ -26,6 +26,8 @@ class BackupSystem:
     def init_git(self):
         """Инициализация Git репозитория с .gitignore"""
         try:
+            import git
+            
             if not (self.repo_path / ".git").exists():
                 logger.info("📦 Initializing Git repository...")
                 self.repo = git.Repo.init(self.repo_path)
@@ -392,5 +394,23 @@ logs/
             logger.warning(f"⚠️  Could not save metadata: {e}")
 
 
-# Глобальный экземпляр
-backup_system = BackupSystem()
+# Глобальный экземпляр (создаётся лениво, при первом обращении)
+_backup_system: Optional[BackupSystem] = None
+_backup_system_lock = threading.Lock()
+
+
+def get_backup_system() -> BackupSystem:
+    """Общий экземпляр BackupSystem"""
+    global _backup_system
+    if _backup_system is None:
+        with _backup_system_lock:
+            if _backup_system is None:
+                _backup_system = BackupSystem()
+    return _backup_system
+
+
+def __getattr__(name: str):
+    # Совместимость: from backup_system import backup_system
+    if name == "backup_system":
+        return get_backup_system()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming Chunker
+Потоковая нарезка текста на чанки по границам предложений и абзацев
+с бюджетом токенов под max_seq_length модели эмбеддингов
+"""
+import re
+from typing import Callable, Iterable, Iterator, List, Tuple, Union
+
+# max_seq_length paraphrase-multilingual-MiniLM-L12-v2
+DEFAULT_MAX_TOKENS = 128
+DEFAULT_OVERLAP_TOKENS = 32
+MIN_CHUNK_CHARS = 50
+# Поток без пустых строк режется на «абзацы» не длиннее этого (буфер ограничен)
+MAX_PARAGRAPH_CHARS = 20000
+
+_PARAGRAPH_SPLIT = re.compile(r"\n\s*\n")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?…])\s+")
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Грубая оценка числа токенов без токенизатора
+
+    Слова многоязычного sentencepiece-словаря в среднем дробятся на 1-2 части,
+    поэтому оценка берётся с запасом (+2 служебных токена).
+    """
+    return int(len(_TOKEN_PATTERN.findall(text)) * 1.6) + 2
+
+
+def _soft_cut(text: str, start: int, max_chars: int) -> int:
+    """Позиция разреза не дальше start + max_chars: после предложения, иначе по пробелу"""
+    end = start + max_chars
+    for boundary in (". ", "\n", " "):
+        cut = text.rfind(boundary, start, end)
+        if cut > start:
+            return cut + len(boundary)
+    return end
+
+
+def _iter_paragraphs(
+    source: Union[str, Iterable[str]],
+    max_chars: int = MAX_PARAGRAPH_CHARS
+) -> Iterator[str]:
+    """
+    Абзацы из строки или из потока кусков текста
+
+    Разделитель ищется только в дописанном хвосте буфера, а буфер без пустых строк
+    режется при max_chars — время линейно, память ограничена.
+    """
+    pieces = [source] if isinstance(source, str) else source
+    buffer = ""
+    for piece in pieces:
+        # Разделитель может начаться в пробелах на конце прежнего буфера
+        scan = len(buffer.rstrip())
+        buffer += piece
+        start = 0
+
+        while True:
+            match = _PARAGRAPH_SPLIT.search(buffer, scan)
+            if match is None:
+                break
+            paragraph = buffer[start:match.start()].strip()
+            if paragraph:
+                yield paragraph
+            start = scan = match.end()
+
+        while len(buffer) - start > max_chars:
+            cut = _soft_cut(buffer, start, max_chars)
+            paragraph = buffer[start:cut].strip()
+            if paragraph:
+                yield paragraph
+            start = cut
+
+        buffer = buffer[start:]
+
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def _split_long(sentence: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    """Предложение длиннее бюджета режется по словам"""
+    pieces, current = [], []
+    for word in sentence.split():
+        candidate = " ".join(current + [word])
+        if current and count_tokens(candidate) > max_tokens:
+            pieces.append(" ".join(current))
+            current = [word]
+        else:
+            current.append(word)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def iter_chunks(
+    source: Union[str, Iterable[str]],
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+    count_tokens: Callable[[str], int] = estimate_tokens,
+    min_chars: int = MIN_CHUNK_CHARS
+) -> Iterator[Tuple[int, str]]:
+    """
+    Генератор чанков [(chunk_id, chunk), ...]
+
+    source — строка или итератор кусков текста (например, поток из файла/HTTP).
+    Чанк не превышает max_tokens, соседние чанки перекрываются
+    последними предложениями суммарно до overlap_tokens.
+    Конец абзаца закрывает чанк, если он заполнен хотя бы наполовину.
+    """
+    chunk_id = 0
+    units: List[Tuple[str, int]] = []  # (предложение, токены)
+    used = 0
+    fresh = False  # есть ли в буфере что-то кроме перекрытия
+
+    def flush() -> Iterator[Tuple[int, str]]:
+        nonlocal chunk_id, units, used, fresh
+        fresh = False
+        text = " ".join(u for u, _ in units).strip()
+        if len(text) >= min_chars:
+            yield chunk_id, text
+        chunk_id += 1
+
+        # Перекрытие: хвост из последних предложений
+        tail, tail_tokens = [], 0
+        for unit, tokens in reversed(units):
+            if tail_tokens + tokens > overlap_tokens:
+                break
+            tail.insert(0, (unit, tokens))
+            tail_tokens += tokens
+        units, used = tail, tail_tokens
+
+    for paragraph in _iter_paragraphs(source):
+        for sentence in _SENTENCE_SPLIT.split(paragraph):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+
+            tokens = count_tokens(sentence)
+            parts = (
+                [(sentence, tokens)] if tokens <= max_tokens
+                else [(p, count_tokens(p)) for p in _split_long(sentence, max_tokens, count_tokens)]
+            )
+
+            for part, part_tokens in parts:
+                if units and used + part_tokens > max_tokens:
+                    yield from flush()
+                    # Перекрытие не должно вытеснять новое предложение
+                    while units and used + part_tokens > max_tokens:
+                        used -= units.pop(0)[1]
+                units.append((part, part_tokens))
+                used += part_tokens
+                fresh = True
+
+        # Граница абзаца
+        if fresh and used >= max_tokens // 2:
+            yield from flush()
+            units, used = [], 0
+
+    if fresh:
+        text = " ".join(u for u, _ in units).strip()
+        if len(text) >= min_chars:
+            yield chunk_id, text
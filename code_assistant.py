@@ -20,8 +20,20 @@ logger = logging.getLogger(__name__)
 
 # ======================== тОНФИГУРАЦИЯ =========================
 
-CODE_SANDBOX_DIR = Path("/app/sandbox")
-CODE_SANDBOX_DIR.mkdir(parents=True, exist_ok=True)
+_SANDBOX_PATH = Path("/app/sandbox")
+
+
+def get_sandbox_dir() -> Path:
+    """Каталог песочницы создаётся при первом использовании, а не при импорте"""
+    _SANDBOX_PATH.mkdir(parents=True, exist_ok=True)
+    return _SANDBOX_PATH
+
+
+def __getattr__(name: str):
+    # Совместимость: CODE_SANDBOX_DIR — каталог, созданный при первом обращении
+    if name == "CODE_SANDBOX_DIR":
+        return get_sandbox_dir()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Разрешённый импорты (whitelist)
 ALLOWED_IMPORTS = {
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+Async Training Crawler
+Асинхронный краулер для ночного обучения:
+общий лимит параллелизма, вежливость по хостам, персистентная очередь
+и конвейер producer/consumer в батчевый эмбеддинг
+"""
+import asyncio
+import logging
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse, unquote
+
+logger = logging.getLogger(__name__)
+
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+USER_AGENT = "II-Agent-Trainer/1.0 (night training crawler)"
+
+# Ссылки на статьи Википедии (без служебных пространств имён)
+_WIKI_LINK = re.compile(r'href="(/wiki/[^":#?]+)"')
+
+
+@dataclass
+class CrawlerConfig:
+    """Настройки краулера: пропускная способность задаётся вежливостью"""
+    concurrency: int = 8            # глобальный лимит одновременных запросов
+    per_host_concurrency: int = 2   # одновременных запросов к одному хосту
+    per_host_delay: float = 1.0     # минимальный интервал между запросами к хосту (сек)
+    max_depth: int = 1              # глубина обхода найденных ссылок
+    embed_seeds: bool = True        # False — со стартовых страниц берутся только ссылки
+    max_links_per_page: int = 10
+    request_timeout: float = 20.0
+    max_attempts: int = 3
+    embed_batch_docs: int = 16      # документов в одном батче эмбеддинга
+    result_queue_size: int = 64     # backpressure между загрузкой и эмбеддингом
+
+
+class CrawlQueue:
+    """Персистентная очередь URL в knowledge.db"""
+
+    def __init__(self, db):
+        self.db = db
+        with self.db.transaction() as cursor:
+            self.create_tables(cursor)
+            # Задачи, прерванные перезапуском, возвращаются в очередь
+            cursor.execute("UPDATE crawl_queue SET status = 'pending' WHERE status = 'in_progress'")
+
+    @staticmethod
+    def create_tables(cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS crawl_queue (
+                url TEXT PRIMARY KEY,
+                topic VARCHAR(200),
+                depth INTEGER DEFAULT 0,
+                status VARCHAR(20) DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP
+            )
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_crawl_queue_status ON crawl_queue(status, depth)"
+        )
+
+    def push(self, items: List[Tuple[str, str, int]]) -> int:
+        """Добавить (url, topic, depth); известные URL игнорируются"""
+        if not items:
+            return 0
+        with self.db.transaction() as cursor:
+            before = cursor.execute("SELECT COUNT(*) FROM crawl_queue").fetchone()[0]
+            cursor.executemany(
+                "INSERT OR IGNORE INTO crawl_queue (url, topic, depth) VALUES (?, ?, ?)",
+                items
+            )
+            after = cursor.execute("SELECT COUNT(*) FROM crawl_queue").fetchone()[0]
+        return after - before
+
+    def requeue_done(self, urls: List[str]):
+        """Повторный обход уже пройденных URL (новая ночь — свежие версии)"""
+        with self.db.transaction() as cursor:
+            cursor.executemany(
+                "UPDATE crawl_queue SET status = 'pending', attempts = 0 "
+                "WHERE url = ? AND status IN ('done', 'failed')",
+                [(url,) for url in urls]
+            )
+
+    def take(self, limit: int) -> List[Tuple[str, str, int]]:
+        """Забрать пачку задач (сначала мелкая глубина)"""
+        with self.db.transaction() as cursor:
+            rows = cursor.execute("""
+                SELECT url, topic, depth FROM crawl_queue
+                WHERE status = 'pending'
+                ORDER BY depth, added_at
+                LIMIT ?
+            """, (limit,)).fetchall()
+            cursor.executemany(
+                "UPDATE crawl_queue SET status = 'in_progress', updated_at = ? WHERE url = ?",
+                [(datetime.now(), url) for url, _, _ in rows]
+            )
+        return rows
+
+    def finish(self, url: str, ok: bool, max_attempts: int):
+        with self.db.transaction() as cursor:
+            if ok:
+                cursor.execute(
+                    "UPDATE crawl_queue SET status = 'done', updated_at = ? WHERE url = ?",
+                    (datetime.now(), url)
+                )
+            else:
+                cursor.execute("""
+                    UPDATE crawl_queue
+                    SET attempts = attempts + 1, updated_at = ?,
+                        status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END
+                    WHERE url = ?
+                """, (datetime.now(), max_attempts, url))
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.db.query_all("SELECT status, COUNT(*) FROM crawl_queue GROUP BY status"))
+
+
+class _HostLimiter:
+    """Вежливость: лимит параллелизма и минимальный интервал на хост"""
+
+    def __init__(self, concurrency: int, delay: float):
+        self.concurrency = concurrency
+        self.delay = delay
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._next_slot: Dict[str, float] = {}
+
+    async def acquire(self, host: str):
+        semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self.concurrency))
+        await semaphore.acquire()
+
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            now = time.monotonic()
+            wait = self._next_slot.get(host, now) - now
+            self._next_slot[host] = max(now, self._next_slot.get(host, now)) + self.delay
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def release(self, host: str):
+        self._semaphores[host].release()
+
+
+class AsyncCrawler:
+    """Конвейер: очередь URL -> загрузка (asyncio) -> батчевый эмбеддинг"""
+
+    def __init__(self, rag, config: Optional[CrawlerConfig] = None):
+        self.rag = rag
+        self.config = config or CrawlerConfig()
+        self.queue = CrawlQueue(rag.db)
+        self.stats = {
+            "fetched": 0,
+            "failed": 0,
+            "documents_added": 0,
+            "links_discovered": 0,
+            "bytes": 0,
+        }
+        # URL -> сколько новых документов дала страница (0 — дубликат уже сохранённого)
+        self.documents_by_url: Dict[str, int] = {}
+
+    def seed_topics(self, topics: List[str], lang: str = "ru"):
+        """Стартовые темы — статьи Википедии"""
+        items = [(f"https://{lang}.wikipedia.org/wiki/{topic}", topic, 0) for topic in topics]
+        added = self.queue.push(items)
+        self.queue.requeue_done([url for url, _, _ in items])
+        return added
+
+    async def run(self, deadline: float, should_continue=lambda: True) -> Dict[str, Any]:
+        """Обход до дедлайна (time.time()) или пока не кончится очередь"""
+        if not AIOHTTP_AVAILABLE:
+            raise RuntimeError("aiohttp is not installed")
+
+        started = time.time()
+        results: asyncio.Queue = asyncio.Queue(maxsize=self.config.result_queue_size)
+        global_limit = asyncio.Semaphore(self.config.concurrency)
+        hosts = _HostLimiter(self.config.per_host_concurrency, self.config.per_host_delay)
+
+        timeout = aiohttp.ClientTimeout(total=self.config.request_timeout)
+        async with aiohttp.ClientSession(timeout=timeout, headers={"User-Agent": USER_AGENT}) as session:
+            consumer = asyncio.create_task(self._embed_worker(results))
+            in_flight = set()
+
+            while time.time() < deadline and should_continue():
+                free = self.config.concurrency * 2 - len(in_flight)
+                batch = await self._queue_call(self.queue.take, free) if free > 0 else []
+
+                if not batch and not in_flight:
+                    break  # очередь пуста
+
+                for url, topic, depth in batch:
+                    task = asyncio.create_task(
+                        self._process(session, global_limit, hosts, results, url, topic, depth)
+                    )
+                    in_flight.add(task)
+
+                if in_flight:
+                    done, in_flight = await asyncio.wait(
+                        in_flight, timeout=1.0, return_when=asyncio.FIRST_COMPLETED
+                    )
+
+            # Остановка: незавершённые задачи остаются in_progress
+            # и возвращаются в очередь при следующем старте без траты попытки
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+            await results.put(None)
+            await consumer
+
+        elapsed = max(time.time() - started, 1e-6)
+        return dict(
+            self.stats,
+            seconds=round(elapsed, 1),
+            pages_per_minute=round(self.stats["fetched"] * 60 / elapsed, 2),
+            documents_by_url=dict(self.documents_by_url),
+            queue=await self._queue_call(self.queue.get_stats)
+        )
+
+    async def _queue_call(self, method, *args):
+        """Вызов CrawlQueue в пуле потоков: BEGIN IMMEDIATE не должен блокировать цикл событий"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, method, *args)
+
+    async def _process(self, session, global_limit, hosts, results, url: str, topic: str, depth: int):
+        host = urlparse(url).netloc
+        ok = False
+        try:
+            async with global_limit:
+                await hosts.acquire(host)
+                try:
+                    async with session.get(url) as response:
+                        if response.status != 200:
+                            raise RuntimeError(f"HTTP {response.status}")
+                        html = await response.text()
+                finally:
+                    hosts.release(host)
+
+            self.stats["fetched"] += 1
+            self.stats["bytes"] += len(html)
+
+            # Разбор HTML — в пуле потоков, чтобы не блокировать цикл событий
+            text = None
+            if depth > 0 or self.config.embed_seeds:
+                loop = asyncio.get_running_loop()
+                text = await loop.run_in_executor(None, self.rag.extract_paragraphs, html)
+
+            if depth < self.config.max_depth:
+                links = self._discover_links(url, html, depth + 1)
+                self.stats["links_discovered"] += await self._queue_call(self.queue.push, links)
+
+            if text and len(text) >= 100:
+                # Backpressure: ждём, если эмбеддинг не успевает
+                await results.put({
+                    "url": url,
+                    "content": text,
+                    "source": "wikipedia",
+                    "topic": topic,
+                    "content_type": "article"
+                })
+            ok = True
+        except asyncio.CancelledError:
+            # Остановка по дедлайну — не неудачная попытка
+            raise
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.warning(f"Crawl failed for {url}: {e}")
+
+        await self._queue_call(self.queue.finish, url, ok, self.config.max_attempts)
+
+    def _discover_links(self, url: str, html: str, depth: int) -> List[Tuple[str, str, int]]:
+        links, seen = [], set()
+        for path in _WIKI_LINK.findall(html):
+            if path in seen:
+                continue
+            seen.add(path)
+            topic = unquote(path[len("/wiki/"):])
+            links.append((urljoin(url, path), topic, depth))
+            if len(links) >= self.config.max_links_per_page:
+                break
+        return links
+
+    async def _embed_worker(self, results: asyncio.Queue):
+        """Потребитель: собирает документы в батчи и отдаёт в add_training_batch"""
+        loop = asyncio.get_running_loop()
+        batch = []
+        finished = False
+
+        while not finished:
+            item = await results.get()
+            if item is None:
+                finished = True
+            else:
+                batch.append(item)
+                # Добираем всё, что уже готово, до размера батча
+                while len(batch) < self.config.embed_batch_docs and not results.empty():
+                    item = results.get_nowait()
+                    if item is None:
+                        finished = True
+                        break
+                    batch.append(item)
+
+            if batch:
+                documents, batch = batch, []
+                try:
+                    flags = await loop.run_in_executor(None, self.rag.add_training_batch, documents)
+                    for document, added in zip(documents, flags):
+                        self.documents_by_url[document["url"]] = int(added)
+                    self.stats["documents_added"] += sum(flags)
+                except Exception as e:
+                    logger.error(f"Crawler embedding batch failed: {e}")
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Near-Duplicate Detection
+Поиск точных и почти-дубликатов (SHA-256 + SimHash) до эмбеддинга
+"""
+import hashlib
+import logging
+import re
+import unicodedata
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Почти-дубликат: расстояние Хэмминга SimHash не больше порога (из 64 бит)
+SIMHASH_MAX_DISTANCE = 3
+# 4 полосы по 16 бит: при расстоянии <= 3 хотя бы одна полоса совпадает
+SIMHASH_BANDS = 4
+SHINGLE_SIZE = 3
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация для сравнения: NFKC, без регистра и различий в пробелах"""
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def content_hash(text: str) -> str:
+    """SHA-256 нормализованного текста"""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def simhash(text: str) -> int:
+    """64-битный SimHash по словесным шинглам"""
+    words = re.findall(r"\w+", normalize_text(text))
+    if not words:
+        return 0
+
+    shingles = (
+        [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+        if len(words) >= SHINGLE_SIZE else [" ".join(words)]
+    )
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+         for s in shingles],
+        dtype=np.uint64
+    )
+
+    # Голосование по каждому биту
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(hashes)
+    fingerprint = np.packbits(votes > 0, bitorder="little").view(np.uint64)[0]
+    return int(fingerprint)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _to_signed(value: int) -> int:
+    """uint64 -> int64 для хранения в SQLite"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _bands(fingerprint: int) -> List[int]:
+    width = 64 // SIMHASH_BANDS
+    mask = (1 << width) - 1
+    return [(fingerprint >> (i * width)) & mask for i in range(SIMHASH_BANDS)]
+
+
+class DuplicateDetector:
+    """Проверка и регистрация контента в таблицах knowledge.db"""
+
+    KINDS = ("document", "chunk")
+
+    @staticmethod
+    def create_tables(cursor):
+        """Таблицы хэшей и счётчиков дедупликации"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS content_hashes (
+                hash TEXT NOT NULL,
+                kind VARCHAR(20) NOT NULL,
+                ref_id INTEGER,
+                simhash INTEGER,
+                band0 INTEGER,
+                band1 INTEGER,
+                band2 INTEGER,
+                band3 INTEGER,
+                PRIMARY KEY (kind, hash)
+            )
+        """)
+        for band in range(SIMHASH_BANDS):
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_content_hashes_band{band} "
+                f"ON content_hashes(kind, band{band})"
+            )
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS dedup_stats (
+                kind VARCHAR(20) PRIMARY KEY,
+                seen INTEGER DEFAULT 0,
+                duplicates INTEGER DEFAULT 0
+            )
+        """)
+
+    def find_duplicate(
+        self,
+        cursor,
+        text: str,
+        kind: str,
+        exact_only: bool = False
+    ) -> Optional[Tuple[str, Optional[int]]]:
+        """
+        Поиск дубликата
+
+        Возвращает ("exact" | "near", ref_id) или None;
+        exact_only — только совпадение SHA-256, без SimHash.
+        """
+        row = cursor.execute(
+            "SELECT ref_id FROM content_hashes WHERE kind = ? AND hash = ?",
+            (kind, content_hash(text))
+        ).fetchone()
+        if row:
+            return "exact", row[0]
+        if exact_only:
+            return None
+
+        fingerprint = simhash(text)
+        bands = _bands(fingerprint)
+        where = " OR ".join(f"band{i} = ?" for i in range(SIMHASH_BANDS))
+        for ref_id, candidate in cursor.execute(
+            f"SELECT ref_id, simhash FROM content_hashes WHERE kind = ? AND ({where})",
+            (kind, *bands)
+        ):
+            if hamming(fingerprint, candidate & ((1 << 64) - 1)) <= SIMHASH_MAX_DISTANCE:
+                return "near", ref_id
+
+        return None
+
+    def register(self, cursor, text: str, kind: str, ref_id: Optional[int]):
+        """Запомнить уникальный контент"""
+        fingerprint = simhash(text)
+        cursor.execute("""
+            INSERT OR IGNORE INTO content_hashes
+            (hash, kind, ref_id, simhash, band0, band1, band2, band3)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (content_hash(text), kind, ref_id, _to_signed(fingerprint), *_bands(fingerprint)))
+
+    def count(self, cursor, kind: str, seen: int, duplicates: int):
+        """Обновление счётчиков в той же транзакции"""
+        cursor.execute("""
+            INSERT INTO dedup_stats (kind, seen, duplicates) VALUES (?, ?, ?)
+            ON CONFLICT(kind) DO UPDATE SET
+                seen = seen + excluded.seen,
+                duplicates = duplicates + excluded.duplicates
+        """, (kind, seen, duplicates))
+
+    def new_chunks(self, cursor, chunks: List[tuple]) -> List[tuple]:
+        """
+        Чанки, которых нет ни в базе, ни выше в списке (текст — последний элемент кортежа)
+
+        Ничего не регистрирует: хэши записываются register_chunks после вставки векторов.
+        """
+        unique = []
+        hashes, fingerprints = set(), []
+        for item in chunks:
+            chunk = item[-1]
+            digest, fingerprint = content_hash(chunk), simhash(chunk)
+            if digest in hashes or any(
+                hamming(fingerprint, other) <= SIMHASH_MAX_DISTANCE for other in fingerprints
+            ):
+                continue
+            if self.find_duplicate(cursor, chunk, "chunk"):
+                continue
+            hashes.add(digest)
+            fingerprints.append(fingerprint)
+            unique.append(item)
+        return unique
+
+    def register_chunks(self, cursor, chunks: List[Tuple[int, str]], seen: int):
+        """Регистрация проиндексированных чанков [(ref_id, chunk), ...] и счётчики"""
+        for ref_id, chunk in chunks:
+            self.register(cursor, chunk, "chunk", ref_id)
+        self.count(cursor, "chunk", seen, seen - len(chunks))
+
+    @staticmethod
+    def get_stats(db) -> Dict[str, Any]:
+        """Доля дубликатов по документам и чанкам"""
+        stats = {kind: {"seen": 0, "duplicates": 0, "ratio": 0} for kind in DuplicateDetector.KINDS}
+        for kind, seen, duplicates in db.query_all("SELECT kind, seen, duplicates FROM dedup_stats"):
+            stats[kind] = {
+                "seen": seen,
+                "duplicates": duplicates,
+                "ratio": round(duplicates / seen, 3) if seen else 0,
+            }
+        return stats
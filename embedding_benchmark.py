@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Embedding Backend Benchmark
+Сравнение бэкендов эмбеддера: PyTorch (SentenceTransformer) и ONNX Runtime (fp32 / int8)
+Задержка одиночного запроса, пропускная способность батчами, пиковая память процесса
+и совпадение векторов с PyTorch (косинус)
+
+Каждый бэкенд измеряется в отдельном процессе — память не смешивается.
+
+    python embedding_benchmark.py --export /app/data/onnx_minilm --quantize
+    python embedding_benchmark.py --onnx /app/data/onnx_minilm --texts 2000 --json
+"""
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import random
+import resource
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from onnx_embedder import OnnxEmbedder, compare_embeddings, export_onnx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+
+_WORDS = (
+    "данные модель система обучение поиск вектор текст запрос сеть алгоритм "
+    "память индекс страница статья история город язык наука структура время "
+    "python docker kubernetes database query cache server model training"
+).split()
+
+
+def make_texts(count: int, seed: int = 42) -> List[str]:
+    """Тексты разной длины: от запроса в несколько слов до чанка"""
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choice(_WORDS) for _ in range(rng.choice((4, 12, 40, 120))))
+        for _ in range(count)
+    ]
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss в Linux — килобайты
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _load(backend: str, model_name: str, onnx_path: Optional[str], threads: int):
+    if backend == "torch":
+        import torch
+        from sentence_transformers import SentenceTransformer
+        torch.set_num_threads(threads)
+        return SentenceTransformer(model_name, device="cpu")
+    return OnnxEmbedder(onnx_path, quantized=backend == "onnx-int8", threads=threads)
+
+
+def _measure(backend, model_name, onnx_path, texts, queries, batch_size, threads, results):
+    """Замеры одного бэкенда (в дочернем процессе)"""
+    try:
+        rss_before = _peak_rss_mb()
+        started = time.perf_counter()
+        model = _load(backend, model_name, onnx_path, threads)
+        load_sec = time.perf_counter() - started
+
+        encode = lambda batch, size: model.encode(
+            batch, batch_size=size, convert_to_numpy=True, show_progress_bar=False
+        )
+        encode(texts[:batch_size], batch_size)  # прогрев
+
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            encode([query], 1)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        embeddings = encode(texts, batch_size)
+        bulk_sec = max(time.perf_counter() - started, 1e-9)
+
+        results.put((backend, {
+            "load_sec": round(load_sec, 2),
+            "query_p50_ms": round(float(np.percentile(latencies, 50)), 2),
+            "query_p95_ms": round(float(np.percentile(latencies, 95)), 2),
+            "texts_per_sec": round(len(texts) / bulk_sec, 1),
+            "peak_rss_mb": round(_peak_rss_mb(), 1),
+            "model_rss_mb": round(_peak_rss_mb() - rss_before, 1),
+        }, np.asarray(embeddings, dtype=np.float32)))
+    except Exception as e:
+        results.put((backend, {"error": repr(e)}, None))
+
+
+def run_benchmark(
+    backends: List[str],
+    model_name: str = DEFAULT_MODEL,
+    onnx_path: Optional[str] = None,
+    texts: int = 1000,
+    queries: int = 100,
+    batch_size: int = 64,
+    threads: int = 4
+) -> Dict[str, Dict[str, Any]]:
+    """Замеры бэкендов; косинус с PyTorch, если он в списке"""
+    corpus = make_texts(texts)
+    query_texts = make_texts(queries, seed=7)
+    ctx = mp.get_context("spawn")
+    report, vectors = {}, {}
+
+    for backend in backends:
+        results = ctx.Queue()
+        process = ctx.Process(
+            target=_measure,
+            args=(backend, model_name, onnx_path, corpus, query_texts, batch_size, threads, results)
+        )
+        process.start()
+        name, row, embeddings = results.get()
+        process.join()
+
+        report[name] = row
+        if embeddings is not None:
+            vectors[name] = embeddings
+        logger.info(f"⏱️ {name}: {row}")
+
+    if "torch" in vectors:
+        for name, embeddings in vectors.items():
+            if name != "torch":
+                report[name]["vs_torch"] = compare_embeddings(vectors["torch"], embeddings)
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding backend benchmark")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--onnx", default=None, help="directory with the exported ONNX model")
+    parser.add_argument("--export", default=None, help="export --model to this directory first")
+    parser.add_argument("--quantize", action="store_true", help="also write an int8 model on export")
+    parser.add_argument("--backends", nargs="*", default=None,
+                        help="torch onnx onnx-int8 (default: all available)")
+    parser.add_argument("--texts", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.export:
+        export_onnx(args.model, args.export, quantize=args.quantize)
+        args.onnx = args.onnx or args.export
+
+    backends = args.backends
+    if backends is None:
+        backends = ["torch"]
+        if args.onnx:
+            backends.append("onnx")
+            try:
+                OnnxEmbedder._find_model_file(Path(args.onnx), True, None)
+                backends.append("onnx-int8")
+            except FileNotFoundError:
+                pass
+    if any(b.startswith("onnx") for b in backends) and not args.onnx:
+        parser.error("--onnx (or --export) is required for ONNX backends")
+
+    report = run_benchmark(
+        backends, args.model, args.onnx, args.texts, args.queries, args.batch_size, args.threads
+    )
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+
+    print(f"{args.texts} texts, {args.queries} queries, batch {args.batch_size}, {args.threads} threads")
+    print(f"{'backend':<10} {'load s':>7} {'p50 ms':>8} {'p95 ms':>8} {'texts/s':>9} {'RSS MB':>8} {'min cos':>8}")
+    for name, row in report.items():
+        if "error" in row:
+            print(f"{name:<10} {row['error']}")
+            continue
+        cosine = row.get("vs_torch", {}).get("min_cosine")
+        print(
+            f"{name:<10} {row['load_sec']:>7} {row['query_p50_ms']:>8} {row['query_p95_ms']:>8} "
+            f"{row['texts_per_sec']:>9} {row['peak_rss_mb']:>8} {'-' if cosine is None else cosine:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""
+Embedding Cache
+Кэш эмбеддингов запросов: LRU в памяти + опциональный уровень на диске
+Персистентный content-addressed кэш эмбеддингов (SQLite, float16)
+"""
+import hashlib
+import logging
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Set
+
+import numpy as np
+
+from sqlite_pool import SQLiteConnectionManager
+
+logger = logging.getLogger(__name__)
+
+# Отметки last_used копятся в памяти и пишутся пачкой:
+# чтение из кэша не берёт блокировку записи на каждое попадание
+TOUCH_BATCH = 2000
+TOUCH_INTERVAL = 60.0
+
+
+def normalize_text(text: str) -> str:
+    """
+    Нормализация текста для ключа кэша
+
+    Только NFC и крайние пробелы: токенизатор модели чувствителен к регистру
+    и пробелам, разные для него тексты не должны делить один вектор.
+    """
+    return unicodedata.normalize("NFC", text).strip()
+
+
+class PersistentEmbeddingCache:
+    """
+    Content-addressed кэш эмбеддингов на диске
+
+    Ключ: (модель, sha256 нормализованного текста), значение — float16 blob.
+    При превышении max_size_mb вытесняются давно не использованные записи
+    (last_used обновляется пачками, точность LRU — до TOUCH_INTERVAL).
+    """
+
+    def __init__(self, path: str, max_size_mb: float = 1024, dtype: str = "float16"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.dtype = np.dtype(dtype)
+
+        self.db = SQLiteConnectionManager(str(self.path), mmap_size=0)
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    hash BLOB NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used INTEGER NOT NULL,
+                    PRIMARY KEY (model, hash)
+                ) WITHOUT ROWID
+            """)
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)"
+            )
+
+        self._lock = threading.Lock()
+        self._size_bytes = self.db.query_one(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        )[0]
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "evictions": 0,
+            "touch_flushes": 0,
+        }
+        # Попадания, ещё не записанные в last_used: модель -> хэши
+        self._touched: Dict[str, Set[bytes]] = {}
+        self._touched_count = 0
+        self._touched_at = time.monotonic()
+
+    @staticmethod
+    def text_hash(text: str) -> bytes:
+        return hashlib.sha256(normalize_text(text).encode("utf-8")).digest()
+
+    def get_many(
+        self,
+        model_name: str,
+        texts: List[str],
+        count_stats: bool = True
+    ) -> List[Optional[np.ndarray]]:
+        """
+        Эмбеддинги из кэша (None для отсутствующих), в порядке texts
+
+        count_stats=False — обращение учитывает вызывающий (дисковый уровень кэша запросов).
+        """
+        hashes = [self.text_hash(t) for t in texts]
+        found: Dict[bytes, np.ndarray] = {}
+
+        unique = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique), 500):
+            part = unique[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            for key, blob in self.db.query_all(
+                f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                (model_name, *part)
+            ):
+                found[key] = np.frombuffer(blob, dtype=self.dtype).astype(np.float32)
+
+        # Отметка использования для вытеснения (отложенная)
+        if found:
+            self._touch(model_name, found.keys())
+
+        results = [found.get(h) for h in hashes]
+        if not count_stats:
+            return results
+
+        hits = sum(1 for r in results if r is not None)
+        with self._lock:
+            self.stats["hits"] += hits
+            self.stats["misses"] += len(results) - hits
+        return results
+
+    def _touch(self, model_name: str, keys):
+        with self._lock:
+            touched = self._touched.setdefault(model_name, set())
+            before = len(touched)
+            touched.update(keys)
+            self._touched_count += len(touched) - before
+            due = (
+                self._touched_count >= TOUCH_BATCH
+                or time.monotonic() - self._touched_at >= TOUCH_INTERVAL
+            )
+        if due:
+            self.flush_touches()
+
+    def flush_touches(self):
+        """Запись накопленных отметок last_used одной транзакцией"""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._touched_count = 0
+            self._touched_at = time.monotonic()
+        if not touched:
+            return
+
+        now = int(time.time())
+        try:
+            with self.db.transaction() as cursor:
+                for model_name, keys in touched.items():
+                    keys = list(keys)
+                    for start in range(0, len(keys), 500):
+                        part = keys[start:start + 500]
+                        placeholders = ",".join("?" * len(part))
+                        cursor.execute(
+                            f"UPDATE embeddings SET last_used = ? "
+                            f"WHERE model = ? AND hash IN ({placeholders})",
+                            (now, model_name, *part)
+                        )
+            with self._lock:
+                self.stats["touch_flushes"] += 1
+        except Exception as e:
+            logger.debug(f"Embedding cache touch error: {e}")
+
+    def put_many(self, model_name: str, texts: List[str], embeddings: np.ndarray):
+        """Сохранение эмбеддингов"""
+        if not texts:
+            return
+
+        now = int(time.time())
+        rows = [
+            (model_name, self.text_hash(t), np.asarray(e, dtype=self.dtype).tobytes(), now)
+            for t, e in zip(texts, embeddings)
+        ]
+
+        with self.db.transaction() as cursor:
+            cursor.executemany("""
+                INSERT OR IGNORE INTO embeddings (model, hash, vector, last_used)
+                VALUES (?, ?, ?, ?)
+            """, rows)
+            written = cursor.rowcount
+
+        with self._lock:
+            self.stats["writes"] += max(written, 0)
+            self._size_bytes += sum(len(r[2]) for r in rows[:max(written, 0)])
+            over_limit = self._size_bytes > self.max_bytes
+
+        if over_limit:
+            self.evict()
+
+    def evict(self, target_ratio: float = 0.9):
+        """Вытеснение давно не использованных записей до target_ratio от лимита"""
+        target = int(self.max_bytes * target_ratio)
+        removed = 0
+        # Недавние попадания не должны вытесняться как давно не использованные
+        self.flush_touches()
+
+        with self.db.transaction() as cursor:
+            size = cursor.execute(
+                "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            ).fetchone()[0]
+
+            while size > target:
+                batch = cursor.execute("""
+                    SELECT model, hash, LENGTH(vector) FROM embeddings
+                    ORDER BY last_used LIMIT 1000
+                """).fetchall()
+                if not batch:
+                    break
+
+                for model, key, length in batch:
+                    if size <= target:
+                        break
+                    cursor.execute(
+                        "DELETE FROM embeddings WHERE model = ? AND hash = ?", (model, key)
+                    )
+                    size -= length
+                    removed += 1
+
+        with self._lock:
+            self._size_bytes = size
+            self.stats["evictions"] += removed
+
+        logger.info(f"🧹 Embedding cache evicted {removed} entries")
+
+    def close(self):
+        """Запись отложенных отметок и закрытие соединений с базой кэша"""
+        self.flush_touches()
+        self.db.close_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit rate и размер кэша"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["size_mb"] = round(self._size_bytes / (1024 * 1024), 2)
+
+        stats["max_size_mb"] = round(self.max_bytes / (1024 * 1024), 2)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0
+        return stats
+
+
+class QueryEmbeddingCache:
+    """Потокобезопасный LRU эмбеддингов запросов"""
+
+    def __init__(
+        self,
+        max_size: int = 10000,
+        disk_store: Optional[PersistentEmbeddingCache] = None
+    ):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "disk_hits": 0,
+        }
+
+        # Уровень на диске (переживает перезапуск)
+        self.disk_store = disk_store
+
+    @staticmethod
+    def make_key(query: str, model_name: str) -> str:
+        """Ключ: модель + нормализованный текст запроса"""
+        normalized = normalize_text(query)
+        return hashlib.sha1(f"{model_name}\x00{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, query: str, model_name: str) -> Optional[np.ndarray]:
+        """Эмбеддинг из кэша или None"""
+        key = self.make_key(query, model_name)
+
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return embedding
+
+        embedding = self._disk_get(query, model_name)
+        if embedding is not None:
+            self._put_memory(key, embedding)
+            with self._lock:
+                self.stats["hits"] += 1
+                self.stats["disk_hits"] += 1
+            return embedding
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, query: str, model_name: str, embedding: np.ndarray):
+        """Сохранить эмбеддинг запроса"""
+        key = self.make_key(query, model_name)
+        embedding = np.asarray(embedding, dtype=np.float32)
+        embedding.setflags(write=False)
+
+        self._put_memory(key, embedding)
+        self._disk_put(query, model_name, embedding)
+
+    def _put_memory(self, key: str, embedding: np.ndarray):
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def _disk_get(self, query: str, model_name: str) -> Optional[np.ndarray]:
+        if self.disk_store is None:
+            return None
+        try:
+            # Попадания и промахи учитываются в счётчиках кэша запросов, а не дискового
+            embedding = self.disk_store.get_many(model_name, [query], count_stats=False)[0]
+            if embedding is not None:
+                embedding.setflags(write=False)
+            return embedding
+        except Exception as e:
+            logger.debug(f"Query cache disk read error: {e}")
+        return None
+
+    def _disk_put(self, query: str, model_name: str, embedding: np.ndarray):
+        if self.disk_store is None:
+            return
+        try:
+            self.disk_store.put_many(model_name, [query], embedding.reshape(1, -1))
+        except Exception as e:
+            logger.debug(f"Query cache disk write error: {e}")
+
+    def clear(self):
+        """Очистка кэша в памяти"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика hit/miss/eviction"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["size"] = len(self._entries)
+
+        stats["max_size"] = self.max_size
+        stats["disk_enabled"] = self.disk_store is not None
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0
+        return stats
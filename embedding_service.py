@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+"""
+Embedding Service
+Пул процессов-энкодеров: каждый процесс держит свою копию модели
+и свой PyTorch-контекст, результаты возвращаются через shared memory.
+Запросы параллельных вызывающих склеиваются в общие батчи;
+у поисковых запросов отдельная очередь и зарезервированные процессы.
+"""
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Any, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+LANES = ("query", "bulk")
+
+
+def load_sentence_transformer(model_name: str, device: str = "cpu"):
+    """Загрузчик модели по умолчанию (выполняется в процессе-энкодере)"""
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name, device=device)
+
+
+def _worker_main(
+    index: int,
+    loader: Callable,
+    model_name: str,
+    device: str,
+    threads: int,
+    batch_size: int,
+    tasks,
+    results
+):
+    """Процесс-энкодер: загрузка модели, затем цикл encode -> shared memory"""
+    # Число потоков BLAS/OpenMP фиксируется до импорта torch
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    try:
+        model = loader(model_name, device)
+        dim = model.get_sentence_embedding_dimension()
+    except Exception as e:
+        results.put(("failed", index, repr(e)))
+        return
+
+    results.put(("ready", index, dim))
+    shm, out = None, None
+
+    while True:
+        message = tasks.get()
+        if message is None:
+            break
+
+        if message[0] == "shm":
+            shm = shared_memory.SharedMemory(name=message[1])
+            out = np.ndarray((message[2], dim), dtype=np.float32, buffer=shm.buf)
+            continue
+
+        _, job_id, texts = message
+        try:
+            out[:len(texts)] = model.encode(
+                texts,
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+            results.put(("done", index, job_id, len(texts)))
+        except Exception as e:
+            results.put(("error", index, job_id, repr(e)))
+
+    if shm is not None:
+        del out
+        shm.close()
+
+
+class _Request:
+    """Вызов encode(): собирается из кусков, выполненных разными процессами"""
+
+    __slots__ = ("future", "lane", "size", "remaining", "result", "submitted")
+
+    def __init__(self, lane: str, size: int):
+        self.future: Future = Future()
+        self.lane = lane
+        self.size = size
+        self.remaining = size
+        self.result: Optional[np.ndarray] = None
+        self.submitted = time.perf_counter()
+
+
+class _Worker:
+    __slots__ = ("index", "process", "tasks", "shm", "view", "state", "job")
+
+    def __init__(self, index: int, process, tasks):
+        self.index = index
+        self.process = process
+        self.tasks = tasks
+        self.shm: Optional[shared_memory.SharedMemory] = None
+        self.view: Optional[np.ndarray] = None
+        self.state = "loading"  # loading | idle | busy | dead
+        self.job: Optional[int] = None
+
+
+class EmbeddingService:
+    """
+    Пул процессов-энкодеров с объединением батчей и быстрой полосой запросов
+
+    workers           — число процессов (каждый со своей копией модели)
+    threads_per_worker — потоков PyTorch на процесс (workers * threads ≈ ядра)
+    query_workers     — процессы, зарезервированные под поисковые запросы
+    max_batch         — предел текстов в одной задаче процесса (размер shared memory)
+    coalesce_ms       — сколько копить мелкие bulk-запросы в общий батч
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        workers: int = 2,
+        threads_per_worker: int = 1,
+        query_workers: int = 1,
+        max_batch: int = 256,
+        batch_size: int = 64,
+        coalesce_ms: float = 5.0,
+        device: str = "cpu",
+        loader: Callable = load_sentence_transformer
+    ):
+        self.model_name = model_name
+        self.workers_count = max(workers, 1)
+        self.threads_per_worker = threads_per_worker
+        # Хотя бы один процесс остаётся под bulk
+        self.query_workers = max(min(query_workers, self.workers_count - 1), 0)
+        self.max_batch = max_batch
+        self.batch_size = batch_size
+        self.coalesce = coalesce_ms / 1000.0
+        self.device = device
+        self.loader = loader
+
+        self._ctx = mp.get_context("spawn")
+        self._results = None
+        self._workers: List[_Worker] = []
+        self._cond = threading.Condition()
+        self._pending: Dict[str, deque] = {lane: deque() for lane in LANES}
+        self._jobs: Dict[int, tuple] = {}
+        self._job_ids = itertools.count()
+        self._closed = False
+        self.dim: Optional[int] = None
+
+        self.stats = {
+            lane: {"requests": 0, "texts": 0, "jobs": 0, "seconds": 0.0}
+            for lane in LANES
+        }
+        self.stats["coalesced_requests"] = 0
+        self.stats["errors"] = 0
+
+    # ==================== LIFECYCLE ====================
+
+    def start(self) -> "EmbeddingService":
+        """Запуск процессов (модели грузятся в фоне) и потоков диспетчера"""
+        self._results = self._ctx.Queue()
+        for index in range(self.workers_count):
+            tasks = self._ctx.Queue()
+            process = self._ctx.Process(
+                target=_worker_main,
+                args=(
+                    index, self.loader, self.model_name, self.device,
+                    self.threads_per_worker, self.batch_size, tasks, self._results
+                ),
+                name=f"rag-embed-{index}",
+                daemon=True
+            )
+            process.start()
+            self._workers.append(_Worker(index, process, tasks))
+
+        threading.Thread(target=self._collect, name="rag-embed-collector", daemon=True).start()
+        threading.Thread(target=self._dispatch, name="rag-embed-dispatcher", daemon=True).start()
+        logger.info(
+            f"🧵 Embedding service: {self.workers_count} workers x {self.threads_per_worker} threads "
+            f"({self.query_workers} reserved for queries)"
+        )
+        return self
+
+    def close(self, timeout: float = 10):
+        """Остановка процессов и освобождение shared memory"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+
+        for worker in self._workers:
+            if worker.state != "dead":
+                worker.tasks.put(None)
+        for worker in self._workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            self._release(worker)
+
+        self._fail_all(RuntimeError("Embedding service closed"))
+
+    def _release(self, worker: _Worker):
+        if worker.shm is not None:
+            worker.view = None
+            worker.shm.close()
+            worker.shm.unlink()
+            worker.shm = None
+
+    def is_ready(self, lane: str = "bulk") -> bool:
+        """Есть загруженный процесс, который может взять задачу этой полосы"""
+        return any(
+            w.state in ("idle", "busy") and self._serves(w, lane) for w in self._workers
+        )
+
+    def _serves(self, worker: _Worker, lane: str) -> bool:
+        return lane == "query" or worker.index >= self.query_workers
+
+    # ==================== API ====================
+
+    def submit(self, texts: List[str], lane: str = "bulk") -> Future:
+        """Асинхронный encode: Future с матрицей (len(texts), dim) float32"""
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane: {lane}")
+
+        request = _Request(lane, len(texts))
+        if not texts:
+            request.future.set_result(np.zeros((0, self.dim or 0), dtype=np.float32))
+            return request.future
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Embedding service closed")
+            # Большой запрос режется на куски не больше max_batch
+            for offset in range(0, len(texts), self.max_batch):
+                self._pending[lane].append((request, offset, texts[offset:offset + self.max_batch]))
+            self.stats[lane]["requests"] += 1
+            self.stats[lane]["texts"] += len(texts)
+            self._cond.notify_all()
+
+        return request.future
+
+    def encode(self, texts: List[str], lane: str = "bulk", timeout: Optional[float] = None) -> np.ndarray:
+        """Синхронный encode через пул"""
+        return self.submit(texts, lane).result(timeout)
+
+    # ==================== DISPATCH ====================
+
+    def _dispatch(self):
+        """Диспетчер: сначала полоса запросов, затем bulk с ожиданием добора батча"""
+        with self._cond:
+            while not self._closed:
+                wait = None
+                for lane in LANES:
+                    pending = self._pending[lane]
+                    if not pending:
+                        continue
+
+                    worker = self._pick_worker(lane)
+                    if worker is None:
+                        continue
+
+                    # bulk: ждём, пока параллельные вызовы доберут батч
+                    if lane == "bulk":
+                        queued = sum(len(piece[2]) for piece in pending)
+                        age = time.perf_counter() - pending[0][0].submitted
+                        if queued < self.max_batch and age < self.coalesce:
+                            wait = self.coalesce - age
+                            continue
+
+                    self._send(worker, lane)
+                    break
+                else:
+                    self._cond.wait(wait)
+
+    def _pick_worker(self, lane: str) -> Optional[_Worker]:
+        """Свободный процесс: запросы — сначала зарезервированные, bulk — только свои"""
+        idle = [w for w in self._workers if w.state == "idle" and self._serves(w, lane)]
+        if not idle:
+            return None
+        return min(idle, key=lambda w: w.index) if lane == "query" else idle[0]
+
+    def _send(self, worker: _Worker, lane: str):
+        """Склейка кусков очереди в одну задачу (под _cond)"""
+        pending = self._pending[lane]
+        pieces, total, requests = [], 0, set()
+        while pending and total + len(pending[0][2]) <= self.max_batch:
+            piece = pending.popleft()
+            pieces.append(piece)
+            requests.add(id(piece[0]))
+            total += len(piece[2])
+
+        job_id = next(self._job_ids)
+        self._jobs[job_id] = (worker, lane, pieces, time.perf_counter())
+        worker.state, worker.job = "busy", job_id
+        self.stats[lane]["jobs"] += 1
+        self.stats["coalesced_requests"] += max(len(requests) - 1, 0)
+
+        worker.tasks.put(("encode", job_id, [text for piece in pieces for text in piece[2]]))
+
+    # ==================== RESULTS ====================
+
+    def _collect(self):
+        """Приём результатов: копия из shared memory в матрицы вызывающих"""
+        while not self._closed:
+            try:
+                message = self._results.get(timeout=0.5)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            except (EOFError, OSError):
+                break
+
+            kind, index = message[0], message[1]
+            worker = self._workers[index]
+
+            if kind == "ready":
+                self._attach(worker, message[2])
+            elif kind == "failed":
+                logger.error(f"Embedding worker {index} failed to load model: {message[2]}")
+                self._mark_dead(worker)
+            elif kind == "done":
+                self._complete(worker, message[2], message[3])
+            elif kind == "error":
+                self._fail_job(message[2], RuntimeError(message[3]))
+                with self._cond:
+                    worker.state, worker.job = "idle", None
+                    self._cond.notify_all()
+
+    def _attach(self, worker: _Worker, dim: int):
+        """Процесс загрузил модель: выделяем его буфер результатов"""
+        self.dim = dim
+        worker.shm = shared_memory.SharedMemory(create=True, size=self.max_batch * dim * 4)
+        worker.view = np.ndarray((self.max_batch, dim), dtype=np.float32, buffer=worker.shm.buf)
+        worker.tasks.put(("shm", worker.shm.name, self.max_batch))
+
+        with self._cond:
+            worker.state = "idle"
+            self._cond.notify_all()
+        logger.info(f"✅ Embedding worker {worker.index} ready (dim={dim})")
+
+    def _complete(self, worker: _Worker, job_id: int, count: int):
+        with self._cond:
+            job = self._jobs.pop(job_id, None)
+        if job is None or worker.view is None:
+            return
+        _, lane, pieces, started = job
+
+        # Буфер процесса переиспользуется: копируем до того, как отдать ему новую задачу
+        rows = np.array(worker.view[:count])
+        position = 0
+        for request, offset, texts in pieces:
+            if request.result is None:
+                request.result = np.empty((request.size, rows.shape[1]), dtype=np.float32)
+            request.result[offset:offset + len(texts)] = rows[position:position + len(texts)]
+            position += len(texts)
+            request.remaining -= len(texts)
+            if request.remaining == 0 and not request.future.done():
+                request.future.set_result(request.result)
+
+        with self._cond:
+            self.stats[lane]["seconds"] += time.perf_counter() - started
+            worker.state, worker.job = "idle", None
+            self._cond.notify_all()
+
+    def _fail_job(self, job_id: int, error: Exception):
+        with self._cond:
+            job = self._jobs.pop(job_id, None)
+            self.stats["errors"] += 1
+        if job is None:
+            return
+        for request, _, _ in job[2]:
+            if not request.future.done():
+                request.future.set_exception(error)
+
+    def _mark_dead(self, worker: _Worker):
+        with self._cond:
+            worker.state = "dead"
+            job = worker.job
+        if job is not None:
+            self._fail_job(job, RuntimeError(f"Embedding worker {worker.index} died"))
+        self._release(worker)
+
+        # Некому выполнять очередь — вызывающие не должны ждать вечно
+        if all(w.state == "dead" for w in self._workers):
+            self._fail_all(RuntimeError("No live embedding workers"))
+
+    def _check_workers(self):
+        for worker in self._workers:
+            if worker.state != "dead" and not worker.process.is_alive():
+                logger.error(f"Embedding worker {worker.index} exited (code {worker.process.exitcode})")
+                self._mark_dead(worker)
+
+    def _fail_all(self, error: Exception):
+        with self._cond:
+            pieces = [piece for lane in LANES for piece in self._pending[lane]]
+            for lane in LANES:
+                self._pending[lane].clear()
+            jobs = list(self._jobs)
+        for job_id in jobs:
+            self._fail_job(job_id, error)
+        for request, _, _ in pieces:
+            if not request.future.done():
+                request.future.set_exception(error)
+
+    # ==================== STATS ====================
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Очереди, состояния процессов, средний размер задачи по полосам"""
+        with self._cond:
+            stats: Dict[str, Any] = {
+                "model": self.model_name,
+                "workers": {w.index: w.state for w in self._workers},
+                "threads_per_worker": self.threads_per_worker,
+                "query_workers": self.query_workers,
+                "coalesced_requests": self.stats["coalesced_requests"],
+                "errors": self.stats["errors"],
+            }
+            for lane in LANES:
+                lane_stats = dict(self.stats[lane])
+                lane_stats["queued_texts"] = sum(len(piece[2]) for piece in self._pending[lane])
+                lane_stats["avg_job_texts"] = (
+                    round(lane_stats["texts"] / lane_stats["jobs"], 1) if lane_stats["jobs"] else 0
+                )
+                lane_stats["seconds"] = round(lane_stats["seconds"], 3)
+                stats[lane] = lane_stats
+        return stats
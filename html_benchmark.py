@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+HTML Extraction Benchmark
+Сравнение движков html_extract на корпусе HTML-фикстур:
+страниц в секунду и качество извлечения (token F1 к эталонному тексту)
+
+Фикстуры: <dir>/<name>.html и, если есть, эталон <dir>/<name>.txt;
+по умолчанию — небольшой корпус html_fixtures/ рядом с модулем
+
+    python html_benchmark.py --repeat 5 --json
+    python html_benchmark.py --fixtures /app/data/html_fixtures --synthetic 50            # офлайн-корпус
+    python html_benchmark.py --fixtures /app/data/html_fixtures --record Уфа Git Алгоритм # из MediaWiki API
+"""
+import argparse
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+from html_extract import available_extractors, get_extractor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FIXTURES_DIR = str(Path(__file__).parent / "html_fixtures")
+
+_WORDS = (
+    "данные модель система обучение поиск вектор текст запрос сеть алгоритм "
+    "память индекс страница статья история город язык наука структура время"
+).split()
+
+
+def load_fixtures(fixtures_dir: str) -> List[Tuple[str, str, Optional[str]]]:
+    """[(name, html, эталон | None), ...]"""
+    fixtures = []
+    for path in sorted(Path(fixtures_dir).glob("*.html")):
+        gold_path = path.with_suffix(".txt")
+        gold = gold_path.read_text(encoding="utf-8") if gold_path.exists() else None
+        fixtures.append((path.stem, path.read_text(encoding="utf-8"), gold))
+    return fixtures
+
+
+def make_synthetic_fixtures(fixtures_dir: str, count: int = 50, seed: int = 42) -> int:
+    """Страницы с навигацией, скриптами и подвалом вокруг известного текста статьи"""
+    rng = random.Random(seed)
+    out = Path(fixtures_dir)
+    out.mkdir(parents=True, exist_ok=True)
+
+    def sentence() -> str:
+        words = [rng.choice(_WORDS) for _ in range(rng.randint(8, 20))]
+        return " ".join(words).capitalize() + "."
+
+    for i in range(count):
+        paragraphs = [
+            " ".join(sentence() for _ in range(rng.randint(3, 8)))
+            for _ in range(rng.randint(5, 60))
+        ]
+        body = "\n".join(f"<p>{p}</p>" for p in paragraphs)
+        noise = "".join(
+            f"<li><a href='/wiki/{w}'>{w}</a></li>" for w in rng.sample(_WORDS, 10)
+        )
+        html = (
+            "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Fixture</title>"
+            f"<script>var data = {json.dumps(paragraphs[:2], ensure_ascii=False)};</script>"
+            "<style>p { margin: 0 }</style></head><body>"
+            f"<header><p>{sentence() * 4}</p></header>"
+            f"<nav><ul>{noise}</ul></nav>"
+            f"<div id='content'><h1>Статья {i}</h1>{body}</div>"
+            f"<footer><p>{sentence() * 4}</p></footer>"
+            "</body></html>"
+        )
+        (out / f"synthetic_{i:03d}.html").write_text(html, encoding="utf-8")
+        (out / f"synthetic_{i:03d}.txt").write_text("\n\n".join(paragraphs), encoding="utf-8")
+
+    return count
+
+
+def record_wikipedia(fixtures_dir: str, titles: List[str], lang: str = "ru") -> int:
+    """HTML страниц Википедии + эталонный plain-text из MediaWiki API"""
+    import requests
+    from wiki_api import USER_AGENT
+
+    out = Path(fixtures_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    headers = {"User-Agent": USER_AGENT}
+    saved = 0
+
+    for title in titles:
+        try:
+            html = requests.get(
+                f"https://{lang}.wikipedia.org/wiki/{title}", headers=headers, timeout=30
+            )
+            html.raise_for_status()
+            extract = requests.get(f"https://{lang}.wikipedia.org/w/api.php", params={
+                "action": "query", "format": "json", "formatversion": 2,
+                "prop": "extracts", "explaintext": 1, "redirects": 1, "titles": title,
+            }, headers=headers, timeout=30).json()
+            pages = extract.get("query", {}).get("pages", [])
+            gold = pages[0].get("extract") if pages else None
+        except Exception as e:
+            logger.error(f"Failed to record {title}: {e}")
+            continue
+
+        name = re.sub(r"[^\w.-]+", "_", title)
+        (out / f"{name}.html").write_text(html.text, encoding="utf-8")
+        if gold:
+            (out / f"{name}.txt").write_text(gold, encoding="utf-8")
+        saved += 1
+
+    return saved
+
+
+def _tokens(text: str) -> Counter:
+    return Counter(re.findall(r"\w+", text.lower()))
+
+
+def quality(extracted: Optional[str], gold: str) -> Dict[str, float]:
+    """Пословные precision / recall / F1 (мешок слов)"""
+    got, expected = _tokens(extracted or ""), _tokens(gold)
+    overlap = sum((got & expected).values())
+    precision = overlap / sum(got.values()) if got else 0.0
+    recall = overlap / sum(expected.values()) if expected else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+
+def run_benchmark(
+    fixtures: List[Tuple[str, str, Optional[str]]],
+    extractors: Optional[List[str]] = None,
+    repeat: int = 3
+) -> Dict[str, Dict[str, Any]]:
+    """Скорость и качество каждого движка"""
+    total_bytes = sum(len(html.encode("utf-8")) for _, html, _ in fixtures)
+    report = {}
+
+    for name in extractors or available_extractors():
+        extractor = get_extractor(name)
+        outputs = {}
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for fixture, html, _ in fixtures:
+                outputs[fixture] = extractor.extract(html)
+        elapsed = max(time.perf_counter() - started, 1e-9)
+
+        scored = [quality(outputs[f], gold) for f, _, gold in fixtures if gold]
+        pages = len(fixtures) * repeat
+        report[name] = {
+            "pages": pages,
+            "pages_per_sec": round(pages / elapsed, 1),
+            "mb_per_sec": round(total_bytes * repeat / elapsed / (1024 * 1024), 2),
+            "empty": sum(1 for text in outputs.values() if not text),
+            "precision": round(sum(s["precision"] for s in scored) / len(scored), 3) if scored else None,
+            "recall": round(sum(s["recall"] for s in scored) / len(scored), 3) if scored else None,
+            "f1": round(sum(s["f1"] for s in scored) / len(scored), 3) if scored else None,
+        }
+        logger.info(f"⏱️ {name}: {report[name]}")
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTML extraction benchmark")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES_DIR)
+    parser.add_argument("--extractors", nargs="*", default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="generate N synthetic fixtures before the run")
+    parser.add_argument("--record", nargs="*", default=None,
+                        help="download Wikipedia titles into the fixtures dir")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.synthetic:
+        make_synthetic_fixtures(args.fixtures, args.synthetic)
+    if args.record:
+        record_wikipedia(args.fixtures, args.record)
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        parser.error(f"no *.html fixtures in {args.fixtures} (use --synthetic or --record)")
+
+    report = run_benchmark(fixtures, args.extractors, args.repeat)
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+
+    print(f"{len(fixtures)} fixtures x {args.repeat} runs")
+    print(f"{'extractor':<12} {'pages/s':>9} {'MB/s':>7} {'empty':>6} {'prec':>6} {'recall':>7} {'F1':>6}")
+    for name, row in report.items():
+        fmt = lambda v: "-" if v is None else f"{v:.3f}"
+        print(
+            f"{name:<12} {row['pages_per_sec']:>9} {row['mb_per_sec']:>7} {row['empty']:>6} "
+            f"{fmt(row['precision']):>6} {fmt(row['recall']):>7} {fmt(row['f1']):>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+HTML Text Extraction
+Подключаемые движки извлечения текста из HTML:
+bs4 (исходный), lxml (потоковый разбор) и trafilatura
+"""
+import importlib.util
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+LXML_AVAILABLE = importlib.util.find_spec("lxml") is not None
+TRAFILATURA_AVAILABLE = importlib.util.find_spec("trafilatura") is not None
+
+# Служебные элементы, текст которых не нужен
+SKIP_TAGS = ("script", "style", "nav", "footer", "header")
+# Параграф короче — навигация, подписи и прочий шум
+MIN_PARAGRAPH_CHARS = 100
+
+HtmlSource = Union[str, bytes, Iterable[bytes], Iterable[str]]
+
+
+def _iter_pieces(source: HtmlSource) -> Iterator[Union[str, bytes]]:
+    if isinstance(source, (str, bytes)):
+        yield source
+    else:
+        yield from source
+
+
+def _join_source(source: HtmlSource) -> str:
+    pieces = list(_iter_pieces(source))
+    if pieces and isinstance(pieces[0], bytes):
+        return b"".join(pieces).decode("utf-8", errors="replace")
+    return "".join(pieces)
+
+
+class HTMLExtractor:
+    """Базовый движок: extract() — текст статьи, iter_paragraphs() — поток абзацев"""
+
+    name = "base"
+
+    def iter_paragraphs(self, source: HtmlSource) -> Iterator[str]:
+        raise NotImplementedError
+
+    def extract(self, source: HtmlSource) -> Optional[str]:
+        """Абзацы статьи через пустую строку (формат для чанкера)"""
+        text = "\n\n".join(self.iter_paragraphs(source))
+        return text if text else None
+
+
+class BeautifulSoupExtractor(HTMLExtractor):
+    """Исходный вариант: html.parser, весь документ в памяти"""
+
+    name = "bs4"
+
+    def iter_paragraphs(self, source: HtmlSource) -> Iterator[str]:
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(_join_source(source), "html.parser")
+
+        # Удаляем ненужные элементы
+        for tag in soup(list(SKIP_TAGS)):
+            tag.decompose()
+
+        for p in soup.find_all("p"):
+            text = p.get_text()
+            if len(text) > MIN_PARAGRAPH_CHARS:
+                yield text.strip()
+
+
+class LxmlExtractor(HTMLExtractor):
+    """
+    Потоковый разбор libxml2 (HTMLPullParser)
+
+    Документ подаётся кусками (например, response.iter_content()),
+    разобранные поддеревья сразу освобождаются — память не растёт
+    с размером страницы.
+    """
+
+    name = "lxml"
+
+    def __init__(self, encoding: str = "utf-8"):
+        # Кодировка байтового потока (без неё libxml2 по умолчанию берёт latin-1)
+        self.encoding = encoding
+
+    def iter_paragraphs(self, source: HtmlSource) -> Iterator[str]:
+        from lxml import etree
+
+        pieces = _iter_pieces(source)
+        first = next(pieces, None)
+        if first is None:
+            return
+
+        parser = etree.HTMLPullParser(
+            events=("start", "end"),
+            remove_comments=True,
+            encoding=self.encoding if isinstance(first, bytes) else None
+        )
+        skip_depth = 0
+        p_depth = 0
+
+        def drain() -> Iterator[str]:
+            nonlocal skip_depth, p_depth
+            for event, element in parser.read_events():
+                tag = element.tag if isinstance(element.tag, str) else ""
+
+                if event == "start":
+                    if tag in SKIP_TAGS:
+                        skip_depth += 1
+                    elif tag == "p":
+                        p_depth += 1
+                    continue
+
+                if tag in SKIP_TAGS:
+                    skip_depth -= 1
+                elif tag == "p":
+                    p_depth -= 1
+                    if skip_depth == 0:
+                        text = "".join(element.itertext())
+                        if len(text) > MIN_PARAGRAPH_CHARS:
+                            yield text.strip()
+
+                # Поддерево разобрано: освобождаем его и предыдущих соседей
+                if p_depth == 0:
+                    element.clear(keep_tail=True)
+                    parent = element.getparent()
+                    while parent is not None and element.getprevious() is not None:
+                        del parent[0]
+
+        parser.feed(first)
+        yield from drain()
+
+        for piece in pieces:
+            parser.feed(piece)
+            yield from drain()
+
+        parser.close()
+        yield from drain()
+
+
+class TrafilaturaExtractor(HTMLExtractor):
+    """trafilatura: выделение основного текста статьи без шаблонных блоков"""
+
+    name = "trafilatura"
+
+    def iter_paragraphs(self, source: HtmlSource) -> Iterator[str]:
+        import trafilatura
+
+        text = trafilatura.extract(
+            _join_source(source),
+            output_format="txt",
+            include_comments=False,
+            include_tables=False,
+        )
+        for line in (text or "").splitlines():
+            if line.strip():
+                yield line.strip()
+
+
+EXTRACTORS = {
+    BeautifulSoupExtractor.name: BeautifulSoupExtractor,
+    LxmlExtractor.name: LxmlExtractor,
+    TrafilaturaExtractor.name: TrafilaturaExtractor,
+}
+
+
+def available_extractors() -> List[str]:
+    """Движки, зависимости которых установлены"""
+    names = ["bs4"]
+    if LXML_AVAILABLE:
+        names.append("lxml")
+    if TRAFILATURA_AVAILABLE:
+        names.append("trafilatura")
+    return names
+
+
+def get_extractor(name: str = "auto") -> HTMLExtractor:
+    """Движок по имени; auto — lxml, если установлен, иначе bs4"""
+    if name == "auto":
+        name = "lxml" if LXML_AVAILABLE else "bs4"
+
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown HTML extractor: {name}")
+    if name not in available_extractors():
+        logger.warning(f"HTML extractor {name} is not installed, using bs4")
+        name = "bs4"
+
+    return EXTRACTORS[name]()
+
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+ONNX Embedder
+Бэкенд эмбеддингов на ONNX Runtime: экспортированная (опционально int8)
+версия той же модели sentence-transformers из локального каталога.
+Интерфейс совместим с SentenceTransformer в той части, которую использует RAG:
+encode(), tokenizer, max_seq_length, get_sentence_embedding_dimension()
+"""
+import importlib.util
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ONNX_AVAILABLE = (
+    importlib.util.find_spec("onnxruntime") is not None
+    and importlib.util.find_spec("transformers") is not None
+)
+
+# Имена файлов модели: свой экспорт (export_onnx), optimum и sentence-transformers
+ONNX_FILE_NAMES = {
+    False: ("model.onnx", "onnx/model.onnx"),
+    True: ("model_quantized.onnx", "onnx/model_quantized.onnx", "onnx/model_qint8_avx512_vnni.onnx"),
+}
+
+# Минимальный косинус с векторами PyTorch-модели, при котором индекс совместим
+DEFAULT_MIN_COSINE = 0.99
+
+# Фиксированные тексты для сверки ONNX с PyTorch, когда сверять с индексом нечего
+PROBE_TEXTS = (
+    "Как настроить виртуальное окружение Python?",
+    "USER: Почему падает сборка?\nASSISTANT: Не хватает зависимости в requirements.txt.",
+    "Уфа — город в России, столица Республики Башкортостан.",
+    "def add(a: int, b: int) -> int:\n    return a + b",
+    "SELECT id, name FROM users WHERE created_at > '2024-01-01' ORDER BY id",
+    "Git — распределённая система управления версиями.",
+    "The quick brown fox jumps over the lazy dog.",
+    "Ошибка: ModuleNotFoundError: No module named 'numpy'",
+)
+
+
+class OnnxEmbedder:
+    """Энкодер sentence-transformers поверх onnxruntime.InferenceSession"""
+
+    def __init__(
+        self,
+        model_path: str,
+        quantized: bool = False,
+        file_name: Optional[str] = None,
+        threads: Optional[int] = None,
+        max_seq_length: Optional[int] = None
+    ):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        path = Path(model_path)
+        self.model_file = path if path.is_file() else self._find_model_file(path, quantized, file_name)
+        self.path = self.model_file.parent if path.is_file() else path
+        self.quantized = quantized
+
+        self.tokenizer = AutoTokenizer.from_pretrained(str(self.path))
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # В процессе-энкодере число потоков задаёт OMP_NUM_THREADS (embedding_service)
+        threads = threads or int(os.environ.get("OMP_NUM_THREADS", 0))
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            str(self.model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+        # Настройки пулинга и длины — из каталога sentence-transformers
+        config = self._read_json("sentence_bert_config.json", {})
+        self.max_seq_length = max_seq_length or config.get("max_seq_length") or min(
+            getattr(self.tokenizer, "model_max_length", 512), 512
+        )
+        pooling = self._read_json("1_Pooling/config.json", {})
+        self.pooling = (
+            "cls" if pooling.get("pooling_mode_cls_token")
+            else "max" if pooling.get("pooling_mode_max_tokens")
+            else "mean"
+        )
+        self.normalize = any(
+            module.get("type", "").endswith("Normalize")
+            for module in self._read_json("modules.json", [])
+        )
+        self._dim: Optional[int] = None
+
+        logger.info(f"✅ ONNX embedder: {self.model_file.name} ({self.pooling} pooling)")
+
+    @staticmethod
+    def _find_model_file(path: Path, quantized: bool, file_name: Optional[str]) -> Path:
+        names = (file_name,) if file_name else ONNX_FILE_NAMES[quantized]
+        for name in names:
+            if (path / name).is_file():
+                return path / name
+        raise FileNotFoundError(f"No ONNX model {names} in {path}")
+
+    def _read_json(self, name: str, default: Any) -> Any:
+        file_path = self.path / name
+        if not file_path.is_file():
+            return default
+        return json.loads(file_path.read_text(encoding="utf-8"))
+
+    def get_sentence_embedding_dimension(self) -> int:
+        if self._dim is None:
+            self._dim = int(self.encode(["dimension probe"]).shape[1])
+        return self._dim
+
+    def _pool(self, hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        if hidden.ndim == 2:
+            # Модель экспортирована вместе с пулингом
+            return hidden
+        if self.pooling == "cls":
+            return hidden[:, 0]
+        mask = mask[:, :, None].astype(hidden.dtype)
+        if self.pooling == "max":
+            return np.where(mask > 0, hidden, -1e9).max(axis=1)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(
+        self,
+        sentences: Union[str, List[str]],
+        batch_size: int = 32,
+        convert_to_numpy: bool = True,
+        show_progress_bar: bool = False,
+        normalize_embeddings: bool = False,
+        **kwargs
+    ) -> np.ndarray:
+        """Эмбеддинги float32 (как SentenceTransformer.encode с convert_to_numpy)"""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self._dim or 0), dtype=np.float32)
+
+        # Батчи из текстов похожей длины — меньше паддинга
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        pooled = []
+        for start in range(0, len(texts), batch_size):
+            batch = [texts[i] for i in order[start:start + batch_size]]
+            encoded = self.tokenizer(
+                batch,
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np"
+            )
+            feed = {}
+            for name in self.input_names:
+                if name in encoded:
+                    feed[name] = encoded[name].astype(np.int64)
+                elif name == "token_type_ids":
+                    feed[name] = np.zeros_like(encoded["input_ids"], dtype=np.int64)
+            hidden = self.session.run(None, feed)[0]
+            pooled.append(self._pool(hidden, encoded["attention_mask"]))
+
+        embeddings = np.empty((len(texts), pooled[0].shape[1]), dtype=np.float32)
+        embeddings[order] = np.concatenate(pooled)
+
+        if self.normalize or normalize_embeddings:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+
+        self._dim = embeddings.shape[1]
+        return embeddings[0] if single else embeddings
+
+
+def load_onnx_embedder(
+    model_path: str,
+    quantized: bool,
+    model_name: str,
+    device: str = "cpu"
+) -> OnnxEmbedder:
+    """Загрузчик для процессов embedding_service (functools.partial по пути)"""
+    return OnnxEmbedder(model_path, quantized=quantized)
+
+
+def compare_embeddings(reference: np.ndarray, candidate: np.ndarray) -> Dict[str, Any]:
+    """Построчный косинус и максимальное расхождение двух наборов векторов"""
+    reference = np.asarray(reference, dtype=np.float32)
+    candidate = np.asarray(candidate, dtype=np.float32)
+    if reference.shape != candidate.shape:
+        return {"compatible": False, "reason": f"shape {candidate.shape} != {reference.shape}"}
+
+    cosine = (reference * candidate).sum(axis=1) / np.clip(
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1), 1e-12, None
+    )
+    return {
+        "samples": len(reference),
+        "min_cosine": round(float(cosine.min()), 5),
+        "mean_cosine": round(float(cosine.mean()), 5),
+        "max_abs_diff": round(float(np.abs(reference - candidate).max()), 5),
+    }
+
+
+def export_onnx(model_name: str, out_dir: str, quantize: bool = False, opset: int = 14) -> Path:
+    """
+    Экспорт трансформера SentenceTransformer в ONNX (+ int8 динамическое квантование)
+
+    В каталог пишутся model.onnx, токенизатор и конфиги пулинга sentence-transformers.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0].auto_model
+    transformer.config.return_dict = False
+    transformer.eval()
+
+    dummy = model.tokenizer(["пример текста"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    model_file = out / "model.onnx"
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(dummy[name] for name in input_names),
+            str(model_file),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+
+    model.tokenizer.save_pretrained(str(out))
+    (out / "sentence_bert_config.json").write_text(
+        json.dumps({"max_seq_length": model.max_seq_length}), encoding="utf-8"
+    )
+    (out / "1_Pooling").mkdir(exist_ok=True)
+    (out / "1_Pooling" / "config.json").write_text(
+        json.dumps(model[1].get_config_dict()), encoding="utf-8"
+    )
+    (out / "modules.json").write_text(json.dumps([
+        {"type": type(module).__module__ + "." + type(module).__name__} for module in model
+    ]), encoding="utf-8")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(str(model_file), str(out / "model_quantized.onnx"), weight_type=QuantType.QInt8)
+
+    logger.info(f"📦 Exported {model_name} to {out}")
+    return out
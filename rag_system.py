@@ -7,50 +7,205 @@ import logging
 import os
 import sqlite3
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Iterable, Iterator, Tuple, Union
 from datetime import datetime
 import json
 import time
+import importlib.util
+import functools
 import requests
-from bs4 import BeautifulSoup
 import threading
+import heapq
+import re
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from sqlite_pool import SQLiteConnectionManager
+from embedding_cache import QueryEmbeddingCache, PersistentEmbeddingCache
+from search_cache import SearchResultCache
+from search_filters import SearchFilters, apply_char_budget
+from onnx_embedder import (
+    OnnxEmbedder, ONNX_AVAILABLE, DEFAULT_MIN_COSINE, PROBE_TEXTS, compare_embeddings, load_onnx_embedder
+)
+from vector_index import NumpyVectorIndex, quantization_report
+from dedup import DuplicateDetector
+from html_extract import get_extractor
+from wiki_api import MediaWikiFetcher, DEFAULT_API_URL as WIKI_API_URL
+from reindex import ReindexJob
+from retention import RetentionPolicy, RetentionCompactor
+from write_behind import DialogueWriteBehind
+from training_scheduler import TrainingScheduler, ADDED, UNCHANGED, FAILED, LOW_VALUE
+from chunker import iter_chunks, estimate_tokens, DEFAULT_MAX_TOKENS, DEFAULT_OVERLAP_TOKENS
+
+if TYPE_CHECKING:
+    # Пул процессов (multiprocessing) импортируется только при embed_workers > 0
+    from embedding_service import EmbeddingService
 
 logger = logging.getLogger(__name__)
 
 # ChromaDB для векторного поиска
-try:
-    import chromadb
-    from chromadb.config import Settings
-    from sentence_transformers import SentenceTransformer
-    CHROMADB_AVAILABLE = True
-except ImportError:
+# (тяжёлые модули импортируются лениво, при создании системы)
+EMBEDDER_AVAILABLE = importlib.util.find_spec("sentence_transformers") is not None
+CHROMADB_INSTALLED = importlib.util.find_spec("chromadb") is not None
+CHROMADB_AVAILABLE = CHROMADB_INSTALLED and EMBEDDER_AVAILABLE
+if not CHROMADB_AVAILABLE:
     logger.warning("ChromaDB or SentenceTransformers not available")
-    CHROMADB_AVAILABLE = False
+
+# Асинхронный краулер ночного обучения (aiohttp)
+CRAWLER_AVAILABLE = importlib.util.find_spec("aiohttp") is not None
+
+# Модель эмбеддингов по умолчанию (смена модели — через start_reindex)
+DEFAULT_EMBEDDING_MODEL = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+
+# Маркер заглушки scrape_programming_content (реального контента нет)
+PLACEHOLDER_CONTENT = "(Content would be scraped from real sources)"
+
+# Логическое имя коллекции -> имя в векторном хранилище
+COLLECTION_NAMES = {
+    "dialogues": "user_dialogues",
+    "training": "training_knowledge",
+    "code": "code_examples",
+    "solutions": "solutions",
+}
 
 
 class UnifiedRAGSystem:
     """Единая система RAG: runtime + training"""
     
-    def __init__(self, data_dir: str = "/app/data"):
+    def __init__(
+        self,
+        data_dir: str = "/app/data",
+        embed_batch_size: int = 64,
+        chroma_batch_size: int = 5000,
+        query_cache_size: int = 10000,
+        query_cache_on_disk: bool = True,
+        result_cache_size: int = 2048,
+        embedding_cache_mb: float = 1024,
+        chunk_max_tokens: Optional[int] = None,
+        chunk_overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+        search_workers: int = 4,
+        warm_embedder: bool = True,
+        embed_workers: int = 0,
+        embed_worker_threads: int = 1,
+        embed_query_workers: int = 1,
+        embedder_backend: str = "torch",
+        onnx_model_path: Optional[str] = None,
+        onnx_quantized: bool = False,
+        onnx_min_cosine: float = DEFAULT_MIN_COSINE,
+        stats_refresh_interval: float = 60,
+        retention: Optional[RetentionPolicy] = None,
+        retention_interval: float = 3600,
+        dialogue_write_behind: bool = False,
+        write_behind_queue: int = 10000,
+        write_behind_batch: int = 64,
+        model_name: Optional[str] = None,
+        vector_backend: str = "auto",
+        vector_dtype: str = "float32",
+        vector_rescore: bool = False,
+        wiki_api_url: str = WIKI_API_URL,
+        html_extractor: str = "auto"
+    ):
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(exist_ok=True, parents=True)
         
+        # Размер батча для эмбеддингов и счётчики пропускной способности
+        self.embed_batch_size = embed_batch_size
+        self.embed_stats = {"chunks": 0, "seconds": 0.0}
+        self.chroma_batch_size = chroma_batch_size
+        
+        # Нарезка на чанки: бюджет токенов (по умолчанию max_seq_length модели)
+        self.chunk_max_tokens = chunk_max_tokens
+        self.chunk_overlap_tokens = chunk_overlap_tokens
+        
+        # Персистентный кэш эмбеддингов (модель + sha256 текста) перед каждым encode
+        self.model_name = model_name or DEFAULT_EMBEDDING_MODEL
+        self.embedding_cache = (
+            PersistentEmbeddingCache(
+                str(self.data_dir / "embedding_cache.db"),
+                max_size_mb=embedding_cache_mb
+            )
+            if embedding_cache_mb > 0 else None
+        )
+        
+        # Кэш эмбеддингов запросов (дисковый уровень — общий кэш эмбеддингов)
+        self.query_cache = QueryEmbeddingCache(
+            max_size=query_cache_size,
+            disk_store=self.embedding_cache if query_cache_on_disk else None
+        )
+        
+        # Кэш результатов поиска (инвалидируется поколениями коллекций)
+        self.search_cache = SearchResultCache(max_entries=result_cache_size)
+        
+        # Пул потоков для параллельного поиска по коллекциям
+        self.search_executor = ThreadPoolExecutor(
+            max_workers=search_workers,
+            thread_name_prefix="rag-search"
+        )
+        
         # SQLite для метаданных
         self.db_path = self.data_dir / "knowledge.db"
+        # Новая база сразу создаётся с incremental VACUUM (для компактора retention)
+        self.db = SQLiteConnectionManager(str(self.db_path), auto_vacuum="INCREMENTAL")
+        self.dedup = DuplicateDetector()
         self.init_sqlite()
         
-        # ChromaDB для векторного поиска
-        if CHROMADB_AVAILABLE:
-            self.chroma_path = self.data_dir / "chroma_db"
+        # Активные коллекции и модель (после переиндексации — теневые _v<job>)
+        self.collection_names = dict(COLLECTION_NAMES)
+        self._load_active_collections(model_name)
+        self.reindex_job: Optional[ReindexJob] = None
+        self._switch_lock = threading.Lock()
+        
+        # Эмбеддер загружается лениво / в фоне (загрузка модели ~60 сек)
+        self.embedder = None
+        self.embedder_state = "not_loaded"  # not_loaded | loading | ready | failed
+        self._embedder_lock = threading.Lock()
+        self._embedder_ready = threading.Event()
+        
+        # Бэкенд эмбеддера: torch (SentenceTransformer) | onnx (экспорт из onnx_model_path)
+        self.embedder_backend = embedder_backend
+        self.onnx_model_path = onnx_model_path
+        self.onnx_quantized = onnx_quantized
+        self.onnx_min_cosine = onnx_min_cosine
+        self.onnx_check: Optional[Dict[str, Any]] = None
+        self.embedder_available = (
+            ONNX_AVAILABLE and onnx_model_path is not None
+            if embedder_backend == "onnx" else EMBEDDER_AVAILABLE
+        )
+        
+        # Векторное хранилище: ChromaDB или встроенный NumPy индекс
+        # vector_backend: auto | chroma | numpy
+        self.chroma_path = self.data_dir / "chroma_db"
+        self.vector_index_path = self.data_dir / "vector_index"
+        self.vector_dtype = vector_dtype  # float32 | float16 | int8
+        self.vector_rescore = vector_rescore
+        self.chroma_client = None
+        self.collections = {}
+        self.vector_backend = None
+        
+        if vector_backend in ("auto", "chroma") and CHROMADB_INSTALLED and self.embedder_available:
             self.chroma_path.mkdir(exist_ok=True)
             self.init_chromadb()
-            self.embedder = SentenceTransformer(
-                'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+        
+        if not self.collections and vector_backend in ("auto", "numpy") and self.embedder_available:
+            self.init_vector_index()
+        
+        if self.collections and warm_embedder:
+            self.start_embedder_warmup()
+        
+        # Пул процессов-энкодеров (0 — энкодинг в вызывающем потоке)
+        self.embed_service_config = {
+            "workers": embed_workers,
+            "threads_per_worker": embed_worker_threads,
+            "query_workers": embed_query_workers,
+            "batch_size": embed_batch_size,
+        }
+        if embedder_backend == "onnx":
+            self.embed_service_config["loader"] = functools.partial(
+                load_onnx_embedder, onnx_model_path, onnx_quantized
             )
-        else:
-            self.chroma_client = None
-            self.collections = {}
-            self.embedder = None
+        self.embedding_service: Optional["EmbeddingService"] = None
+        if self.collections and embed_workers > 0 and self.embedder_available:
+            self.start_embedding_service()
         
         # Статус обучения
         self.training_active = False
@@ -58,9 +213,47 @@ class UnifiedRAGSystem:
         
         # Источники для обучения
         self.learning_sources = self._init_learning_sources()
+        self.wiki = MediaWikiFetcher(self.db, api_url=wiki_api_url)
+        # Движок извлечения текста из HTML: auto | lxml | trafilatura | bs4
+        self.html_extractor = get_extractor(html_extractor)
+        
+        # Планировщик тем обучения: приоритеты и свежесть хранятся в knowledge.db
+        self.training_scheduler = TrainingScheduler(self.db)
+        self.training_scheduler.sync_topics(self.learning_sources)
+        
+        # Дорогие показатели (размер каталогов) считаются в фоне
+        self.stats_refresh_interval = stats_refresh_interval
+        self._slow_stats: Dict[str, Any] = {}
+        self._stats_stop = threading.Event()
+        self.start_stats_refresher()
+        
+        # Политика хранения диалогов и фоновый компактор
+        self.retention = (
+            RetentionCompactor(self, retention, interval=retention_interval).start()
+            if retention is not None and retention.enabled else None
+        )
+        
+        # Отложенная индексация диалогов: всегда в режиме write-behind,
+        # иначе — пока грузится модель; оставшиеся с прошлого запуска дочитываются всегда
+        self._shutdown = threading.Event()
+        self.write_behind: Optional[DialogueWriteBehind] = None
+        if (self.collections and self.embedder_available) or DialogueWriteBehind.has_pending(self.db):
+            self.write_behind = DialogueWriteBehind(
+                self, max_queue=write_behind_queue, batch_size=write_behind_batch
+            ).start()
+        self.dialogue_write_behind = dialogue_write_behind
+        
+        # Обучающие документы, записанные до загрузки модели, эмбеддятся в фоне
+        self._backlog_lock = threading.Lock()
+        self._backlog_thread: Optional[threading.Thread] = None
+        if self.db.query_one("SELECT 1 FROM training_embed_pending LIMIT 1"):
+            self.start_training_backlog()
         
         logger.info("✅ Unified RAG System initialized")
     
+    # Категории, темы которых — заголовки статей Википедии
+    WIKI_CATEGORIES = ("wikipedia", "russian_topics", "science")
+    
     def _init_learning_sources(self) -> Dict[str, List[str]]:
         """Инициализация источников обучения"""
         return {
@@ -89,9 +282,13 @@ class UnifiedRAGSystem:
     
     def init_sqlite(self):
         """Инициализация SQLite базы"""
-        conn = sqlite3.connect(str(self.db_path))
-        cursor = conn.cursor()
+        with self.db.transaction() as cursor:
+            self._create_tables(cursor)
         
+        logger.info(f"✅ SQLite database initialized (WAL)")
+    
+    def _create_tables(self, cursor):
+        """Создание таблиц и индексов"""
         # Таблица диалогов (runtime)
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS dialogues (
@@ -135,17 +332,152 @@ class UnifiedRAGSystem:
         
         # Индексы
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_dialogues_rating ON dialogues(success_rating)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_dialogues_created ON dialogues(created_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_dialogues_model ON dialogues(model_used, id)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_training_topic ON training_data(topic)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_training_quality ON training_data(quality_score)")
         
-        conn.commit()
-        conn.close()
+        # Хэши контента для дедупликации
+        DuplicateDetector.create_tables(cursor)
+        
+        # Активные векторные коллекции и модель, задачи переиндексации
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS vector_collections (
+                key VARCHAR(50) PRIMARY KEY,
+                name TEXT NOT NULL,
+                model TEXT NOT NULL
+            )
+        """)
+        ReindexJob.create_tables(cursor)
+        
+        # Обучающие документы, ждущие эмбеддинга (записаны, пока модель грузилась)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS training_embed_pending (
+                content_id INTEGER PRIMARY KEY,
+                enqueued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Полнотекстовый индекс (FTS5), синхронизируется триггерами
+        self._create_fts(cursor, "dialogues", ["user_message", "assistant_message"])
+        self._create_fts(cursor, "training_data", ["content", "topic"])
+        
+        # Счётчики для get_stats, обновляются триггерами в тех же транзакциях
+        self._create_stats_counters(cursor)
+    
+    @staticmethod
+    def _create_stats_counters(cursor):
+        """Таблица stats_counters и триггеры, поддерживающие её при записи"""
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stats_counters'"
+        ).fetchone()
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stats_counters (
+                name VARCHAR(50) PRIMARY KEY,
+                value REAL NOT NULL DEFAULT 0
+            )
+        """)
+        
+        for table, counter in (("dialogues", "dialogues"), ("training_data", "training_items")):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_stats_insert AFTER INSERT ON {table} BEGIN
+                    UPDATE stats_counters SET value = value + 1 WHERE name = '{counter}';
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_stats_delete AFTER DELETE ON {table} BEGIN
+                    UPDATE stats_counters SET value = value - 1 WHERE name = '{counter}';
+                END
+            """)
+        
+        # Завершённые сессии обучения
+        completed = """
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'training_sessions';
+            UPDATE stats_counters SET value = value + COALESCE(new.items_added, 0)
+                WHERE name = 'total_trained_items';
+            UPDATE stats_counters SET value = value + COALESCE(new.success_rate, 0)
+                WHERE name = 'success_rate_sum';
+        """
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS training_history_stats_insert
+            AFTER INSERT ON training_history WHEN new.status = 'completed' BEGIN
+                {completed}
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS training_history_stats_update
+            AFTER UPDATE OF status ON training_history
+            WHEN new.status = 'completed' AND old.status IS NOT 'completed' BEGIN
+                {completed}
+            END
+        """)
+        
+        # Начальные значения для уже существующей базы (один раз)
+        if not exists:
+            sessions, items, rate_sum = cursor.execute("""
+                SELECT COUNT(*), COALESCE(SUM(items_added), 0), COALESCE(SUM(success_rate), 0)
+                FROM training_history WHERE status = 'completed'
+            """).fetchone()
+            cursor.executemany(
+                "INSERT OR REPLACE INTO stats_counters (name, value) VALUES (?, ?)",
+                [
+                    ("dialogues", cursor.execute("SELECT COUNT(*) FROM dialogues").fetchone()[0]),
+                    ("training_items", cursor.execute("SELECT COUNT(*) FROM training_data").fetchone()[0]),
+                    ("training_sessions", sessions),
+                    ("total_trained_items", items),
+                    ("success_rate_sum", rate_sum),
+                ]
+            )
+    
+    @staticmethod
+    def _create_fts(cursor, table: str, columns: List[str]):
+        """FTS5 таблица с внешним содержимым и триггерами синхронизации"""
+        fts = f"{table}_fts"
+        cols = ", ".join(columns)
+        new_cols = ", ".join(f"new.{c}" for c in columns)
+        old_cols = ", ".join(f"old.{c}" for c in columns)
+        
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)
+        ).fetchone()
+        
+        # '_' — часть токена, чтобы идентификаторы вида add_dialogue искались целиком
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                {cols},
+                content='{table}',
+                content_rowid='id',
+                tokenize="unicode61 remove_diacritics 2 tokenchars '_'"
+            )
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+                INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols});
+            END
+        """)
         
-        logger.info(f"✅ SQLite database initialized")
+        # Индексируем уже существующие строки
+        if not exists:
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
     
     def init_chromadb(self):
         """Инициализация ChromaDB"""
         try:
+            import chromadb
+            from chromadb.config import Settings
+            
             self.chroma_client = chromadb.PersistentClient(
                 path=str(self.chroma_path),
                 settings=Settings(anonymized_telemetry=False)
@@ -153,11 +485,10 @@ class UnifiedRAGSystem:
             
             # Коллекции
             self.collections = {
-                "dialogues": self.chroma_client.get_or_create_collection("user_dialogues"),
-                "training": self.chroma_client.get_or_create_collection("training_knowledge"),
-                "code": self.chroma_client.get_or_create_collection("code_examples"),
-                "solutions": self.chroma_client.get_or_create_collection("solutions"),
+                key: self.chroma_client.get_or_create_collection(name)
+                for key, name in self.collection_names.items()
             }
+            self.vector_backend = "chroma"
             
             logger.info(f"✅ ChromaDB initialized")
         except Exception as e:
@@ -165,6 +496,401 @@ class UnifiedRAGSystem:
             self.chroma_client = None
             self.collections = {}
     
+    def init_vector_index(self):
+        """Инициализация встроенного NumPy индекса (без ChromaDB)"""
+        try:
+            self.collections = {
+                key: NumpyVectorIndex(
+                    str(self.vector_index_path / name),
+                    name,
+                    dtype=self.vector_dtype,
+                    rescore=self.vector_rescore
+                )
+                for key, name in self.collection_names.items()
+            }
+            self.vector_backend = "numpy"
+            
+            logger.info(f"✅ NumPy vector index initialized ({self.vector_dtype})")
+        except Exception as e:
+            logger.error(f"Vector index init failed: {e}")
+            self.collections = {}
+    
+    def _load_active_collections(self, requested_model: Optional[str]):
+        """Имена коллекций и модель из vector_collections"""
+        rows = self.db.query_all("SELECT key, name, model FROM vector_collections")
+        if not rows:
+            return
+        
+        self.collection_names.update({key: name for key, name, _ in rows})
+        active_model = rows[0][2]
+        if requested_model and requested_model != active_model:
+            logger.warning(
+                f"Vectors were built with {active_model}; "
+                f"run start_reindex('{requested_model}') to switch models"
+            )
+        self.model_name = active_model
+    
+    def _open_collection(self, name: str):
+        """Коллекция активного бэкенда (создаётся при отсутствии)"""
+        if self.vector_backend == "chroma":
+            return self.chroma_client.get_or_create_collection(name)
+        return NumpyVectorIndex(
+            str(self.vector_index_path / name),
+            name,
+            dtype=self.vector_dtype,
+            rescore=self.vector_rescore
+        )
+    
+    def _drop_collection(self, name: str):
+        """Удаление коллекции вместе с данными"""
+        try:
+            if self.vector_backend == "chroma":
+                self.chroma_client.delete_collection(name)
+            else:
+                import shutil
+                shutil.rmtree(self.vector_index_path / name, ignore_errors=True)
+        except Exception as e:
+            logger.warning(f"Failed to drop collection {name}: {e}")
+    
+    def activate_collections(
+        self,
+        collections: Dict[str, Any],
+        names: Dict[str, str],
+        model_name: str,
+        embedder
+    ):
+        """Подмена активных коллекций и модели (вызывается ReindexJob под _switch_lock)"""
+        self.collections = dict(collections)
+        self.collection_names = dict(names)
+        self.embedder = embedder
+        self.model_name = model_name
+        self.embedder_state = "ready"
+        self._embedder_ready.set()
+        
+        # Эмбеддинги запросов и результаты поиска старой модели больше не годятся
+        self.query_cache.clear()
+        self.search_cache.bump_all()
+        
+        # Процессы-энкодеры держат старую модель
+        if self.embedding_service is not None and self.embedding_service.model_name != model_name:
+            self.start_embedding_service()
+    
+    # ==================== EMBEDDINGS ====================
+    
+    def _load_embedder(self, timeout: Optional[float] = None):
+        """Загрузка SentenceTransformer (блокирующая)"""
+        with self._embedder_lock:
+            owner = self.embedder_state == "not_loaded"
+            if owner:
+                self.embedder_state = "loading"
+        
+        # Модель уже грузит другой поток
+        if not owner:
+            self._embedder_ready.wait(timeout)
+            return
+        
+        started = time.time()
+        try:
+            self.embedder = self._create_embedder()
+            self.embedder_state = "ready"
+            logger.info(f"✅ Embedder ready in {time.time() - started:.1f}s")
+        except Exception as e:
+            logger.error(f"Embedder load failed: {e}")
+            self.embedder_state = "failed"
+        finally:
+            self._embedder_ready.set()
+    
+    def _create_embedder(self):
+        """Модель выбранного бэкенда; ONNX — только если совместима с индексом"""
+        if self.embedder_backend != "onnx":
+            from sentence_transformers import SentenceTransformer
+            return SentenceTransformer(self.model_name)
+        
+        embedder = OnnxEmbedder(self.onnx_model_path, quantized=self.onnx_quantized)
+        self.onnx_check = self._check_onnx_compatibility(embedder)
+        if self.onnx_check.get("compatible"):
+            return embedder
+        
+        # Процессы-энкодеры грузят ONNX сами: без сверки их нельзя использовать
+        self.embed_service_config.pop("loader", None)
+        message = f"ONNX embedder is not compatible with the index: {self.onnx_check}"
+        if not EMBEDDER_AVAILABLE:
+            if self.embedding_service is not None:
+                self.embedding_service.close()
+                self.embedding_service = None
+            raise ValueError(message)
+        logger.error(f"{message}, falling back to PyTorch")
+        if self.embedding_service is not None:
+            self.start_embedding_service()
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(self.model_name)
+    
+    def _check_onnx_compatibility(self, embedder, samples: int = 64) -> Dict[str, Any]:
+        """
+        Сверка ONNX-векторов с векторами индекса
+        
+        Эталон — кэш эмбеддингов: через него проходит каждый вектор, записанный в индекс.
+        Без эталонов PROBE_TEXTS кодируются PyTorch-моделью (и кэшируются для следующих
+        запусков); без sentence-transformers непроверенный ONNX допускается только к пустому индексу.
+        """
+        documents = list(PROBE_TEXTS)
+        for coll in self.collections.values():
+            try:
+                documents.extend(coll.get(limit=samples).get("documents") or [])
+            except Exception as e:
+                logger.debug(f"Skip collection sample: {e}")
+        indexed = len(documents) - len(PROBE_TEXTS)
+        
+        reference = (
+            self.embedding_cache.get_many(self.model_name, documents, count_stats=False)
+            if self.embedding_cache is not None else [None] * len(documents)
+        )
+        pairs = [(doc, vector) for doc, vector in zip(documents, reference) if vector is not None]
+        
+        if not pairs and EMBEDDER_AVAILABLE:
+            from sentence_transformers import SentenceTransformer
+            vectors = SentenceTransformer(self.model_name).encode(
+                list(PROBE_TEXTS), batch_size=self.embed_batch_size, convert_to_numpy=True
+            )
+            if self.embedding_cache is not None:
+                self.embedding_cache.put_many(self.model_name, list(PROBE_TEXTS), vectors)
+            pairs = list(zip(PROBE_TEXTS, vectors))
+        
+        if not pairs:
+            # Сверить не с чем: к непустому индексу непроверенные векторы не допускаются
+            report = {
+                "compatible": indexed == 0,
+                "verified": False,
+                "samples": 0,
+                "reason": "no reference vectors (embedding cache empty, sentence-transformers missing)",
+            }
+            logger.warning(f"⚠️ ONNX embedder unverified: {report}")
+            return report
+        
+        report = compare_embeddings(
+            np.stack([vector for _, vector in pairs]),
+            embedder.encode([doc for doc, _ in pairs], batch_size=self.embed_batch_size)
+        )
+        report["compatible"] = report.get("min_cosine", 0) >= self.onnx_min_cosine
+        report["verified"] = True
+        report["min_cosine_required"] = self.onnx_min_cosine
+        logger.info(f"🔎 ONNX vs reference vectors: {report}")
+        return report
+    
+    def start_embedder_warmup(self) -> bool:
+        """Фоновая загрузка эмбеддера"""
+        if not self.embedder_available or self.embedder_state != "not_loaded":
+            return False
+        
+        threading.Thread(
+            target=self._load_embedder,
+            name="rag-embedder-warmup",
+            daemon=True
+        ).start()
+        return True
+    
+    def ensure_embedder(self, timeout: Optional[float] = None) -> bool:
+        """Эмбеддер готов к работе (при необходимости ждём загрузку)"""
+        if self.embedder_state == "ready":
+            return True
+        if not self.embedder_available or self.embedder_state == "failed":
+            return False
+        
+        self._load_embedder(timeout)
+        return self.embedder_state == "ready"
+    
+    @property
+    def is_ready(self) -> bool:
+        """Готов ли векторный поиск"""
+        return self.embedder_state == "ready"
+    
+    def _vectors_enabled(self, collection: str) -> bool:
+        """Записи коллекции индексируются: она есть, а эмбеддер загружен или грузится"""
+        return (
+            self.collections.get(collection) is not None
+            and self.embedder_available
+            and self.embedder_state != "failed"
+        )
+    
+    def start_embedding_service(self) -> "EmbeddingService":
+        """Запуск (или перезапуск под текущую модель) пула процессов-энкодеров"""
+        from embedding_service import EmbeddingService
+        
+        previous = self.embedding_service
+        self.embedding_service = EmbeddingService(
+            self.model_name, **self.embed_service_config
+        ).start()
+        
+        # Пока новые процессы грузят модель, энкодинг идёт в вызывающем потоке
+        if previous is not None:
+            previous.close()
+        return self.embedding_service
+    
+    def close(self):
+        """Остановка фоновых потоков и процессов-энкодеров"""
+        self._shutdown.set()
+        # Очередь write-behind дренируется, пока энкодер ещё работает
+        if self.write_behind is not None:
+            self.write_behind.close()
+        self._stats_stop.set()
+        if self.retention is not None:
+            self.retention.stop()
+        if self.embedding_service is not None:
+            self.embedding_service.close()
+        
+        # Соединения SQLite всех потоков (пул, обучение, переиндексация)
+        self.db.close_all()
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
+    
+    def encode_batch(
+        self,
+        texts: List[str],
+        embedder=None,
+        model_name: Optional[str] = None
+    ) -> np.ndarray:
+        """Батч-энкодинг текстов в матрицу float32 (через кэш эмбеддингов)"""
+        # Другая модель (переиндексация) — со своими ключами в кэше
+        model_name = model_name or self.model_name
+        
+        if self.embedding_cache is None or not texts:
+            return self._encode_texts(texts, embedder)
+        
+        cached = self.embedding_cache.get_many(model_name, texts)
+        missing = [i for i, embedding in enumerate(cached) if embedding is None]
+        
+        if missing:
+            encoded = self._encode_texts([texts[i] for i in missing], embedder)
+            self.embedding_cache.put_many(model_name, [texts[i] for i in missing], encoded)
+            for i, embedding in zip(missing, encoded):
+                cached[i] = embedding
+        
+        return np.stack(cached).astype(np.float32, copy=False)
+    
+    def _encode_texts(self, texts: List[str], embedder=None, lane: str = "bulk") -> np.ndarray:
+        """Энкодинг моделью (с группировкой по длине): пул процессов или текущий поток"""
+        started = time.perf_counter()
+        
+        # Сортируем по длине, чтобы в батч попадали тексты похожей длины
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        ordered = [texts[i] for i in order]
+        
+        encoded = None
+        service = self.embedding_service
+        if embedder is None and service is not None and self._service_trusted() and service.is_ready(lane):
+            try:
+                encoded = service.encode(ordered, lane)
+            except Exception as e:
+                logger.warning(f"Embedding service error, encoding in-process: {e}")
+        
+        if encoded is None:
+            encoded = (embedder or self.embedder).encode(
+                ordered,
+                batch_size=self.embed_batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            ).astype(np.float32, copy=False)
+        
+        # Возвращаем исходный порядок
+        embeddings = np.empty_like(encoded)
+        embeddings[order] = encoded
+        
+        self.embed_stats["chunks"] += len(texts)
+        self.embed_stats["seconds"] += time.perf_counter() - started
+        return embeddings
+    
+    def _service_trusted(self) -> bool:
+        """Пул процессов с ONNX-моделью — только после успешной сверки с индексом"""
+        if "loader" not in self.embed_service_config:
+            return True
+        return bool(self.onnx_check and self.onnx_check.get("compatible"))
+    
+    def get_embed_throughput(self) -> float:
+        """Пропускная способность энкодера (чанков в секунду)"""
+        seconds = self.embed_stats["seconds"]
+        return round(self.embed_stats["chunks"] / seconds, 2) if seconds else 0.0
+    
+    def embed_query(self, query: str) -> np.ndarray:
+        """Эмбеддинг поискового запроса (через LRU кэш)"""
+        embedding = self.query_cache.get(query, self.model_name)
+        if embedding is None:
+            # Быстрая полоса: запрос не ждёт за батчами обучения
+            embedding = self._encode_texts([query], lane="query")[0]
+            self.query_cache.put(query, self.model_name, embedding)
+        return embedding
+    
+    def _chroma_add(
+        self,
+        collection_name: str,
+        embeddings: np.ndarray,
+        documents: List[str],
+        metadatas: List[Dict[str, Any]],
+        ids: List[str]
+    ):
+        """
+        Массовая вставка в активную коллекцию крупными батчами
+        
+        Поиск коллекции и вставка — под _switch_lock: переиндексация не подменит коллекцию
+        посередине. Векторы старой модели (подмена случилась во время encode) не вставляются:
+        строка уже в базе, и её проиндексирует догоняющий проход после подмены.
+        """
+        with self._switch_lock:
+            encoded_by = {meta.get("embedding_model") for meta in metadatas}
+            if encoded_by != {self.model_name}:
+                logger.info(f"Skipping {len(ids)} vectors of a replaced model in {collection_name}")
+                return
+            self._collection_add(self.collections[collection_name], embeddings, documents, metadatas, ids)
+    
+    def _collection_add(
+        self,
+        coll,
+        embeddings: np.ndarray,
+        documents: List[str],
+        metadatas: List[Dict[str, Any]],
+        ids: List[str]
+    ):
+        """Вставка в коллекцию срезами по chroma_batch_size"""
+        step = self.chroma_batch_size
+        
+        for start in range(0, len(ids), step):
+            coll.add(
+                embeddings=embeddings[start:start + step].tolist(),
+                documents=documents[start:start + step],
+                metadatas=metadatas[start:start + step],
+                ids=ids[start:start + step]
+            )
+    
+    @staticmethod
+    def _iter_batches(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+        """Разбиение итератора/генератора на списки фиксированного размера"""
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    def count_tokens(self, text: str) -> int:
+        """Число токенов: токенизатор модели, если загружена, иначе оценка"""
+        if self.is_ready and hasattr(self.embedder, "tokenizer"):
+            return len(self.embedder.tokenizer.tokenize(text)) + 2
+        return estimate_tokens(text)
+    
+    def _chunk_content(self, content: Union[str, Iterable[str]]) -> Iterator[tuple]:
+        """Потоковая нарезка текста на чанки: (chunk_id, chunk), ..."""
+        max_tokens = self.chunk_max_tokens
+        if max_tokens is None:
+            max_tokens = getattr(self.embedder, "max_seq_length", None) or DEFAULT_MAX_TOKENS
+        
+        return iter_chunks(
+            content,
+            max_tokens=max_tokens,
+            overlap_tokens=self.chunk_overlap_tokens,
+            count_tokens=self.count_tokens
+        )
+    
     # ==================== RUNTIME RAG ====================
     
     def add_dialogue(
@@ -174,40 +900,43 @@ class UnifiedRAGSystem:
         model_used: str = "unknown",
         success_rating: float = 0.5
     ) -> int:
-        """Добавить диалог в базу (runtime)"""
-        conn = sqlite3.connect(str(self.db_path))
-        cursor = conn.cursor()
+        """
+        Добавить диалог в базу (runtime)
         
-        cursor.execute("""
-            INSERT INTO dialogues 
-            (user_message, assistant_message, model_used, success_rating)
-            VALUES (?, ?, ?, ?)
-        """, (user_message, assistant_message, model_used, success_rating))
+        В режиме write-behind, а также пока модель грузится, эмбеддинг — в фоне:
+        запись не ждёт загрузку модели.
+        """
+        deferred = self.dialogue_write_behind or not self.is_ready
+        if (
+            deferred
+            and self._vectors_enabled("dialogues")
+            and self.write_behind is not None
+            and self.write_behind.accepting
+        ):
+            dialogue_id = self.write_behind.add(user_message, assistant_message, model_used, success_rating)
+            # Строка уже видна лексическому поиску
+            self._bump_generation("dialogues")
+            return dialogue_id
         
-        dialogue_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO dialogues 
+                (user_message, assistant_message, model_used, success_rating)
+                VALUES (?, ?, ?, ?)
+            """, (user_message, assistant_message, model_used, success_rating))
+            
+            dialogue_id = cursor.lastrowid
         
         # Добавляем в ChromaDB
-        if self.collections.get("dialogues") and self.embedder:
+        if self.collections.get("dialogues") and self.is_ready:
             try:
-                text = f"USER: {user_message}\nASSISTANT: {assistant_message}"
-                embedding = self.embedder.encode(text).tolist()
-                
-                self.collections["dialogues"].add(
-                    embeddings=[embedding],
-                    documents=[text],
-                    metadatas=[{
-                        "model": model_used,
-                        "rating": success_rating,
-                        "db_id": dialogue_id,
-                        "type": "dialogue"
-                    }],
-                    ids=[f"dialogue_{dialogue_id}_{int(time.time())}"]
+                self._embed_dialogues(
+                    [dialogue_id], [(user_message, assistant_message, model_used, success_rating)]
                 )
             except Exception as e:
                 logger.error(f"Failed to add to ChromaDB: {e}")
         
+        self._bump_generation("dialogues")
         logger.debug(f"Added dialogue #{dialogue_id}")
         return dialogue_id
     
@@ -215,81 +944,320 @@ class UnifiedRAGSystem:
         self,
         query: str,
         limit: int = 5,
-        collection: str = None
+        collection: str = None,
+        hybrid: bool = True,
+        filters: Union[SearchFilters, Dict[str, Any], None] = None,
+        min_similarity: Optional[float] = None,
+        max_chars: Optional[int] = None
     ) -> List[Dict[str, Any]]:
-        """Поиск в базе знаний"""
-        if not self.collections or not self.embedder:
+        """
+        Поиск в базе знаний (векторный + BM25 со слиянием RRF) через кэш результатов
+        
+        filters (SearchFilters или dict) передаются в where векторного хранилища
+        и в SQL лексического поиска; коллекции без нужных полей не опрашиваются.
+        min_similarity отсекает слабые совпадения до слияния,
+        max_chars ограничивает суммарный объём возвращаемого текста.
+        Неизвестная collection — предупреждение в лог и пустой результат.
+        """
+        if collection and collection not in COLLECTION_NAMES:
+            logger.warning(
+                f"⚠️ Unknown collection: {collection!r} (expected one of {', '.join(COLLECTION_NAMES)})"
+            )
             return []
         
+        filters = SearchFilters.coerce(filters)
+        scope = filters.collections([collection] if collection else COLLECTION_NAMES.keys())
+        if not scope:
+            return []
+        
+        vector_mode = bool(self.collections) and self.is_ready
+        key = self.search_cache.make_key(
+            query, collection, limit,
+            hybrid=hybrid, vector=vector_mode, model=self.model_name,
+            filters=filters.conditions(), min_similarity=min_similarity, max_chars=max_chars
+        )
+        cached = self.search_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        # Поколения снимаются до поиска: запись во время поиска сделает результат устаревшим
+        snapshot = self.search_cache.snapshot(scope)
         try:
-            query_embedding = self.embedder.encode(query).tolist()
-            
-            all_results = []
-            
-            # Ищем в указанной коллекции или во всех
-            collections_to_search = (
-                [self.collections[collection]] if collection and collection in self.collections
-                else list(self.collections.values())
+            results = self._search(query, limit, scope, hybrid, vector_mode, filters, min_similarity)
+        except Exception as e:
+            logger.error(f"Search failed: {e}")
+            return []
+        
+        results = apply_char_budget(results, max_chars)
+        
+        self.search_cache.put(key, snapshot, results)
+        return results
+    
+    def _bump_generation(self, collection: str):
+        """Запись в коллекцию/таблицу: закэшированные результаты по ней устаревают"""
+        self.search_cache.bump(collection)
+    
+    def _search(
+        self,
+        query: str,
+        limit: int,
+        scope: List[str],
+        hybrid: bool,
+        vector_mode: bool,
+        filters: SearchFilters,
+        min_similarity: Optional[float]
+    ) -> List[Dict[str, Any]]:
+        """Поиск без кэша по коллекциям scope"""
+        # Пока модель не загружена — только лексический поиск (FTS5)
+        if not vector_mode:
+            return self.lexical_search(query, limit, scope, filters, min_similarity)
+        
+        # Лексический поиск идёт параллельно с векторным
+        lexical_future = (
+            self.search_executor.submit(
+                self.lexical_search, query, limit, scope, filters, min_similarity
             )
-            
-            for coll in collections_to_search:
-                try:
-                    results = coll.query(
-                        query_embeddings=[query_embedding],
-                        n_results=3
-                    )
-                    
-                    if results and results['documents']:
-                        for i, doc in enumerate(results['documents'][0]):
-                            metadata = results['metadatas'][0][i] if results.get('metadatas') else {}
-                            distance = results['distances'][0][i] if results.get('distances') else 0
-                            
-                            similarity = 1.0 - min(distance / 2.0, 1.0)
-                            
-                            all_results.append({
-                                "text": doc,
-                                "similarity": round(similarity, 3),
-                                "collection": coll.name,
-                                "metadata": metadata
-                            })
-                except Exception as e:
-                    logger.debug(f"Skip collection: {e}")
+            if hybrid else None
+        )
+        
+        query_embedding = self.embed_query(query).tolist()
+        where = filters.to_where()
+        
+        # Каждая коллекция может дать весь top-k
+        futures = [
+            self.search_executor.submit(
+                self._query_collection, self.collections[name], query_embedding, limit,
+                where, min_similarity
+            )
+            for name in scope if name in self.collections
+        ]
+        
+        all_results = []
+        for future in futures:
+            all_results.extend(future.result())
+        
+        # Слияние top-k через кучу
+        vector_results = heapq.nlargest(limit, all_results, key=lambda x: x["similarity"])
+        
+        if lexical_future is None:
+            return vector_results
+        return self._fuse_rrf([vector_results, lexical_future.result()], limit)
+    
+    @staticmethod
+    def _fuse_rrf(
+        rankings: List[List[Dict[str, Any]]],
+        limit: int,
+        k: int = 60
+    ) -> List[Dict[str, Any]]:
+        """Reciprocal Rank Fusion нескольких ранжирований"""
+        fused: Dict[tuple, Dict[str, Any]] = {}
+        
+        for ranking in rankings:
+            for rank, item in enumerate(ranking):
+                db_id = item["metadata"].get("db_id") if item.get("metadata") else None
+                key = (item["collection"], db_id if db_id is not None else item["text"])
+                
+                entry = fused.get(key)
+                if entry is None:
+                    entry = dict(item, rrf_score=0.0)
+                    fused[key] = entry
+                elif entry.get("match") != item.get("match"):
+                    entry["match"] = "hybrid"
+                    # Текст векторного чанка точнее, чем сниппет
+                    if item.get("match") != "lexical":
+                        entry["text"] = item["text"]
+                        entry["similarity"] = item["similarity"]
+                else:
+                    # Второй чанк того же документа в том же ранжировании
                     continue
+                
+                entry["rrf_score"] += 1.0 / (k + rank + 1)
+        
+        results = heapq.nlargest(limit, fused.values(), key=lambda x: x["rrf_score"])
+        for item in results:
+            item["rrf_score"] = round(item["rrf_score"], 5)
+        return results
+    
+    def _query_collection(
+        self,
+        coll,
+        query_embedding: List[float],
+        n_results: int,
+        where: Optional[Dict[str, Any]] = None,
+        min_similarity: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """Запрос к одной коллекции (выполняется в пуле потоков)"""
+        started = time.perf_counter()
+        found = []
+        
+        options: Dict[str, Any] = {}
+        if where:
+            options["where"] = where
+        if min_similarity is not None and isinstance(coll, NumpyVectorIndex):
+            # similarity = 1 - distance / 2: порог переводится в расстояние
+            options["max_distance"] = 2.0 * (1.0 - min_similarity)
+        
+        try:
+            results = coll.query(
+                query_embeddings=[query_embedding],
+                n_results=n_results,
+                **options
+            )
+            latency_ms = round((time.perf_counter() - started) * 1000, 2)
             
-            # Сортируем по similarity
-            all_results.sort(key=lambda x: x["similarity"], reverse=True)
-            return all_results[:limit]
-            
+            if results and results['documents']:
+                for i, doc in enumerate(results['documents'][0]):
+                    metadata = results['metadatas'][0][i] if results.get('metadatas') else {}
+                    distance = results['distances'][0][i] if results.get('distances') else 0
+                    
+                    similarity = 1.0 - min(distance / 2.0, 1.0)
+                    # Результаты отсортированы по расстоянию: дальше только хуже
+                    if min_similarity is not None and similarity < min_similarity:
+                        break
+                    
+                    found.append({
+                        "text": doc,
+                        "similarity": round(similarity, 3),
+                        "collection": coll.name,
+                        "metadata": metadata,
+                        "match": "vector",
+                        "latency_ms": latency_ms
+                    })
         except Exception as e:
-            logger.error(f"Search failed: {e}")
+            logger.debug(f"Skip collection: {e}")
+        
+        return found
+    
+    def lexical_search(
+        self,
+        query: str,
+        limit: int = 5,
+        collection: Union[str, Iterable[str], None] = None,
+        filters: Optional[SearchFilters] = None,
+        min_similarity: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """Лексический поиск BM25 по FTS5 (без эмбеддингов), фильтры — в WHERE"""
+        terms = re.findall(r"\w+", query.lower())[:32]
+        if not terms:
+            return []
+        
+        # Каждый терм — строка FTS5 в кавычках (безопасно для спецсимволов)
+        match = " OR ".join('"' + t.replace('"', '""') + '"' for t in terms)
+        
+        # Источник: (SQL, ключ метаданных -> колонка)
+        sources = {
+            "dialogues": ("""
+                SELECT d.id, d.user_message || '\n' || d.assistant_message,
+                       d.model_used, d.success_rating, bm25(dialogues_fts)
+                FROM dialogues_fts JOIN dialogues d ON d.id = dialogues_fts.rowid
+                WHERE dialogues_fts MATCH ? AND bm25(dialogues_fts) <= ? AND {filters}
+                ORDER BY bm25(dialogues_fts) LIMIT ?
+            """, {"model": "d.model_used", "rating": "d.success_rating"}),
+            "training": ("""
+                SELECT t.id, snippet(training_data_fts, 0, '', '', '…', 64),
+                       t.topic, t.source, bm25(training_data_fts)
+                FROM training_data_fts JOIN training_data t ON t.id = training_data_fts.rowid
+                WHERE training_data_fts MATCH ? AND bm25(training_data_fts) <= ? AND {filters}
+                ORDER BY bm25(training_data_fts) LIMIT ?
+            """, {
+                "topic": "t.topic", "source": "t.source", "type": "t.content_type"
+            }),
+        }
+        if collection:
+            scope = [collection] if isinstance(collection, str) else list(collection)
+            sources = {k: v for k, v in sources.items() if k in scope}
+        
+        filters = filters or SearchFilters()
+        sources = {k: v for k, v in sources.items() if k in filters.collections([k])}
+        
+        # similarity = score / (score + 1), score = -bm25: порог переводится в bm25
+        if min_similarity is not None and min_similarity >= 1.0:
             return []
+        max_rank = (
+            -min_similarity / (1.0 - min_similarity)
+            if min_similarity is not None and min_similarity > 0 else float("inf")
+        )
+        
+        results = []
+        try:
+            for name, (sql, columns) in sources.items():
+                # Имя активной коллекции (после переиндексации — с суффиксом версии),
+                # чтобы RRF склеивал лексическое и векторное попадание одного документа
+                coll_name = self.collection_names[name]
+                condition, params = filters.to_sql(columns)
+                rows = self.db.query_all(
+                    sql.format(filters=condition), (match, max_rank, *params, limit)
+                )
+                for db_id, text, meta_a, meta_b, rank in rows:
+                    # bm25() отрицателен: чем меньше, тем лучше
+                    score = max(-rank, 0.0)
+                    metadata = (
+                        {"model": meta_a, "rating": meta_b, "db_id": db_id, "type": "dialogue"}
+                        if name == "dialogues"
+                        else {"topic": meta_a, "source": meta_b, "db_id": db_id}
+                    )
+                    results.append({
+                        "text": text,
+                        "similarity": round(score / (score + 1.0), 3),
+                        "bm25": round(score, 3),
+                        "collection": coll_name,
+                        "metadata": metadata,
+                        "match": "lexical"
+                    })
+        except Exception as e:
+            logger.error(f"Lexical search failed: {e}")
+        
+        return heapq.nlargest(limit, results, key=lambda x: x["bm25"])
     
     # ==================== TRAINING (WEB SCRAPING) ====================
     
     def scrape_wikipedia(self, topic: str) -> Optional[str]:
-        """Парсинг Wikipedia"""
+        """
+        Статья Wikipedia: plain-text через MediaWiki API, HTML — запасной путь
+        
+        Текст статьи или None при ошибке; неизменившаяся статья отдаётся из хранилища
+        (только изменившиеся статьи — scrape_wikipedia_bulk).
+        """
+        try:
+            fetched = self.wiki.fetch([topic])
+        except requests.RequestException as e:
+            logger.warning(f"MediaWiki API error for {topic}, falling back to HTML: {e}")
+            return self.scrape_wikipedia_html(topic)
+        
+        if topic not in fetched:
+            return self.wiki.get_text(topic)
+        return fetched[topic]
+    
+    def scrape_wikipedia_bulk(self, topics: List[str]) -> Dict[str, str]:
+        """Только изменившиеся с прошлой загрузки статьи пачкой: {topic: text}"""
+        try:
+            texts = self.wiki.fetch(topics)
+        except requests.RequestException as e:
+            logger.error(f"MediaWiki API bulk error: {e}")
+            return {}
+        return {topic: text for topic, text in texts.items() if text}
+    
+    def scrape_wikipedia_html(self, topic: str) -> Optional[str]:
+        """Парсинг HTML-страницы Wikipedia"""
         url = f"https://ru.wikipedia.org/wiki/{topic}"
         
         try:
-            response = requests.get(url, timeout=15, headers={
+            response = requests.get(url, timeout=15, stream=True, headers={
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             })
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Удаляем ненужные элементы
-            for tag in soup(['script', 'style', 'nav', 'footer', 'header']):
-                tag.decompose()
-            
-            # Извлекаем параграфы
-            paragraphs = soup.find_all('p')
-            text = '\n'.join([p.get_text().strip() for p in paragraphs if len(p.get_text()) > 100])
-            
-            return text[:5000] if text else None  # Первые 5000 символов
+            with response:
+                response.raise_for_status()
+                # Потоковый разбор: страница не собирается в памяти целиком
+                return self.html_extractor.extract(response.iter_content(chunk_size=65536))
             
         except Exception as e:
             logger.error(f"Wikipedia scrape error for {topic}: {e}")
             return None
     
+    def extract_paragraphs(self, html: str) -> Optional[str]:
+        """Текст статьи из HTML (абзацы через пустую строку, формат для чанкера)"""
+        return self.html_extractor.extract(html)
+    
     def scrape_programming_content(self, query: str) -> Optional[str]:
         """Парсинг программистских ресурсов (симуляция)"""
         # В реальности здесь можно парсить:
@@ -299,7 +1267,7 @@ class UnifiedRAGSystem:
         # - MDN Web Docs
         
         # Пока генерируем запрос к модели
-        return f"Programming topic: {query}\n(Content would be scraped from real sources)"
+        return f"Programming topic: {query}\n{PLACEHOLDER_CONTENT}"
     
     def add_training_content(
         self,
@@ -308,148 +1276,504 @@ class UnifiedRAGSystem:
         topic: str,
         content_type: str = "article"
     ) -> int:
-        """Добавить контент в базу обучения"""
-        conn = sqlite3.connect(str(self.db_path))
-        cursor = conn.cursor()
+        """Добавить контент в базу обучения (пока модель грузится — эмбеддинг в фоне)"""
+        deferred = self._vectors_enabled("training") and not self.is_ready
         
-        cursor.execute("""
-            INSERT INTO training_data 
-            (content, source, topic, content_type)
-            VALUES (?, ?, ?, ?)
-        """, (content, source, topic, content_type))
-        
-        content_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.db.transaction() as cursor:
+            # Дубликат документа: возвращаем id уже сохранённого
+            duplicate = self._find_duplicate_document(cursor, content, topic)
+            if duplicate is not None:
+                return duplicate
+            
+            cursor.execute("""
+                INSERT INTO training_data 
+                (content, source, topic, content_type)
+                VALUES (?, ?, ?, ?)
+            """, (content, source, topic, content_type))
+            
+            content_id = cursor.lastrowid
+            self.dedup.register(cursor, content, "document", content_id)
+            if deferred:
+                cursor.execute(
+                    "INSERT OR IGNORE INTO training_embed_pending (content_id) VALUES (?)", (content_id,)
+                )
         
-        # Добавляем в ChromaDB по чанкам
-        if self.collections.get("training") and self.embedder:
+        if deferred:
+            self.start_training_backlog()
+        else:
             try:
-                # Разбиваем на чанки
-                chunk_size = 500
-                chunks = [content[i:i+chunk_size] for i in range(0, len(content), chunk_size)]
-                
-                for i, chunk in enumerate(chunks):
-                    if len(chunk.strip()) < 50:
-                        continue
-                    
-                    embedding = self.embedder.encode(chunk).tolist()
-                    
-                    self.collections["training"].add(
-                        embeddings=[embedding],
-                        documents=[chunk],
-                        metadatas=[{
-                            "source": source,
-                            "topic": topic,
-                            "type": content_type,
-                            "db_id": content_id,
-                            "chunk_id": i
-                        }],
-                        ids=[f"train_{content_id}_{i}_{int(time.time())}"]
-                    )
+                added = self._embed_training_document(content_id, content, source, topic, content_type)
+                logger.debug(f"Added {added} chunks for {topic}")
+            except Exception as e:
+                # Хэши чанков не записаны — документ доиндексирует фоновый поток
+                logger.error(f"Failed to add training content, retrying in background: {e}")
+                self._defer_training([content_id])
+        
+        self._bump_generation("training")
+        return content_id
+    
+    def _embed_training_document(
+        self,
+        content_id: int,
+        content: str,
+        source: str,
+        topic: str,
+        content_type: str
+    ) -> int:
+        """Нарезка, эмбеддинг и вставка чанков документа; число новых чанков"""
+        if not (self.collections.get("training") and self.is_ready):
+            return 0
+        
+        # Чанки идут в энкодер группами по мере нарезки (память ограничена группой)
+        meta = (source, topic, content_type)
+        added = 0
+        
+        for group in self._iter_batches(self._chunk_content(content), self.embed_batch_size * 4):
+            added += self._embed_training_chunks(
+                [(content_id, meta, i, chunk) for i, chunk in group]
+            )
+        
+        return added
+    
+    def _embed_training_chunks(self, items: List[tuple]) -> int:
+        """
+        Новые чанки [(content_id, (source, topic, content_type), chunk_id, chunk), ...] — в коллекцию
+        
+        Хэши чанков регистрируются только после вставки векторов: при сбое encode/add
+        чанки остаются неизвестными и проиндексируются при повторе.
+        id детерминированы (как у переиндексации): повторная вставка не дублирует векторы.
+        """
+        # Отбрасываем уже известные чанки до эмбеддинга (чтение без блокировки записи)
+        chunks = self.dedup.new_chunks(self.db.get_connection(), items)
+        
+        if chunks:
+            texts = [chunk for *_, chunk in chunks]
+            model_name = self.model_name
+            self._chroma_add(
+                "training",
+                self.encode_batch(texts),
+                texts,
+                [{
+                    "source": source,
+                    "topic": topic,
+                    "type": content_type,
+                    "db_id": content_id,
+                    "chunk_id": i,
+                    "embedding_model": model_name
+                } for content_id, (source, topic, content_type), i, _ in chunks],
+                [f"train_{content_id}_{i}" for content_id, _, i, _ in chunks]
+            )
+        
+        with self.db.transaction() as cursor:
+            self.dedup.register_chunks(
+                cursor, [(content_id, chunk) for content_id, _, _, chunk in chunks], len(items)
+            )
+        return len(chunks)
+    
+    def _defer_training(self, content_ids: List[int]):
+        """Документы — в очередь фонового эмбеддинга (повтор после сбоя)"""
+        with self.db.transaction() as cursor:
+            cursor.executemany(
+                "INSERT OR IGNORE INTO training_embed_pending (content_id) VALUES (?)",
+                [(content_id,) for content_id in content_ids]
+            )
+        self.start_training_backlog()
+    
+    def start_training_backlog(self) -> bool:
+        """Фоновый эмбеддинг документов из training_embed_pending (один поток)"""
+        with self._backlog_lock:
+            if self._backlog_thread is not None and self._backlog_thread.is_alive():
+                return False
+            self._backlog_thread = threading.Thread(
+                target=self._drain_training_backlog,
+                name="rag-training-backlog",
+                daemon=True
+            )
+            self._backlog_thread.start()
+            return True
+    
+    def _drain_training_backlog(self, batch_size: int = 50, retry_delay: float = 60):
+        """Дождаться модели и проиндексировать отложенные документы"""
+        if not self.ensure_embedder():
+            logger.warning("Embedder unavailable, training documents stay pending")
+            return
+        
+        while not self._shutdown.is_set():
+            rows = self.db.query_all("""
+                SELECT p.content_id, t.content, t.source, t.topic, t.content_type
+                FROM training_embed_pending p LEFT JOIN training_data t ON t.id = p.content_id
+                ORDER BY p.content_id LIMIT ?
+            """, (batch_size,))
+            if not rows:
+                break
+            
+            done = 0
+            for content_id, content, source, topic, content_type in rows:
+                # Документ мог быть удалён — пометка просто снимается
+                if content is not None:
+                    try:
+                        self._embed_training_document(content_id, content, source, topic, content_type)
+                    except Exception as e:
+                        logger.error(f"Training backlog failed on #{content_id}, retrying in {retry_delay}s: {e}")
+                        break
+                with self.db.transaction() as cursor:
+                    cursor.execute("DELETE FROM training_embed_pending WHERE content_id = ?", (content_id,))
+                done += 1
+            
+            if done:
+                self._bump_generation("training")
+                logger.info(f"📥 Training backlog: {done} documents embedded")
+            if done < len(rows):
+                self._shutdown.wait(retry_delay)
+    
+    def _find_duplicate_document(self, cursor, content: str, topic: str) -> Optional[int]:
+        """
+        Проверка документа на точный дубликат (учитывается в статистике)
+        
+        Почти-дубликат (правка статьи) не отбрасывается целиком:
+        неизменившиеся чанки отсеет дедупликация чанков, изменившиеся попадут в индекс.
+        """
+        duplicate = self.dedup.find_duplicate(cursor, content, "document", exact_only=True)
+        self.dedup.count(cursor, "document", 1, 1 if duplicate else 0)
+        
+        if duplicate:
+            kind, ref_id = duplicate
+            logger.info(f"♻️ Skipped {kind} duplicate of #{ref_id} for {topic}")
+            return ref_id
+        return None
+    
+    # ==================== BULK INGESTION ====================
+    
+    def add_dialogues_bulk(
+        self,
+        dialogues: Iterable[Dict[str, Any]],
+        batch_size: int = 1000
+    ) -> int:
+        """
+        Массовое добавление диалогов
+        
+        dialogues: итератор/генератор словарей с ключами
+        user_message, assistant_message, model_used, success_rating
+        """
+        total = 0
+        
+        for batch in self._iter_batches(dialogues, batch_size):
+            rows = [(
+                d["user_message"],
+                d["assistant_message"],
+                d.get("model_used", "unknown"),
+                d.get("success_rating", 0.5)
+            ) for d in batch]
+            
+            # Модель ещё грузится: векторы допишет write-behind по пометкам
+            deferred = (
+                not self.is_ready
+                and self._vectors_enabled("dialogues")
+                and self.write_behind is not None
+            )
+            
+            # Одна транзакция на батч
+            with self.db.transaction() as cursor:
+                ids = []
+                for row in rows:
+                    cursor.execute("""
+                        INSERT INTO dialogues 
+                        (user_message, assistant_message, model_used, success_rating)
+                        VALUES (?, ?, ?, ?)
+                    """, row)
+                    ids.append(cursor.lastrowid)
+                if deferred:
+                    DialogueWriteBehind.mark_pending(cursor, ids)
+            
+            total += len(rows)
+            
+            if deferred:
+                self.write_behind.defer(ids)
+            elif self.collections.get("dialogues") and self.is_ready:
+                try:
+                    self._embed_dialogues(ids, rows)
+                except Exception as e:
+                    logger.error(f"Failed to add dialogues batch to ChromaDB: {e}")
+            
+            self._bump_generation("dialogues")
+            logger.info(f"📥 Bulk dialogues: {total} added")
+        
+        return total
+    
+    def _embed_dialogues(self, ids: List[int], rows: List[tuple]):
+        """Эмбеддинг и вставка в коллекцию dialogues: rows — (user, assistant, model, rating)"""
+        texts = [f"USER: {u}\nASSISTANT: {a}" for u, a, _, _ in rows]
+        model_name = self.model_name
+        embeddings = self.encode_batch(texts)
+        
+        self._chroma_add(
+            "dialogues",
+            embeddings,
+            texts,
+            [{
+                "model": model_used,
+                "rating": success_rating,
+                "db_id": dialogue_id,
+                "type": "dialogue",
+                "embedding_model": model_name
+            } for dialogue_id, (_, _, model_used, success_rating) in zip(ids, rows)],
+            [f"dialogue_{dialogue_id}" for dialogue_id in ids]
+        )
+    
+    def add_training_bulk(
+        self,
+        documents: Iterable[Dict[str, Any]],
+        batch_size: int = 200
+    ) -> int:
+        """
+        Массовое добавление обучающих документов
+        
+        documents: итератор/генератор словарей с ключами
+        content, source, topic, content_type
+        """
+        total = 0
+        
+        for batch in self._iter_batches(documents, batch_size):
+            total += sum(self.add_training_batch(batch))
+            logger.info(f"📥 Bulk training: {total} documents added")
+        
+        return total
+    
+    def add_training_batch(self, documents: List[Dict[str, Any]]) -> List[bool]:
+        """
+        Пачка обучающих документов одной транзакцией
+        
+        Возвращает флаги по порядку documents: True — документ новый и сохранён,
+        False — дубликат уже сохранённого.
+        """
+        rows = [(
+            d["content"],
+            d.get("source", "unknown"),
+            d.get("topic", ""),
+            d.get("content_type", "article")
+        ) for d in documents]
+        
+        # Модель ещё грузится: документы эмбеддит фоновый поток по пометкам
+        deferred = self._vectors_enabled("training") and not self.is_ready
+        embed = self.collections.get("training") is not None and self.is_ready
+        
+        # Нарезка и токенизация — до транзакции: блокировка записи только на INSERT
+        chunked = (
+            [list(self._chunk_content(row[0])) for row in rows] if embed
+            else [[] for _ in rows]
+        )
+        
+        # Одна транзакция на батч; дубликаты документов отсеиваются до эмбеддинга
+        flags = []
+        with self.db.transaction() as cursor:
+            added = []
+            for row, doc_chunks in zip(rows, chunked):
+                if self._find_duplicate_document(cursor, row[0], row[2]) is not None:
+                    flags.append(False)
+                    continue
                 
-                logger.debug(f"Added {len(chunks)} chunks for {topic}")
+                cursor.execute("""
+                    INSERT INTO training_data 
+                    (content, source, topic, content_type)
+                    VALUES (?, ?, ?, ?)
+                """, row)
+                content_id = cursor.lastrowid
+                self.dedup.register(cursor, row[0], "document", content_id)
                 
+                if deferred:
+                    cursor.execute(
+                        "INSERT OR IGNORE INTO training_embed_pending (content_id) VALUES (?)",
+                        (content_id,)
+                    )
+                added.append((content_id, row, doc_chunks))
+                flags.append(True)
+        
+        if deferred:
+            self.start_training_backlog()
+        elif embed and added:
+            try:
+                # Чанки всех документов батча эмбеддятся вместе
+                self._embed_training_chunks([
+                    (content_id, (source, topic, content_type), i, chunk)
+                    for content_id, (_, source, topic, content_type), doc_chunks in added
+                    for i, chunk in doc_chunks
+                ])
             except Exception as e:
-                logger.error(f"Failed to add training content: {e}")
+                logger.error(f"Failed to add training batch to ChromaDB, retrying in background: {e}")
+                self._defer_training([content_id for content_id, _, _ in added])
         
-        return content_id
+        self._bump_generation("training")
+        return flags
+    
+    @staticmethod
+    def iter_ii_agent_conversations(db_path: str = "/app/ii_agent.db") -> Iterator[Dict[str, Any]]:
+        """Генератор исторических диалогов из ii_agent.db для add_dialogues_bulk"""
+        conn = sqlite3.connect(str(db_path))
+        try:
+            cursor = conn.execute("""
+                SELECT query, response, model_used, rating
+                FROM conversations
+                WHERE query IS NOT NULL AND response IS NOT NULL
+                ORDER BY id
+            """)
+            for query, response, model_used, rating in cursor:
+                # rating: >0 понравилось, <0 не понравилось, 0 без оценки
+                if rating and rating > 0:
+                    success_rating = 1.0
+                elif rating and rating < 0:
+                    success_rating = 0.0
+                else:
+                    success_rating = 0.5
+                
+                yield {
+                    "user_message": query,
+                    "assistant_message": response,
+                    "model_used": model_used or "unknown",
+                    "success_rating": success_rating
+                }
+        finally:
+            conn.close()
     
     def training_cycle(self) -> bool:
-        """Один цикл обучения"""
+        """Один цикл обучения: самая приоритетная тема из планировщика"""
+        picked = self.training_scheduler.next_topic()
+        if picked is None:
+            logger.info("All training topics are fresh or backing off")
+            return False
+        return self.train_topic(*picked) == ADDED
+    
+    def train_topic(
+        self,
+        category: str,
+        topic: str,
+        fetched: Optional[Dict[str, Optional[str]]] = None
+    ) -> str:
+        """
+        Обучение на одной теме; исход записывается в планировщик
+
+        fetched — результат MediaWikiFetcher.fetch пачкой (тема уже проверена через API).
+        """
+        logger.info(f"📚 Training on: {category} / {topic}")
+        content = None
+        
         try:
-            # Выбираем случайную категорию и тему
-            import random
-            category = random.choice(list(self.learning_sources.keys()))
-            topics = self.learning_sources[category]
-            topic = random.choice(topics)
-            
-            logger.info(f"📚 Training on: {category} / {topic}")
-            
-            # Парсим контент
-            if category == "wikipedia":
-                content = self.scrape_wikipedia(topic)
+            if category in self.WIKI_CATEGORIES:
                 source = "wikipedia"
+                if fetched is None:
+                    try:
+                        fetched = self.wiki.fetch([topic])
+                    except requests.RequestException as e:
+                        logger.warning(f"MediaWiki API error for {topic}, falling back to HTML: {e}")
+                        fetched = {topic: self.scrape_wikipedia_html(topic)}
+                # Та же ревизия, что при прошлой загрузке: текст — из хранилища,
+                # а «не изменилась» решает планировщик по хэшу последнего ADDED
+                # (загрузка могла пройти, а добавление в базу — нет)
+                outcome = None
+                content = fetched[topic] if topic in fetched else self.wiki.get_text(topic)
             else:
-                content = self.scrape_programming_content(topic)
                 source = "web"
+                content = self.scrape_programming_content(topic)
+                outcome = LOW_VALUE if content and PLACEHOLDER_CONTENT in content else None
             
-            if not content or len(content) < 100:
-                logger.warning(f"Insufficient content for {topic}")
-                return False
-            
-            # Добавляем в базу
-            self.add_training_content(
-                content=content,
-                source=source,
-                topic=topic,
-                content_type="article"
-            )
-            
-            logger.info(f"✅ Added {len(content)} chars for {topic}")
-            return True
-            
+            if outcome is None:
+                if not content or len(content) < 100:
+                    logger.warning(f"Insufficient content for {topic}")
+                    outcome = FAILED
+                elif self.training_scheduler.is_unchanged(category, topic, content):
+                    outcome = UNCHANGED
+                elif self.add_training_batch([{
+                    "content": content,
+                    "source": source,
+                    "topic": topic,
+                    "content_type": "article"
+                }])[0]:
+                    logger.info(f"✅ Added {len(content)} chars for {topic}")
+                    outcome = ADDED
+                else:
+                    # Тот же документ уже в базе (например, под другой темой)
+                    outcome = UNCHANGED
         except Exception as e:
             logger.error(f"Training cycle error: {e}")
-            return False
+            outcome = FAILED
+        
+        self.training_scheduler.record(
+            category, topic, outcome,
+            chars=len(content) if outcome == ADDED else 0,
+            text=content if outcome == ADDED else None
+        )
+        return outcome
+    
+    def refresh_change_signals(self) -> int:
+        """Сигналы об изменениях: новые ревизии статей Википедии (один запрос на 50 статей)"""
+        marked = 0
+        for category in self.WIKI_CATEGORIES:
+            topics = self.learning_sources.get(category, [])
+            if not topics:
+                continue
+            try:
+                changed = self.wiki.check_revisions(topics)
+            except requests.RequestException as e:
+                logger.warning(f"Revision check failed for {category}: {e}")
+                continue
+            marked += self.training_scheduler.mark_changed(
+                category, [topic for topic, revid in changed.items() if revid is not None]
+            )
+        return marked
+    
+    def _sleep_while_training(self, seconds: float):
+        """Пауза, прерываемая stop_training"""
+        until = time.time() + seconds
+        while self.training_active and time.time() < until:
+            time.sleep(min(1.0, until - time.time()))
+    
+    def get_training_freshness(self) -> List[Dict[str, Any]]:
+        """Свежесть знаний по темам (возраст, интервал обновления, срок, полезность)"""
+        return self.training_scheduler.get_freshness()
     
     def run_night_training(
         self,
         hours: int = 8,
-        cycles_per_hour: int = 4
+        cycles_per_hour: int = 4,
+        crawler_config=None
     ):
         """Ночное обучение"""
         self.training_active = True
-        total_cycles = hours * cycles_per_hour
-        interval = 3600 / cycles_per_hour
         
         # Записываем старт
-        conn = sqlite3.connect(str(self.db_path))
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO training_history (started_at, status)
-            VALUES (?, 'running')
-        """, (datetime.now(),))
-        session_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO training_history (started_at, status)
+                VALUES (?, 'running')
+            """, (datetime.now(),))
+            session_id = cursor.lastrowid
+        
+        if CRAWLER_AVAILABLE:
+            self._run_crawler_training(session_id, hours, cycles_per_hour, crawler_config)
+            return
         
         logger.info(f"🌙 NIGHT TRAINING STARTED")
-        logger.info(f"Duration: {hours}h ({total_cycles} cycles)")
+        logger.info(f"Duration: {hours}h (up to {hours * cycles_per_hour} new items)")
         
-        success_count = 0
+        self.training_scheduler.sync_topics(self.learning_sources)
+        total_cycles, success_count = self._train_scheduled(time.time() + hours * 3600, cycles_per_hour)
         
-        for i in range(total_cycles):
-            if not self.training_active:
-                logger.info("Training stopped by user")
-                break
-            
-            logger.info(f"🔄 Cycle {i+1}/{total_cycles}")
-            
-            if self.training_cycle():
-                success_count += 1
-            
-            if i < total_cycles - 1:
-                logger.info(f"😴 Sleeping {interval:.0f}s...\n")
-                time.sleep(interval)
+        if not self.training_active:
+            logger.info("Training stopped by user")
         
         # Завершение
-        conn = sqlite3.connect(str(self.db_path))
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE training_history 
-            SET finished_at = ?, cycles_completed = ?, 
-                items_added = ?, success_rate = ?, status = 'completed'
-            WHERE id = ?
-        """, (
-            datetime.now(),
-            total_cycles,
-            success_count,
-            success_count / max(total_cycles, 1),
-            session_id
-        ))
-        conn.commit()
-        conn.close()
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                UPDATE training_history 
+                SET finished_at = ?, cycles_completed = ?, 
+                    items_added = ?, success_rate = ?, status = 'completed'
+                WHERE id = ?
+            """, (
+                datetime.now(),
+                total_cycles,
+                success_count,
+                success_count / max(total_cycles, 1),
+                session_id
+            ))
         
         self.training_active = False
         
@@ -458,6 +1782,138 @@ class UnifiedRAGSystem:
         logger.info(f"Success rate: {success_count}/{total_cycles}")
         logger.info(f"Total items in DB: {stats}")
     
+    def _train_scheduled(
+        self,
+        deadline: float,
+        cycles_per_hour: int,
+        fetched: Optional[Dict[str, Optional[str]]] = None,
+        signals_at: float = 0.0
+    ) -> Tuple[int, int]:
+        """
+        Цикл планировщика до deadline: next_topic → train_topic → record
+
+        fetched — тексты, заранее загруженные пачкой через API (каждый используется один раз);
+        signals_at — время последней проверки ревизий. Возвращает (циклов, добавлено).
+        """
+        # Темп: cycles_per_hour новых материалов; пустые исходы не тратят интервал
+        interval = 3600 / cycles_per_hour
+        fetched = dict(fetched or {})
+        total_cycles = 0
+        success_count = 0
+        
+        while self.training_active and time.time() < deadline:
+            # Ревизии статей проверяются раз в час
+            if time.time() - signals_at >= 3600:
+                marked = self.refresh_change_signals()
+                signals_at = time.time()
+                if marked:
+                    logger.info(f"📰 {marked} topics changed upstream")
+            
+            picked = self.training_scheduler.next_topic()
+            if picked is None:
+                due_in = self.training_scheduler.next_due_in()
+                wait = min(due_in if due_in is not None else interval, interval, deadline - time.time())
+                logger.info(f"😴 Nothing due, sleeping {wait:.0f}s...\n")
+                self._sleep_while_training(wait)
+                continue
+            
+            total_cycles += 1
+            logger.info(f"🔄 Cycle {total_cycles}")
+            
+            topic = picked[1]
+            prefetched = {topic: fetched.pop(topic)} if topic in fetched else None
+            if self.train_topic(*picked, fetched=prefetched) == ADDED:
+                success_count += 1
+                logger.info(f"😴 Sleeping {interval:.0f}s...\n")
+                self._sleep_while_training(min(interval, deadline - time.time()))
+            else:
+                # Неизменившиеся, заглушки и ошибки — сразу следующая тема
+                self._sleep_while_training(1.0)
+        
+        return total_cycles, success_count
+    
+    def _run_crawler_training(
+        self,
+        session_id: int,
+        hours: float,
+        cycles_per_hour: int = 4,
+        crawler_config=None
+    ):
+        """
+        Ночное обучение: стартовые темы — пачкой через MediaWiki API и через цикл планировщика
+        (темп cycles_per_hour), асинхронный краулер в отдельном потоке — расширение по ссылкам
+        (темп задаёт вежливость)
+        """
+        import asyncio
+        from dataclasses import replace
+        from crawler import AsyncCrawler, CrawlerConfig
+        
+        # Текст стартовых страниц уже загружен через API: краулер берёт с них только ссылки
+        crawler = AsyncCrawler(self, replace(crawler_config or CrawlerConfig(), embed_seeds=False))
+        # Стартовые темы — только те, которым пора, в порядке приоритета
+        self.training_scheduler.sync_topics(self.learning_sources)
+        self.refresh_change_signals()
+        seeds = self.training_scheduler.ranked(categories=self.WIKI_CATEGORIES)
+        topics = [topic for _, topic, _ in seeds]
+        
+        try:
+            fetched = self.wiki.fetch(topics)
+        except requests.RequestException as e:
+            logger.warning(f"MediaWiki API error, seeding topics one by one: {e}")
+            fetched = None
+        crawler.seed_topics(topics)
+        deadline = time.time() + hours * 3600
+        
+        logger.info(f"🌙 NIGHT TRAINING STARTED (async crawler)")
+        logger.info(
+            f"Duration: {hours}h, {len(topics)} seed topics "
+            f"(up to {hours * cycles_per_hour} new items via API)"
+        )
+        
+        crawl: Dict[str, Any] = {}
+        
+        def run_crawler():
+            try:
+                crawl["result"] = asyncio.run(crawler.run(
+                    deadline=deadline,
+                    should_continue=lambda: self.training_active
+                ))
+            except Exception as e:
+                logger.error(f"Crawler training error: {e}")
+        
+        crawler_thread = threading.Thread(target=run_crawler, name="rag-crawler", daemon=True)
+        crawler_thread.start()
+        # Стартовые темы — через планировщик: темп, приоритеты и запись исходов как без краулера;
+        # темы, до которых не дошла очередь, остаются к сроку для следующей сессии
+        cycles, seeds_added = self._train_scheduled(
+            deadline, cycles_per_hour, fetched=fetched, signals_at=time.time()
+        )
+        crawler_thread.join()
+        
+        status = "completed" if "result" in crawl else "failed"
+        result = crawl.get("result") or dict(crawler.stats)
+        
+        # Исходы тем записаны train_topic; краулер добавляет найденные по ссылкам
+        attempts = cycles + result["fetched"] + result["failed"]
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                UPDATE training_history 
+                SET finished_at = ?, cycles_completed = ?, 
+                    items_added = ?, success_rate = ?, status = ?
+                WHERE id = ?
+            """, (
+                datetime.now(),
+                attempts,
+                seeds_added + result["documents_added"],
+                (seeds_added + result["fetched"]) / max(attempts, 1),
+                status,
+                session_id
+            ))
+        
+        self.training_active = False
+        logger.info(f"\n🎉 TRAINING COMPLETED!")
+        logger.info(f"Crawler: {result}")
+    
     def start_training_thread(
         self,
         hours: int = 8,
@@ -479,49 +1935,233 @@ class UnifiedRAGSystem:
         """Остановка обучения"""
         self.training_active = False
     
-    # ==================== STATS ====================
+    # ==================== REINDEX ====================
     
-    def get_stats(self) -> Dict[str, Any]:
-        """Статистика"""
-        conn = sqlite3.connect(str(self.db_path))
-        cursor = conn.cursor()
+    def start_reindex(
+        self,
+        model_name: Optional[str] = None,
+        batch_size: int = 256,
+        drop_old: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Фоновая переиндексация моделью model_name (по умолчанию — текущей)
         
-        stats = {}
+        Прерванная задача с той же моделью продолжается с контрольной точки.
+        Поиск работает по старым коллекциям до атомарного переключения.
+        """
+        model_name = model_name or self.model_name
         
-        # Подсчёт записей
-        cursor.execute("SELECT COUNT(*) FROM dialogues")
-        stats["dialogues"] = cursor.fetchone()[0]
+        if self.reindex_job and self.reindex_job.thread and self.reindex_job.thread.is_alive():
+            return {"error": "Reindex already running", **self.reindex_job.get_status()}
         
-        cursor.execute("SELECT COUNT(*) FROM training_data")
-        stats["training_items"] = cursor.fetchone()[0]
+        job = ReindexJob.find_unfinished(self)
+        if job and job.model_name != model_name:
+            logger.info(f"Abandoning unfinished reindex #{job.job_id} ({job.model_name})")
+            job.abandon()
+            job = None
         
-        # Размеры
-        db_size = self.db_path.stat().st_size / (1024 * 1024)
-        stats["db_size_mb"] = round(db_size, 2)
+        if job:
+            job.batch_size, job.drop_old = batch_size, drop_old
+            logger.info(f"▶️ Resuming reindex #{job.job_id}")
+        else:
+            job = ReindexJob(self, model_name, batch_size=batch_size, drop_old=drop_old)
+        
+        self.reindex_job = job.start()
+        return job.get_status()
+    
+    def get_reindex_status(self) -> Optional[Dict[str, Any]]:
+        """Прогресс переиндексации: строки, скорость, ETA"""
+        return self.reindex_job.get_status() if self.reindex_job else None
+    
+    def cancel_reindex(self):
+        """Пауза переиндексации (прогресс сохранён в контрольных точках)"""
+        if self.reindex_job:
+            self.reindex_job.cancel()
+    
+    # ==================== RETENTION ====================
+    
+    def compact_dialogues(self, policy: Optional[RetentionPolicy] = None) -> Dict[str, Any]:
+        """Разовое применение политики хранения (строки + векторы + VACUUM)"""
+        if policy is None and self.retention is None:
+            return {"error": "No retention policy configured"}
+        
+        compactor = (
+            RetentionCompactor(self, policy) if policy is not None else self.retention
+        )
+        return compactor.run_once()
+    
+    def convert_to_incremental_vacuum(self) -> Dict[str, Any]:
+        """Обслуживание: перевод старой базы в auto_vacuum=INCREMENTAL (полный VACUUM)"""
+        compactor = self.retention or RetentionCompactor(self, RetentionPolicy())
+        return compactor.convert_to_incremental()
+    
+    # ==================== STATS ====================
+    
+    def start_stats_refresher(self):
+        """Фоновое обновление размера хранилищ раз в stats_refresh_interval секунд"""
+        def refresh_loop():
+            while True:
+                try:
+                    self.refresh_slow_stats()
+                except Exception as e:
+                    logger.debug(f"Stats refresh error: {e}")
+                if self._stats_stop.wait(self.stats_refresh_interval):
+                    return
+        
+        threading.Thread(target=refresh_loop, name="rag-stats", daemon=True).start()
+    
+    def refresh_slow_stats(self) -> Dict[str, Any]:
+        """Пересчёт показателей, требующих обхода файлов/таблиц"""
+        slow = {"refreshed_at": datetime.now().isoformat(timespec="seconds")}
         
         if self.chroma_path.exists():
             chroma_size = sum(
                 f.stat().st_size for f in self.chroma_path.rglob('*') if f.is_file()
             ) / (1024 * 1024)
-            stats["chroma_size_mb"] = round(chroma_size, 2)
+            slow["chroma_size_mb"] = round(chroma_size, 2)
+        
+        slow["wiki_storage"] = self.wiki.get_storage_stats()
+        slow["training_scheduler"] = self.training_scheduler.get_stats()
+        
+        self._slow_stats = slow
+        return slow
+    
+    
+    def get_quantization_report(
+        self,
+        collection: str = "dialogues",
+        sample_size: int = 5000,
+        query_count: int = 200,
+        k: int = 10
+    ) -> Dict[str, Any]:
+        """Экономия памяти и потеря recall квантованного хранения на своём корпусе"""
+        if not self.ensure_embedder():
+            return {"success": False, "error": "Embedder not available"}
+        
+        if collection == "dialogues":
+            rows = self.db.query_all("""
+                SELECT user_message, assistant_message FROM dialogues
+                ORDER BY id DESC LIMIT ?
+            """, (sample_size,))
+            corpus = [f"USER: {u}\nASSISTANT: {a}" for u, a in rows]
+            queries = [u for u, _ in rows[:query_count]]
+        else:
+            rows = self.db.query_all("""
+                SELECT content FROM training_data
+                ORDER BY id DESC LIMIT ?
+            """, (sample_size,))
+            corpus = [chunk for (content,) in rows for _, chunk in self._chunk_content(content)]
+            corpus = corpus[:sample_size]
+            queries = [chunk[:200] for chunk in corpus[::max(len(corpus) // query_count, 1)]]
+            queries = queries[:query_count]
+        
+        if not corpus or not queries:
+            return {"success": False, "error": f"Not enough data in {collection}"}
+        
+        report = quantization_report(
+            self.encode_batch(corpus),
+            self.encode_batch(queries),
+            k=k
+        )
+        report["success"] = True
+        report["collection"] = collection
+        return report
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика"""
+        stats = {}
+        
+        # Счётчики поддерживаются триггерами при записи
+        counters = dict(self.db.query_all("SELECT name, value FROM stats_counters"))
+        stats["dialogues"] = int(counters.get("dialogues", 0))
+        stats["training_items"] = int(counters.get("training_items", 0))
+        
+        # Размеры
+        # В режиме WAL часть данных ещё лежит в -wal файле
+        wal_path = self.db_path.with_name(self.db_path.name + "-wal")
+        db_size = (
+            self.db_path.stat().st_size
+            + (wal_path.stat().st_size if wal_path.exists() else 0)
+        ) / (1024 * 1024)
+        stats["db_size_mb"] = round(db_size, 2)
+        
+        # Размер ChromaDB — из фонового обновления
+        slow = self._slow_stats
+        if "chroma_size_mb" in slow:
+            stats["chroma_size_mb"] = slow["chroma_size_mb"]
+        stats["slow_stats_refreshed_at"] = slow.get("refreshed_at")
+        
+        if self.vector_backend == "numpy":
+            stats["vector_index"] = {
+                key: coll.get_stats() for key, coll in self.collections.items()
+            }
+        stats["vector_backend"] = self.vector_backend
+        stats["embedding_model"] = self.model_name
+        stats["embedder_backend"] = self.embedder_backend
+        if self.onnx_check is not None:
+            stats["onnx_check"] = self.onnx_check
+        if self.reindex_job:
+            stats["reindex"] = self.reindex_job.get_status()
         
         # Статус обучения
         stats["training_active"] = self.training_active
+        stats["embedder_state"] = self.embedder_state
+        
+        # Пропускная способность энкодера
+        stats["embedded_chunks"] = self.embed_stats["chunks"]
+        stats["embed_chunks_per_sec"] = self.get_embed_throughput()
+        stats["query_cache"] = self.query_cache.get_stats()
+        if self.embedding_cache is not None:
+            stats["embedding_cache"] = self.embedding_cache.get_stats()
         
         # История обучения
-        cursor.execute("""
-            SELECT COUNT(*), SUM(items_added), AVG(success_rate)
-            FROM training_history
-            WHERE status = 'completed'
-        """)
-        row = cursor.fetchone()
-        stats["training_sessions"] = row[0] if row[0] else 0
-        stats["total_trained_items"] = row[1] if row[1] else 0
-        stats["avg_success_rate"] = round(row[2], 3) if row[2] else 0
+        sessions = int(counters.get("training_sessions", 0))
+        stats["training_sessions"] = sessions
+        stats["total_trained_items"] = int(counters.get("total_trained_items", 0))
+        stats["avg_success_rate"] = (
+            round(counters.get("success_rate_sum", 0) / sessions, 3) if sessions else 0
+        )
+        
+        # Доля дубликатов в обучающем конвейере
+        stats["dedup"] = DuplicateDetector.get_stats(self.db)
+        
+        # Трафик MediaWiki API и сжатие сохранённых статей
+        stats["wiki"] = {
+            **self.wiki.get_stats(include_storage=False),
+            **slow.get("wiki_storage", {})
+        }
+        
+        stats["search_cache"] = self.search_cache.get_stats()
+        if self.embedding_service is not None:
+            stats["embedding_service"] = self.embedding_service.get_stats()
+        if self.write_behind is not None:
+            stats["write_behind"] = self.write_behind.get_stats()
+        if self.retention is not None:
+            stats["retention"] = self.retention.get_stats()
+        
+        # Счётчики SQLite (ожидание блокировок, время запросов)
+        stats["sqlite"] = self.db.get_stats()
         
-        conn.close()
         return stats
 
 
-# Глобальный экземпляр
-rag_system = UnifiedRAGSystem()
+# Глобальный экземпляр (создаётся лениво, при первом обращении)
+_rag_system: Optional[UnifiedRAGSystem] = None
+_rag_system_lock = threading.Lock()
+
+
+def get_rag_system() -> UnifiedRAGSystem:
+    """Общий экземпляр UnifiedRAGSystem"""
+    global _rag_system
+    if _rag_system is None:
+        with _rag_system_lock:
+            if _rag_system is None:
+                _rag_system = UnifiedRAGSystem()
+    return _rag_system
+
+
+def __getattr__(name: str):
+    # Совместимость: from rag_system import rag_system
+    if name == "rag_system":
+        return get_rag_system()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
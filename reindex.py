@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+"""
+Re-embedding Job
+Возобновляемая фоновая переиндексация под новую модель эмбеддингов:
+теневые коллекции, контрольные точки в SQLite, атомарное переключение
+"""
+import logging
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from chunker import iter_chunks, DEFAULT_MAX_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# Источники: таблицы SQLite (потоково по id) и коллекции без таблицы (копия документов)
+SQL_SOURCES = ("dialogues", "training")
+COPY_SOURCES = ("code", "solutions")
+
+
+def base_collection_name(name: str) -> str:
+    """Имя коллекции без суффикса задачи: user_dialogues_v3 -> user_dialogues"""
+    return re.sub(r"_v\d+$", "", name)
+
+
+class ReindexJob:
+    """
+    Переиндексация всех векторов моделью model_name
+
+    Строки dialogues/training_data читаются по возрастанию id и эмбеддятся
+    батчами в теневые коллекции <имя>_v<job_id>. После каждого батча
+    last_id сохраняется в reindex_checkpoints, поэтому после перезапуска
+    задача продолжается с места остановки. По завершении активные коллекции
+    и модель подменяются разом (vector_collections + объекты в памяти).
+    """
+
+    def __init__(
+        self,
+        rag,
+        model_name: str,
+        batch_size: int = 256,
+        drop_old: bool = True,
+        job_id: Optional[int] = None
+    ):
+        self.rag = rag
+        self.db = rag.db
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.drop_old = drop_old
+
+        self.embedder = None
+        self.thread: Optional[threading.Thread] = None
+        self._cancel = threading.Event()
+
+        # Скорость считается по текущему запуску (после возобновления — заново)
+        self.run_started: Optional[float] = None
+        self.run_rows = 0
+        self.status = "pending"
+        self.error: Optional[str] = None
+
+        if job_id is None:
+            with self.db.transaction() as cursor:
+                cursor.execute("""
+                    INSERT INTO reindex_jobs (model, status, started_at, rows_total)
+                    VALUES (?, 'running', ?, ?)
+                """, (model_name, datetime.now(), self._count_rows()))
+                job_id = cursor.lastrowid
+                cursor.executemany(
+                    "INSERT INTO reindex_checkpoints (job_id, source) VALUES (?, ?)",
+                    [(job_id, source) for source in SQL_SOURCES + COPY_SOURCES]
+                )
+        self.job_id = job_id
+
+        self.shadow_names = {
+            key: f"{base_collection_name(name)}_v{self.job_id}"
+            for key, name in rag.collection_names.items()
+        }
+
+    @staticmethod
+    def create_tables(cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS reindex_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                model TEXT NOT NULL,
+                status VARCHAR(20),
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                rows_total INTEGER DEFAULT 0,
+                rows_done INTEGER DEFAULT 0,
+                chunks INTEGER DEFAULT 0,
+                error TEXT
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS reindex_checkpoints (
+                job_id INTEGER NOT NULL,
+                source VARCHAR(20) NOT NULL,
+                last_id INTEGER DEFAULT 0,
+                rows_done INTEGER DEFAULT 0,
+                finished INTEGER DEFAULT 0,
+                PRIMARY KEY (job_id, source)
+            )
+        """)
+
+    @classmethod
+    def find_unfinished(cls, rag) -> Optional["ReindexJob"]:
+        """Прерванная задача (статус running после перезапуска)"""
+        row = rag.db.query_one(
+            "SELECT id, model FROM reindex_jobs WHERE status = 'running' ORDER BY id DESC LIMIT 1"
+        )
+        if not row:
+            return None
+        return cls(rag, row[1], job_id=row[0])
+
+    # ==================== LIFECYCLE ====================
+
+    def start(self) -> "ReindexJob":
+        self.thread = threading.Thread(target=self.run, name="rag-reindex", daemon=True)
+        self.thread.start()
+        return self
+
+    def cancel(self, wait: bool = True):
+        """Остановка с сохранением прогресса; задачу можно будет продолжить"""
+        self._cancel.set()
+        if wait and self.thread is not None:
+            self.thread.join()
+
+    def abandon(self):
+        """Отказ от задачи: теневые коллекции удаляются"""
+        self.cancel()
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                "UPDATE reindex_jobs SET status = 'cancelled', finished_at = ? WHERE id = ?",
+                (datetime.now(), self.job_id)
+            )
+        for name in self.shadow_names.values():
+            self.rag._drop_collection(name)
+
+    def run(self):
+        self.status = "running"
+        self.run_started = time.time()
+        self.run_rows = 0
+        logger.info(f"🔁 Reindex #{self.job_id} → {self.model_name}")
+
+        try:
+            self.embedder = self._load_embedder()
+            shadow = {key: self.rag._open_collection(name) for key, name in self.shadow_names.items()}
+
+            for source in COPY_SOURCES:
+                if not self._cancel.is_set():
+                    self._copy_collection(source, shadow)
+
+            for source in SQL_SOURCES:
+                self._reindex_source(source, shadow)
+
+            if self._cancel.is_set():
+                self.status = "paused"
+                logger.info(f"⏸️ Reindex #{self.job_id} paused")
+                return
+
+            self._switch(shadow)
+            self.status = "completed"
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            logger.error(f"Reindex #{self.job_id} failed: {e}")
+            with self.db.transaction() as cursor:
+                cursor.execute(
+                    "UPDATE reindex_jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                    (str(e), datetime.now(), self.job_id)
+                )
+
+    def _load_embedder(self):
+        """Модель задачи; текущая переиспользуется, если совпадает"""
+        if self.model_name == self.rag.model_name and self.rag.ensure_embedder():
+            return self.rag.embedder
+
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(self.model_name)
+
+    # ==================== STREAMING ====================
+
+    def _count_rows(self) -> int:
+        total = sum(
+            self.db.query_one(f"SELECT COUNT(*) FROM {table}")[0]
+            for table in ("dialogues", "training_data")
+        )
+        for key in COPY_SOURCES:
+            coll = self.rag.collections.get(key)
+            if coll is not None:
+                total += coll.count()
+        return total
+
+    def _checkpoint(self, source: str) -> Tuple[int, bool]:
+        row = self.db.query_one(
+            "SELECT last_id, finished FROM reindex_checkpoints WHERE job_id = ? AND source = ?",
+            (self.job_id, source)
+        )
+        return (row[0], bool(row[1])) if row else (0, False)
+
+    def _save_checkpoint(self, source: str, last_id: int, rows: int, chunks: int, finished: bool = False):
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                UPDATE reindex_checkpoints
+                SET last_id = ?, rows_done = rows_done + ?, finished = ?
+                WHERE job_id = ? AND source = ?
+            """, (last_id, rows, int(finished), self.job_id, source))
+            cursor.execute("""
+                UPDATE reindex_jobs SET rows_done = rows_done + ?, chunks = chunks + ?
+                WHERE id = ?
+            """, (rows, chunks, self.job_id))
+        self.run_rows += rows
+
+    def _iter_rows(self, source: str, after_id: int) -> Iterator[List[tuple]]:
+        """Батчи строк по возрастанию id (keyset-пагинация)"""
+        query = {
+            "dialogues": """
+                SELECT id, user_message, assistant_message, model_used, success_rating
+                FROM dialogues WHERE id > ? ORDER BY id LIMIT ?
+            """,
+            "training": """
+                SELECT id, content, source, topic, content_type
+                FROM training_data WHERE id > ? ORDER BY id LIMIT ?
+            """,
+        }[source]
+
+        while True:
+            rows = self.db.query_all(query, (after_id, self.batch_size))
+            if not rows:
+                return
+            yield rows
+            after_id = rows[-1][0]
+
+    def _reindex_source(
+        self,
+        source: str,
+        shadow: Dict[str, Any],
+        cancellable: bool = True,
+        skip_indexed: bool = False
+    ):
+        """
+        Строки таблицы-источника после контрольной точки — в теневую коллекцию
+
+        skip_indexed — пропуск строк, которые писатели уже добавили в коллекцию сами
+        (после подмены они пишут в новую коллекцию со своими id).
+        """
+        last_id, finished = self._checkpoint(source)
+        if finished:
+            return
+
+        for rows in self._iter_rows(source, last_id):
+            if cancellable and self._cancel.is_set():
+                return
+
+            pending = self._unindexed(shadow[source], rows) if skip_indexed else rows
+            texts, metadatas, ids = self._prepare(source, pending)
+            if texts:
+                embeddings = self.rag.encode_batch(
+                    texts, embedder=self.embedder, model_name=self.model_name
+                )
+                self.rag._collection_add(shadow[source], embeddings, texts, metadatas, ids)
+
+            self._save_checkpoint(source, rows[-1][0], len(rows), len(texts))
+
+        self._save_checkpoint(source, self._checkpoint(source)[0], 0, 0, finished=True)
+
+    @staticmethod
+    def _unindexed(collection, rows: List[tuple]) -> List[tuple]:
+        """Строки, для которых в коллекции ещё нет векторов (по db_id)"""
+        found = collection.get(
+            where={"db_id": {"$in": [row[0] for row in rows]}}, include=["metadatas"]
+        )
+        indexed = {meta.get("db_id") for meta in found["metadatas"] if meta}
+        return [row for row in rows if row[0] not in indexed]
+
+    def _prepare(self, source: str, rows: List[tuple]) -> Tuple[List[str], List[Dict[str, Any]], List[str]]:
+        """Тексты, метаданные и детерминированные id (повторная вставка идемпотентна)"""
+        texts, metadatas, ids = [], [], []
+
+        if source == "dialogues":
+            for dialogue_id, user_message, assistant_message, model_used, rating in rows:
+                texts.append(f"USER: {user_message}\nASSISTANT: {assistant_message}")
+                metadatas.append({
+                    "model": model_used or "unknown",
+                    "rating": rating if rating is not None else 0.5,
+                    "db_id": dialogue_id,
+                    "type": "dialogue",
+                    "embedding_model": self.model_name
+                })
+                ids.append(f"dialogue_{dialogue_id}")
+            return texts, metadatas, ids
+
+        max_tokens = (
+            self.rag.chunk_max_tokens
+            or getattr(self.embedder, "max_seq_length", None)
+            or DEFAULT_MAX_TOKENS
+        )
+        cursor = self.db.get_connection()
+        for content_id, content, source_name, topic, content_type in rows:
+            for i, chunk in iter_chunks(
+                content,
+                max_tokens=max_tokens,
+                overlap_tokens=self.rag.chunk_overlap_tokens,
+                count_tokens=self._count_tokens
+            ):
+                if not self._owns_chunk(cursor, content_id, chunk):
+                    continue
+                texts.append(chunk)
+                metadatas.append({
+                    "source": source_name or "unknown",
+                    "topic": topic or "",
+                    "type": content_type or "article",
+                    "db_id": content_id,
+                    "chunk_id": i,
+                    "embedding_model": self.model_name
+                })
+                ids.append(f"train_{content_id}_{i}")
+        return texts, metadatas, ids
+
+    def _owns_chunk(self, cursor, content_id: int, chunk: str) -> bool:
+        """
+        Тот же фильтр дубликатов, что у писателя: чанк индексируется документом,
+        за которым зарегистрирован его хэш, либо если он ещё неизвестен
+        """
+        duplicate = self.rag.dedup.find_duplicate(cursor, chunk, "chunk")
+        if duplicate is None:
+            return True
+        kind, ref_id = duplicate
+        return kind == "exact" and ref_id == content_id
+
+    def _count_tokens(self, text: str) -> int:
+        tokenizer = getattr(self.embedder, "tokenizer", None)
+        if tokenizer is not None:
+            return len(tokenizer.tokenize(text)) + 2
+        return self.rag.count_tokens(text)
+
+    def _copy_collection(self, source: str, shadow: Dict[str, Any]):
+        """Коллекции без таблицы-источника: документы берутся из текущей коллекции"""
+        if self._checkpoint(source)[1]:
+            return
+
+        current = self.rag.collections.get(source)
+        data = current.get() if current is not None else {"ids": []}
+        rows = 0
+
+        for start in range(0, len(data["ids"]), self.batch_size):
+            ids = data["ids"][start:start + self.batch_size]
+            texts = data["documents"][start:start + self.batch_size]
+            metadatas = [
+                dict(meta or {}, embedding_model=self.model_name)
+                for meta in data["metadatas"][start:start + self.batch_size]
+            ]
+            embeddings = self.rag.encode_batch(texts, embedder=self.embedder, model_name=self.model_name)
+            self.rag._collection_add(shadow[source], embeddings, texts, metadatas, ids)
+            rows += len(ids)
+
+        self._save_checkpoint(source, 0, rows, rows, finished=True)
+
+    # ==================== SWITCH ====================
+
+    def _catch_up(self, shadow: Dict[str, Any]):
+        """Строки, добавленные во время переиндексации (без уже проиндексированных писателями)"""
+        for source in SQL_SOURCES:
+            with self.db.transaction() as cursor:
+                cursor.execute(
+                    "UPDATE reindex_checkpoints SET finished = 0 WHERE job_id = ? AND source = ?",
+                    (self.job_id, source)
+                )
+            self._reindex_source(source, shadow, cancellable=False, skip_indexed=True)
+
+    def _switch(self, shadow: Dict[str, Any]):
+        """Атомарная подмена активных коллекций и модели"""
+        self._catch_up(shadow)
+
+        rag = self.rag
+        with rag._switch_lock:
+            self._catch_up(shadow)
+            old_names = dict(rag.collection_names)
+
+            with self.db.transaction() as cursor:
+                cursor.execute("DELETE FROM vector_collections")
+                cursor.executemany(
+                    "INSERT INTO vector_collections (key, name, model) VALUES (?, ?, ?)",
+                    [(key, name, self.model_name) for key, name in self.shadow_names.items()]
+                )
+                cursor.execute(
+                    "UPDATE reindex_jobs SET status = 'completed', finished_at = ? WHERE id = ?",
+                    (datetime.now(), self.job_id)
+                )
+
+            rag.activate_collections(shadow, self.shadow_names, self.model_name, self.embedder)
+
+        # Строки, записанные в старые коллекции в момент подмены
+        self._catch_up(shadow)
+        for source in SQL_SOURCES:
+            rag._bump_generation(source)
+
+        if self.drop_old:
+            for key, name in old_names.items():
+                if name != self.shadow_names.get(key):
+                    rag._drop_collection(name)
+
+        logger.info(f"✅ Reindex #{self.job_id} switched to {self.model_name}")
+
+    # ==================== STATUS ====================
+
+    def get_status(self) -> Dict[str, Any]:
+        """Прогресс, пропускная способность и ETA"""
+        row = self.db.query_one(
+            "SELECT status, rows_total, rows_done, chunks, error FROM reindex_jobs WHERE id = ?",
+            (self.job_id,)
+        )
+        db_status, rows_total, rows_done, chunks, error = row
+        rows_total = max(rows_total or 0, rows_done or 0)
+
+        elapsed = time.time() - self.run_started if self.run_started else 0
+        rate = self.run_rows / elapsed if elapsed > 0 else 0
+        remaining = rows_total - rows_done
+
+        return {
+            "job_id": self.job_id,
+            "model": self.model_name,
+            "status": self.status if self.status in ("running", "paused") else db_status,
+            "rows_total": rows_total,
+            "rows_done": rows_done,
+            "chunks_embedded": chunks,
+            "progress": round(rows_done / rows_total, 4) if rows_total else 1.0,
+            "rows_per_sec": round(rate, 2),
+            "eta_seconds": round(remaining / rate) if rate > 0 else None,
+            "error": self.error or error,
+        }
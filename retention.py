@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Dialogue Retention
+Политика хранения диалогов (TTL, минимальный рейтинг, лимит на модель)
+и фоновый компактор: строки и векторы удаляются вместе, затем incremental VACUUM
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RetentionPolicy:
+    """Правила хранения диалогов; None — правило отключено"""
+    ttl_days: Optional[float] = None            # старше — удаляются
+    min_success_rating: Optional[float] = None  # ниже — удаляются (после grace-периода)
+    rating_grace_hours: float = 24              # время на получение оценки
+    max_per_model: Optional[int] = None         # сверх лимита — удаляются самые старые
+
+    @property
+    def enabled(self) -> bool:
+        return any(v is not None for v in (self.ttl_days, self.min_success_rating, self.max_per_model))
+
+
+class RetentionCompactor:
+    """Фоновое применение RetentionPolicy к dialogues и коллекции dialogues"""
+
+    def __init__(
+        self,
+        rag,
+        policy: RetentionPolicy,
+        interval: float = 3600,
+        batch_size: int = 500,
+        vacuum_pages: int = 10000
+    ):
+        self.rag = rag
+        self.db = rag.db
+        self.policy = policy
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+
+        self._stop = threading.Event()
+        self._run_lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+        self.last_report: Optional[Dict[str, Any]] = None
+        self.totals = {
+            "runs": 0,
+            "rows_deleted": 0,
+            "bytes_reclaimed": 0,
+        }
+
+    # ==================== LIFECYCLE ====================
+
+    def start(self) -> "RetentionCompactor":
+        def loop():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.run_once()
+                except Exception as e:
+                    logger.error(f"Retention compaction error: {e}")
+
+        self.thread = threading.Thread(target=loop, name="rag-retention", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    # ==================== SELECTION ====================
+
+    def _rule_conditions(self) -> Tuple[List[str], List[Any]]:
+        """Условия TTL и минимального рейтинга для WHERE по dialogues"""
+        policy = self.policy
+        conditions, params = [], []
+
+        if policy.ttl_days is not None:
+            conditions.append("created_at < datetime('now', ?)")
+            params.append(f"-{policy.ttl_days * 86400:.0f} seconds")
+
+        if policy.min_success_rating is not None:
+            conditions.append("(success_rating < ? AND created_at < datetime('now', ?))")
+            params.extend([policy.min_success_rating, f"-{policy.rating_grace_hours * 3600:.0f} seconds"])
+
+        return conditions, params
+
+    def _model_cutoffs(self) -> Dict[str, int]:
+        """
+        max_per_model: модель -> id самой новой строки сверх лимита
+
+        Окно ROW_NUMBER() считается один раз за проход и только по строкам,
+        которые переживут TTL и рейтинг; батчи удаляют всё, что не новее отсечки.
+        """
+        if self.policy.max_per_model is None:
+            return {}
+
+        conditions, params = self._rule_conditions()
+        where = f"WHERE NOT COALESCE({' OR '.join(conditions)}, 0)" if conditions else ""
+        return dict(self.db.query_all(f"""
+            SELECT model, id FROM (
+                SELECT COALESCE(model_used, 'unknown') AS model, id, ROW_NUMBER() OVER (
+                    PARTITION BY COALESCE(model_used, 'unknown') ORDER BY id DESC
+                ) AS rank
+                FROM dialogues {where}
+            ) WHERE rank = ?
+        """, (*params, self.policy.max_per_model + 1)))
+
+    def _expired_ids(self, limit: int, cutoffs: Dict[str, int]) -> List[int]:
+        """id диалогов, нарушающих политику (cutoffs — из _model_cutoffs)"""
+        conditions, params = self._rule_conditions()
+
+        for model, cutoff in cutoffs.items():
+            conditions.append("(id <= ? AND COALESCE(model_used, 'unknown') = ?)")
+            params.extend([cutoff, model])
+
+        if not conditions:
+            return []
+
+        query = f"SELECT id FROM dialogues WHERE {' OR '.join(conditions)} ORDER BY id LIMIT ?"
+        return [row[0] for row in self.db.query_all(query, (*params, limit))]
+
+    # ==================== COMPACTION ====================
+
+    def _db_files_size(self) -> int:
+        path = self.rag.db_path
+        wal = path.with_name(path.name + "-wal")
+        return path.stat().st_size + (wal.stat().st_size if wal.exists() else 0)
+
+    def _delete_batch(self, ids: List[int]) -> int:
+        """Сначала векторы, затем строки: повтор после сбоя удалит остаток"""
+        collection = self.rag.collections.get("dialogues")
+        if collection is not None:
+            collection.delete(where={"db_id": {"$in": ids}})
+
+        placeholders = ",".join("?" * len(ids))
+        with self.db.transaction() as cursor:
+            # Триггеры синхронно обновляют FTS и счётчики
+            cursor.execute(f"DELETE FROM dialogues WHERE id IN ({placeholders})", ids)
+            deleted = cursor.rowcount
+
+        self.rag._bump_generation("dialogues")
+        return deleted
+
+    def _incremental_mode(self) -> bool:
+        return self.db.query_one("PRAGMA auto_vacuum")[0] == 2
+
+    def _vacuum(self) -> Dict[str, Any]:
+        """Incremental VACUUM и усечение WAL (полный VACUUM — только convert_to_incremental)"""
+        free_pages = self.db.query_one("PRAGMA freelist_count")[0]
+        if self._incremental_mode():
+            self.db.query_all(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)})")
+        else:
+            logger.warning(
+                "⚠️ knowledge.db is not in auto_vacuum=INCREMENTAL mode, freed pages stay in the file; "
+                "run convert_to_incremental_vacuum() during maintenance"
+            )
+        self.db.query_all("PRAGMA wal_checkpoint(TRUNCATE)")
+        return {"free_pages_before": free_pages}
+
+    def convert_to_incremental(self) -> Dict[str, Any]:
+        """
+        Однократный перевод существующей базы в auto_vacuum=INCREMENTAL
+
+        Полный VACUUM переписывает весь файл и держит блокировку записи всё время работы —
+        вызывать явно, в окно обслуживания; фоновый проход его не запускает.
+        """
+        if self._incremental_mode():
+            return {"converted": False, "auto_vacuum": "incremental"}
+
+        with self._run_lock:
+            started = time.time()
+            size_before = self._db_files_size()
+            logger.info("🧹 Converting knowledge.db to auto_vacuum=INCREMENTAL (full VACUUM)")
+            self.db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self.db.execute("VACUUM")
+            self.db.query_all("PRAGMA wal_checkpoint(TRUNCATE)")
+
+            return {
+                "converted": self._incremental_mode(),
+                "db_bytes_reclaimed": max(size_before - self._db_files_size(), 0),
+                "seconds": round(time.time() - started, 2),
+            }
+
+    def run_once(self) -> Dict[str, Any]:
+        """Один проход: удаление по политике, сжатие векторов и базы"""
+        if not self._run_lock.acquire(blocking=False):
+            return {"skipped": "already running"}
+
+        try:
+            started = time.time()
+            size_before = self._db_files_size()
+            deleted = 0
+            cutoffs = self._model_cutoffs()
+
+            while not self._stop.is_set():
+                ids = self._expired_ids(self.batch_size, cutoffs)
+                if not ids:
+                    break
+                deleted += self._delete_batch(ids)
+
+            report: Dict[str, Any] = {
+                "finished_at": datetime.now().isoformat(timespec="seconds"),
+                "policy": asdict(self.policy),
+                "rows_deleted": deleted,
+            }
+
+            # Встроенный индекс освобождает место только при перезаписи
+            collection = self.rag.collections.get("dialogues")
+            if deleted and hasattr(collection, "compact"):
+                report["vector_index"] = collection.compact()
+
+            if deleted:
+                report.update(self._vacuum())
+
+            db_reclaimed = max(size_before - self._db_files_size(), 0)
+            report["db_bytes_reclaimed"] = db_reclaimed
+            report["bytes_reclaimed"] = db_reclaimed + report.get("vector_index", {}).get("bytes_reclaimed", 0)
+            report["seconds"] = round(time.time() - started, 2)
+
+            self.last_report = report
+            self.totals["runs"] += 1
+            self.totals["rows_deleted"] += deleted
+            self.totals["bytes_reclaimed"] += report["bytes_reclaimed"]
+
+            if deleted:
+                logger.info(
+                    f"🗑️ Retention: {deleted} dialogues removed, "
+                    f"{report['bytes_reclaimed'] / (1024 * 1024):.2f} MB reclaimed"
+                )
+            return report
+        finally:
+            self._run_lock.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "policy": asdict(self.policy),
+            "interval_sec": self.interval,
+            "incremental_vacuum": self._incremental_mode(),
+            **self.totals,
+            "last_run": self.last_report,
+        }
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Search Result Cache
+Кэш результатов search_knowledge с версионированием по коллекциям:
+каждая запись в коллекцию увеличивает её поколение, и закэшированные
+результаты со старым поколением перестают находиться без обхода кэша
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+from embedding_cache import normalize_text
+
+
+class SearchResultCache:
+    """Потокобезопасный LRU результатов поиска с поколениями коллекций"""
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[tuple, List[Dict[str, Any]]]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stale": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        }
+
+    @staticmethod
+    def make_key(query: str, collection: Optional[str], limit: int, **options) -> str:
+        """Ключ: нормализованный запрос, коллекция, limit и параметры поиска (фильтры и т.п.)"""
+        return json.dumps(
+            [normalize_text(query), collection, limit, options],
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+
+    # ==================== ПОКОЛЕНИЯ ====================
+
+    def bump(self, collection: str):
+        """Запись в коллекцию: все результаты по ней становятся устаревшими"""
+        with self._lock:
+            self._generations[collection] = self._generations.get(collection, 0) + 1
+            self.stats["invalidations"] += 1
+
+    def bump_all(self):
+        """Смена модели/коллекций: устаревает весь кэш"""
+        with self._lock:
+            for collection in list(self._generations):
+                self._generations[collection] += 1
+            self._entries.clear()
+            self.stats["invalidations"] += 1
+
+    def snapshot(self, collections: Iterable[str]) -> tuple:
+        """Поколения коллекций на момент начала поиска"""
+        with self._lock:
+            return tuple((c, self._generations.get(c, 0)) for c in sorted(collections))
+
+    def _is_current(self, snapshot: tuple) -> bool:
+        return all(self._generations.get(c, 0) == generation for c, generation in snapshot)
+
+    # ==================== LRU ====================
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """Актуальный результат или None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+
+            snapshot, results = entry
+            if not self._is_current(snapshot):
+                del self._entries[key]
+                self.stats["stale"] += 1
+                self.stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+
+        return [dict(r) for r in results]
+
+    def put(self, key: str, snapshot: tuple, results: List[Dict[str, Any]]):
+        """
+        Сохранить результат с поколениями, снятыми ДО поиска
+
+        Если во время поиска была запись, запись в кэше сразу будет устаревшей.
+        """
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            if not self._is_current(snapshot):
+                return
+            self._entries[key] = (snapshot, [dict(r) for r in results])
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """hit/miss, устаревшие записи и размер"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["size"] = len(self._entries)
+            stats["generations"] = dict(self._generations)
+
+        stats["max_entries"] = self.max_entries
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0
+        return stats
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Search Filters
+Типизированные фильтры поиска по метаданным: один набор условий
+превращается в where для ChromaDB / встроенного индекса и в SQL для FTS5
+"""
+from dataclasses import dataclass, fields
+from typing import Dict, Any, List, Optional, Sequence, Tuple, Union
+
+Values = Union[str, Sequence[str]]
+
+# Поле фильтра -> (ключ метаданных, оператор, коллекции, где ключ есть)
+FILTER_FIELDS = {
+    "min_rating": ("rating", "$gte", ("dialogues",)),
+    "model": ("model", "$in", ("dialogues",)),
+    "topic": ("topic", "$in", ("training",)),
+    "source": ("source", "$in", ("training",)),
+    "content_type": ("type", "$in", ("training",)),
+}
+
+_SQL_OPERATORS = {"$gte": ">=", "$in": "IN"}
+
+
+@dataclass(frozen=True)
+class SearchFilters:
+    """Условия по метаданным; None — условие не задано, список — любое из значений"""
+    min_rating: Optional[float] = None
+    model: Optional[Values] = None
+    topic: Optional[Values] = None
+    source: Optional[Values] = None
+    content_type: Optional[Values] = None
+
+    @classmethod
+    def coerce(cls, filters: Union["SearchFilters", Dict[str, Any], None]) -> "SearchFilters":
+        """SearchFilters из словаря (неизвестное поле — TypeError)"""
+        if filters is None:
+            return cls()
+        if isinstance(filters, cls):
+            return filters
+        return cls(**filters)
+
+    def conditions(self) -> List[Tuple[str, str, Any]]:
+        """[(ключ метаданных, оператор, значение), ...]"""
+        result = []
+        for field in fields(self):
+            value = getattr(self, field.name)
+            if value is None:
+                continue
+            key, op, _ = FILTER_FIELDS[field.name]
+            if op == "$in":
+                value = [value] if isinstance(value, str) else sorted(value)
+            result.append((key, op, value))
+        return result
+
+    def collections(self, candidates: Sequence[str]) -> List[str]:
+        """Коллекции, в метаданных которых есть все ключи фильтра"""
+        scope = list(candidates)
+        for field in fields(self):
+            if getattr(self, field.name) is not None:
+                allowed = FILTER_FIELDS[field.name][2]
+                scope = [c for c in scope if c in allowed]
+        return scope
+
+    def to_where(self) -> Optional[Dict[str, Any]]:
+        """where в синтаксисе ChromaDB (несколько условий — только через $and)"""
+        clauses = [{key: {op: value}} for key, op, value in self.conditions()]
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def to_sql(self, columns: Dict[str, str]) -> Tuple[str, List[Any]]:
+        """Условие для SQL: columns — ключ метаданных -> колонка таблицы"""
+        clauses, params = [], []
+        for key, op, value in self.conditions():
+            if op == "$in":
+                clauses.append(f"{columns[key]} IN ({','.join('?' * len(value))})")
+                params.extend(value)
+            else:
+                clauses.append(f"{columns[key]} {_SQL_OPERATORS[op]} ?")
+                params.append(value)
+        return (" AND ".join(clauses) or "1"), params
+
+
+def apply_char_budget(results: List[Dict[str, Any]], max_chars: Optional[int]) -> List[Dict[str, Any]]:
+    """Результаты по порядку, пока суммарный текст укладывается в max_chars (последний — обрезается)"""
+    if max_chars is None:
+        return results
+
+    budget, kept = max_chars, []
+    for item in results:
+        if budget <= 0:
+            break
+        text = item["text"] or ""
+        if len(text) > budget:
+            item = dict(item, text=text[:budget], truncated=True)
+        kept.append(item)
+        budget -= len(item["text"])
+    return kept
@@ -21,7 +21,11 @@ CODE_DIR = Path("/app")
 BACKUP_DIR = Path("/app/backups")
 LOGS_FILE = Path("/app/logs/agent.log")
 
-BACKUP_DIR.mkdir(parents=True, exist_ok=True)
+
+def _ensure_backup_dir() -> Path:
+    """Каталог бэкапов создаётся при первой записи, а не при импорте"""
+    BACKUP_DIR.mkdir(parents=True, exist_ok=True)
+    return BACKUP_DIR
 
 # ==================== ВЫЗОВ LLM ====================
 
@@ -316,7 +320,7 @@ def create_patch(fix: Dict[str, Any], code_data: Dict[str, Any]) -> Optional[str
     """Создание патча для кода"""
     try:
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        patch_file = BACKUP_DIR / f"patch_{timestamp}.json"
+        patch_file = _ensure_backup_dir() / f"patch_{timestamp}.json"
         
         patch = {
             'timestamp': timestamp,
@@ -357,7 +361,7 @@ def apply_patch(patch_file: Path, auto_approve: bool = False) -> bool:
         
         # Создаём бэкап
         timestamp = patch.get('timestamp', datetime.now().strftime('%Y%m%d_%H%M%S'))
-        backup_file = BACKUP_DIR / f"main_backup_{timestamp}.py"
+        backup_file = _ensure_backup_dir() / f"main_backup_{timestamp}.py"
         original_file = CODE_DIR / "main.py"
         
         if not original_file.exists():
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite Connection Manager
+Общий менеджер соединений SQLite: соединение на поток, WAL, счётчики
+"""
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Iterator, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteConnectionManager:
+    """
+    Пул соединений SQLite: одно постоянное соединение на поток
+
+    Соединения завершившихся потоков закрываются при открытии следующего
+    (и в get_stats), остальные — в close_all.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        busy_timeout_ms: int = 10000,
+        cache_size_kb: int = 64 * 1024,
+        mmap_size: int = 256 * 1024 * 1024,
+        statement_cache_size: int = 256,
+        auto_vacuum: Optional[str] = None
+    ):
+        self.db_path = Path(db_path)
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.statement_cache_size = statement_cache_size
+        # NONE | FULL | INCREMENTAL; действует для новой базы (до первой таблицы)
+        self.auto_vacuum = auto_vacuum
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # (поток-владелец, соединение)
+        self._connections: List[Tuple[threading.Thread, sqlite3.Connection]] = []
+
+        # Счётчики
+        self.stats = {
+            "connections_opened": 0,
+            "connections_closed": 0,
+            "queries": 0,
+            "query_time": 0.0,
+            "transactions": 0,
+            "lock_wait_time": 0.0,
+            "max_lock_wait": 0.0,
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        """Открытие соединения с настроенными PRAGMA"""
+        conn = sqlite3.connect(
+            str(self.db_path),
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,  # транзакции управляются явно
+            cached_statements=self.statement_cache_size,
+            # Используется только своим потоком; закрывается и из других (уборка, close_all)
+            check_same_thread=False
+        )
+        if self.auto_vacuum:
+            conn.execute(f"PRAGMA auto_vacuum={self.auto_vacuum}")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+
+        self.release_dead()
+        with self._lock:
+            self._connections.append((threading.current_thread(), conn))
+            self.stats["connections_opened"] += 1
+
+        logger.debug(f"SQLite connection opened for {threading.current_thread().name}")
+        return conn
+
+    def get_connection(self) -> sqlite3.Connection:
+        """Соединение текущего потока (создаётся при первом обращении)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        """Выполнение запроса с замером времени"""
+        started = time.perf_counter()
+        try:
+            return self.get_connection().execute(sql, params)
+        finally:
+            self._count_query(time.perf_counter() - started)
+
+    def query_one(self, sql: str, params: tuple = ()) -> Optional[tuple]:
+        """Первая строка результата"""
+        return self.execute(sql, params).fetchone()
+
+    def query_all(self, sql: str, params: tuple = ()) -> List[tuple]:
+        """Все строки результата"""
+        return self.execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        """
+        Пишущая транзакция (BEGIN IMMEDIATE)
+
+        Время ожидания блокировки записи учитывается отдельно от времени запросов.
+        """
+        conn = self.get_connection()
+
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        waited = time.perf_counter() - started
+
+        with self._lock:
+            self.stats["transactions"] += 1
+            self.stats["lock_wait_time"] += waited
+            self.stats["max_lock_wait"] = max(self.stats["max_lock_wait"], waited)
+
+        cursor = _TimedCursor(conn.cursor(), self)
+        try:
+            yield cursor
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _count_query(self, elapsed: float):
+        with self._lock:
+            self.stats["queries"] += 1
+            self.stats["query_time"] += elapsed
+
+    def release_dead(self) -> int:
+        """Закрытие соединений потоков, которые уже завершились"""
+        with self._lock:
+            dead = [conn for thread, conn in self._connections if not thread.is_alive()]
+            if not dead:
+                return 0
+            self._connections = [(t, c) for t, c in self._connections if t.is_alive()]
+            self.stats["connections_closed"] += len(dead)
+
+        self._close(dead)
+        return len(dead)
+
+    @staticmethod
+    def _close(connections: List[sqlite3.Connection]):
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                logger.debug(f"SQLite close error: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Счётчики времени запросов и ожидания блокировок"""
+        self.release_dead()
+        with self._lock:
+            stats = dict(self.stats)
+            stats["open_connections"] = len(self._connections)
+
+        stats["query_time"] = round(stats["query_time"], 4)
+        stats["lock_wait_time"] = round(stats["lock_wait_time"], 4)
+        stats["max_lock_wait"] = round(stats["max_lock_wait"], 4)
+        stats["avg_query_ms"] = round(
+            stats["query_time"] * 1000 / stats["queries"], 3
+        ) if stats["queries"] else 0
+        return stats
+
+    def close_all(self):
+        """Закрытие всех соединений (при остановке сервиса)"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self.stats["connections_closed"] += len(connections)
+
+        self._close([conn for _, conn in connections])
+        self._local = threading.local()
+
+
+class _TimedCursor:
+    """Курсор транзакции с учётом времени запросов"""
+
+    def __init__(self, cursor: sqlite3.Cursor, manager: SQLiteConnectionManager):
+        self._cursor = cursor
+        self._manager = manager
+
+    def execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, params)
+        finally:
+            self._manager._count_query(time.perf_counter() - started)
+
+    def executemany(self, sql: str, seq_of_params) -> sqlite3.Cursor:
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(sql, seq_of_params)
+        finally:
+            self._manager._count_query(time.perf_counter() - started)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
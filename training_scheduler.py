@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Training Scheduler
+Планировщик ночного обучения: очередь тем с приоритетом по устареванию,
+полезности прошлых попыток, backoff после ошибок и сигналам об изменениях.
+Состояние хранится в knowledge.db — перезапуск продолжает с того же места.
+"""
+import hashlib
+import heapq
+import logging
+import time
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Исходы попытки обучения на теме
+ADDED = "added"            # новый контент добавлен в базу
+UNCHANGED = "unchanged"    # источник не изменился с прошлого раза
+FAILED = "failed"          # ошибка или слишком мало текста
+LOW_VALUE = "low_value"    # заглушка вместо контента
+OUTCOMES = (ADDED, UNCHANGED, FAILED, LOW_VALUE)
+
+# Устаревание темы, которой ещё не учились (в единицах интервала обновления)
+NEVER_LEARNED_STALENESS = 3.0
+# Вклад полезности (EWMA доли попыток с новым контентом) и сигнала об изменении
+YIELD_WEIGHT = 1.0
+CHANGE_BONUS = 2.0
+YIELD_ALPHA = 0.3
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+class TrainingScheduler:
+    """Приоритетная очередь тем обучения с персистентным состоянием"""
+
+    def __init__(
+        self,
+        db,
+        min_refresh_hours: float = 12,
+        max_refresh_hours: float = 24 * 30,
+        base_backoff_minutes: float = 30,
+        max_backoff_hours: float = 24,
+        low_value_hours: float = 24 * 7
+    ):
+        self.db = db
+        self.min_refresh = min_refresh_hours * 3600
+        self.max_refresh = max_refresh_hours * 3600
+        self.base_backoff = base_backoff_minutes * 60
+        self.max_backoff = max_backoff_hours * 3600
+        self.low_value_delay = low_value_hours * 3600
+
+        with self.db.transaction() as cursor:
+            self.create_tables(cursor)
+
+    @staticmethod
+    def create_tables(cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS training_topics (
+                category VARCHAR(100) NOT NULL,
+                topic VARCHAR(200) NOT NULL,
+                active INTEGER DEFAULT 1,
+                attempts INTEGER DEFAULT 0,
+                successes INTEGER DEFAULT 0,
+                failures_in_row INTEGER DEFAULT 0,
+                chars_added INTEGER DEFAULT 0,
+                yield_score FLOAT DEFAULT 0.5,
+                refresh_seconds FLOAT,
+                content_hash TEXT,
+                changed INTEGER DEFAULT 0,
+                last_outcome VARCHAR(20),
+                last_attempt_at FLOAT,
+                last_success_at FLOAT,
+                next_due_at FLOAT DEFAULT 0,
+                PRIMARY KEY (category, topic)
+            )
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_training_topics_due ON training_topics(active, next_due_at)"
+        )
+
+    # ==================== ТЕМЫ ====================
+
+    def sync_topics(self, sources: Dict[str, List[str]]):
+        """Регистрация тем из learning_sources; пропавшие из источников — неактивны"""
+        pairs = [(category, topic) for category, topics in sources.items() for topic in topics]
+        with self.db.transaction() as cursor:
+            cursor.execute("UPDATE training_topics SET active = 0")
+            cursor.executemany("""
+                INSERT INTO training_topics (category, topic, refresh_seconds) VALUES (?, ?, ?)
+                ON CONFLICT(category, topic) DO UPDATE SET active = 1
+            """, [(category, topic, self.min_refresh) for category, topic in pairs])
+
+    def mark_changed(self, category: str, topics: Iterable[str]) -> int:
+        """Сигнал «источник изменился»: тема становится срочной (кроме backoff после ошибок)"""
+        now = time.time()
+        with self.db.transaction() as cursor:
+            cursor.executemany("""
+                UPDATE training_topics
+                SET changed = 1, next_due_at = MIN(next_due_at, ?)
+                WHERE category = ? AND topic = ? AND failures_in_row = 0
+                  AND COALESCE(last_outcome, '') != ?
+            """, [(now, category, topic, LOW_VALUE) for topic in topics])
+            return cursor.rowcount
+
+    # ==================== ПРИОРИТЕТ ====================
+
+    def _score(self, row: Dict[str, Any], now: float) -> float:
+        if row["last_success_at"] is None:
+            staleness = NEVER_LEARNED_STALENESS
+        else:
+            staleness = (now - row["last_success_at"]) / max(row["refresh_seconds"] or self.min_refresh, 1)
+        return (
+            min(staleness, 10.0)
+            + YIELD_WEIGHT * row["yield_score"]
+            + (CHANGE_BONUS if row["changed"] else 0.0)
+        )
+
+    def _rows(self, where: str = "1", params: tuple = ()) -> List[Dict[str, Any]]:
+        columns = (
+            "category", "topic", "attempts", "successes", "failures_in_row", "chars_added",
+            "yield_score", "refresh_seconds", "changed", "last_outcome",
+            "last_attempt_at", "last_success_at", "next_due_at"
+        )
+        rows = self.db.query_all(
+            f"SELECT {', '.join(columns)} FROM training_topics WHERE active = 1 AND {where}", params
+        )
+        return [dict(zip(columns, row)) for row in rows]
+
+    def ranked(
+        self,
+        limit: Optional[int] = None,
+        categories: Optional[Iterable[str]] = None,
+        now: Optional[float] = None
+    ) -> List[Tuple[str, str, float]]:
+        """Темы, которым пора обновиться: [(category, topic, score), ...] по убыванию приоритета"""
+        now = now or time.time()
+        allowed = set(categories) if categories is not None else None
+        heap = [
+            (-self._score(row, now), row["category"], row["topic"])
+            for row in self._rows("next_due_at <= ?", (now,))
+            if allowed is None or row["category"] in allowed
+        ]
+        heapq.heapify(heap)
+        count = len(heap) if limit is None else min(limit, len(heap))
+        return [
+            (category, topic, round(-score, 3))
+            for score, category, topic in (heapq.heappop(heap) for _ in range(count))
+        ]
+
+    def next_topic(self, now: Optional[float] = None) -> Optional[Tuple[str, str]]:
+        """Самая приоритетная тема из тех, которым пора; None — все свежие или в backoff"""
+        best = self.ranked(limit=1, now=now)
+        return (best[0][0], best[0][1]) if best else None
+
+    def next_due_in(self, now: Optional[float] = None) -> Optional[float]:
+        """Секунд до ближайшей темы, которой пора обновиться"""
+        now = now or time.time()
+        row = self.db.query_one("SELECT MIN(next_due_at) FROM training_topics WHERE active = 1")
+        return max(row[0] - now, 0.0) if row and row[0] is not None else None
+
+    # ==================== ИСХОДЫ ====================
+
+    def is_unchanged(self, category: str, topic: str, text: str) -> bool:
+        """Тот же текст, что и при прошлом успешном обучении"""
+        row = self.db.query_one(
+            "SELECT content_hash FROM training_topics WHERE category = ? AND topic = ?",
+            (category, topic)
+        )
+        return bool(row) and row[0] == content_hash(text)
+
+    def record(
+        self,
+        category: str,
+        topic: str,
+        outcome: str,
+        chars: int = 0,
+        text: Optional[str] = None,
+        now: Optional[float] = None
+    ):
+        """
+        Учесть исход попытки и назначить следующий срок
+
+        Новый контент сокращает интервал обновления вдвое, неизменный — удваивает;
+        ошибки дают экспоненциальный backoff, заглушки — длинную паузу.
+        """
+        if outcome not in OUTCOMES:
+            raise ValueError(f"Unknown training outcome: {outcome}")
+        now = now or time.time()
+
+        row = self.db.query_one("""
+            SELECT refresh_seconds, failures_in_row, yield_score FROM training_topics
+            WHERE category = ? AND topic = ?
+        """, (category, topic))
+        if row is None:
+            self.db.execute(
+                "INSERT OR IGNORE INTO training_topics (category, topic, refresh_seconds) VALUES (?, ?, ?)",
+                (category, topic, self.min_refresh)
+            )
+            row = (self.min_refresh, 0, 0.5)
+        refresh, failures, yield_score = row[0] or self.min_refresh, row[1], row[2]
+
+        success = outcome in (ADDED, UNCHANGED)
+        if outcome == ADDED:
+            refresh = max(refresh / 2, self.min_refresh)
+        elif outcome == UNCHANGED:
+            refresh = min(refresh * 2, self.max_refresh)
+        failures = 0 if success else failures + 1
+        yield_score = (1 - YIELD_ALPHA) * yield_score + YIELD_ALPHA * (1.0 if outcome == ADDED else 0.0)
+
+        if success:
+            next_due = now + refresh
+        elif outcome == LOW_VALUE:
+            next_due = now + self.low_value_delay
+        else:
+            next_due = now + min(self.base_backoff * 2 ** (failures - 1), self.max_backoff)
+
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                UPDATE training_topics SET
+                    attempts = attempts + 1,
+                    successes = successes + ?,
+                    failures_in_row = ?,
+                    chars_added = chars_added + ?,
+                    yield_score = ?,
+                    refresh_seconds = ?,
+                    content_hash = COALESCE(?, content_hash),
+                    changed = CASE WHEN ? THEN 0 ELSE changed END,
+                    last_outcome = ?,
+                    last_attempt_at = ?,
+                    last_success_at = CASE WHEN ? THEN ? ELSE last_success_at END,
+                    next_due_at = ?
+                WHERE category = ? AND topic = ?
+            """, (
+                1 if outcome == ADDED else 0, failures, chars, yield_score, refresh,
+                content_hash(text) if text and outcome == ADDED else None,
+                success, outcome, now, success, now, next_due,
+                category, topic
+            ))
+
+    # ==================== ОТЧЁТЫ ====================
+
+    def get_freshness(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Свежесть по темам: возраст знаний, интервал обновления, срок, полезность"""
+        now = now or time.time()
+        report = []
+        for row in self._rows():
+            age = now - row["last_success_at"] if row["last_success_at"] is not None else None
+            refresh = row["refresh_seconds"] or self.min_refresh
+            report.append({
+                "category": row["category"],
+                "topic": row["topic"],
+                "age_hours": round(age / 3600, 1) if age is not None else None,
+                "refresh_hours": round(refresh / 3600, 1),
+                "fresh": age is not None and age < refresh,
+                "due_in_hours": round(max(row["next_due_at"] - now, 0) / 3600, 2),
+                "priority": round(self._score(row, now), 3),
+                "yield": round(row["yield_score"], 3),
+                "attempts": row["attempts"],
+                "failures_in_row": row["failures_in_row"],
+                "last_outcome": row["last_outcome"],
+            })
+        return sorted(report, key=lambda r: (r["due_in_hours"], -r["priority"]))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Сводка: сколько тем свежих, устаревших, в backoff и заглушек"""
+        now = time.time()
+        freshness = self.get_freshness(now)
+        return {
+            "topics": len(freshness),
+            "fresh": sum(1 for r in freshness if r["fresh"]),
+            "due": sum(1 for r in freshness if r["due_in_hours"] == 0),
+            "backing_off": sum(
+                1 for r in freshness
+                if r["last_outcome"] == FAILED and r["due_in_hours"] > 0
+            ),
+            "low_value": sum(1 for r in freshness if r["last_outcome"] == LOW_VALUE),
+            "never_learned": sum(1 for r in freshness if r["age_hours"] is None),
+            "next_due_in_sec": round(self.next_due_in(now) or 0, 1),
+        }
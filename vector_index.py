@@ -0,0 +1,597 @@
+# -*- coding: utf-8 -*-
+"""
+NumPy Vector Index
+Встроенное векторное хранилище: memory-mapped матрица + SQLite sidecar
+Используется, когда ChromaDB недоступна (совместимо по интерфейсу коллекции)
+Поддерживает квантованное хранение: float16 и int8 с масштабом на вектор
+"""
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк матрицы перемножается за один шаг поиска
+SEARCH_BLOCK_ROWS = 65536
+
+STORAGE_DTYPES = ("float32", "float16", "int8")
+
+
+def quantize(vectors: np.ndarray, dtype: str):
+    """
+    Квантование матрицы float32
+
+    Возвращает (хранимая матрица, масштабы на вектор или None)
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        stored = np.round(vectors / scales[:, None]).clip(-127, 127).astype(np.int8)
+        return stored, scales.astype(np.float32)
+    return vectors.astype(dtype), None
+
+
+def dequantize(stored: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    """Обратное преобразование в float32"""
+    vectors = np.asarray(stored, dtype=np.float32)
+    if scales is not None:
+        vectors = vectors * np.asarray(scales, dtype=np.float32)[:, None]
+    return vectors
+
+
+# Операторы фильтров ChromaDB -> SQL
+_WHERE_OPERATORS = {
+    "$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<=",
+}
+
+
+def where_to_sql(where: Dict[str, Any]):
+    """
+    Фильтр по метаданным в синтаксисе ChromaDB -> (условие SQL, параметры)
+
+    {"db_id": {"$in": [1, 2]}}, {"$and": [{"rating": {"$gte": 0.5}}, {"type": "dialogue"}]}
+    """
+    clauses, params = [], []
+
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_to_sql(sub) for sub in condition]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(sql for sql, _ in parts) + ")")
+            for _, sub_params in parts:
+                params.extend(sub_params)
+            continue
+
+        field = "json_extract(metadata, ?)"
+        path = f'$."{key}"'
+        operators = condition if isinstance(condition, dict) else {"$eq": condition}
+
+        for op, value in operators.items():
+            if op in ("$in", "$nin"):
+                values = list(value)
+                if not values:
+                    clauses.append("0" if op == "$in" else "1")
+                    continue
+                negate = "NOT " if op == "$nin" else ""
+                clauses.append(f"{field} {negate}IN ({','.join('?' * len(values))})")
+                params.extend([path, *values])
+            elif op in _WHERE_OPERATORS:
+                clauses.append(f"{field} {_WHERE_OPERATORS[op]} ?")
+                params.extend([path, value])
+            else:
+                raise ValueError(f"Unsupported where operator: {op}")
+
+    return (" AND ".join(clauses) or "1"), params
+
+
+class NumpyVectorIndex:
+    """
+    Append-only индекс одной коллекции
+
+    vectors.bin — матрица (n, dim) float32/float16/int8, дописывается в конец
+    norms.bin   — квадраты норм векторов (float32) для L2-расстояний
+    scales.bin  — масштаб на вектор (только int8)
+    exact.bin   — точная копия float32 для пересчёта top-k (rescore=True)
+    sidecar.db  — id, документ, метаданные и пометка удаления по номеру строки
+    """
+
+    def __init__(
+        self,
+        path: str,
+        name: str,
+        dtype: str = "float32",
+        rescore: bool = False,
+        rescore_factor: int = 4
+    ):
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported vector dtype: {dtype}")
+
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.name = name
+
+        self._lock = threading.RLock()
+        self._sidecar = sqlite3.connect(
+            str(self.path / "sidecar.db"),
+            check_same_thread=False,
+            isolation_level=None
+        )
+        self._sidecar.execute("PRAGMA journal_mode=WAL")
+        self._sidecar.execute("PRAGMA synchronous=NORMAL")
+        self._sidecar.execute("""
+            CREATE TABLE IF NOT EXISTS rows (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                document TEXT,
+                metadata TEXT,
+                deleted INTEGER DEFAULT 0
+            )
+        """)
+        self._sidecar.execute("""
+            CREATE TABLE IF NOT EXISTS info (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+
+        # Параметры матрицы фиксируются при первой вставке
+        info = dict(self._sidecar.execute("SELECT key, value FROM info").fetchall())
+        self.dtype = np.dtype(info.get("dtype", dtype))
+        self.dim = int(info["dim"]) if "dim" in info else None
+        self.rescore = info.get("rescore", str(rescore)) == "True" and self.dtype != np.float32
+        self.rescore_factor = rescore_factor
+
+        self._vectors_path = self.path / "vectors.bin"
+        self._norms_path = self.path / "norms.bin"
+        self._scales_path = self.path / "scales.bin"
+        self._exact_path = self.path / "exact.bin"
+
+        # Количество строк: по sidecar (файлы могли быть дописаны не до конца)
+        row = self._sidecar.execute("SELECT MAX(row) FROM rows").fetchone()
+        self._count = (row[0] + 1) if row[0] is not None else 0
+        self._truncate_files()
+
+        self._deleted = np.zeros(self._count, dtype=bool)
+        for (deleted_row,) in self._sidecar.execute("SELECT row FROM rows WHERE deleted = 1"):
+            self._deleted[deleted_row] = True
+
+        self._arrays = None
+
+    # ==================== ХРАНЕНИЕ ====================
+
+    def _array_specs(self) -> Dict[str, tuple]:
+        """Файлы индекса: имя -> (путь, dtype, ширина строки)"""
+        specs = {
+            "vectors": (self._vectors_path, self.dtype, self.dim),
+            "norms": (self._norms_path, np.dtype(np.float32), 1),
+        }
+        if self.dtype == np.int8:
+            specs["scales"] = (self._scales_path, np.dtype(np.float32), 1)
+        if self.rescore:
+            specs["exact"] = (self._exact_path, np.dtype(np.float32), self.dim)
+        return specs
+
+    def _truncate_files(self):
+        """Обрезка хвоста после аварийного завершения во время записи"""
+        if self.dim is None:
+            return
+        for file_path, dtype, width in self._array_specs().values():
+            row_bytes = dtype.itemsize * width
+            if file_path.exists() and file_path.stat().st_size > self._count * row_bytes:
+                with open(file_path, "r+b") as f:
+                    f.truncate(self._count * row_bytes)
+
+    def _set_info(self, key: str, value: Any):
+        self._sidecar.execute(
+            "INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)", (key, str(value))
+        )
+
+    def _load_arrays(self) -> Optional[Dict[str, np.ndarray]]:
+        """Memory-mapped представление файлов индекса (переоткрывается после вставок)"""
+        if self._arrays is not None and len(self._arrays["vectors"]) == self._count:
+            return self._arrays
+
+        if self._count == 0 or self.dim is None:
+            return None
+
+        self._arrays = {
+            name: np.memmap(
+                file_path,
+                dtype=dtype,
+                mode="r",
+                shape=(self._count, width) if width > 1 else (self._count,)
+            )
+            for name, (file_path, dtype, width) in self._array_specs().items()
+        }
+        return self._arrays
+
+    # ==================== ИНТЕРФЕЙС КОЛЛЕКЦИИ ====================
+
+    def add(
+        self,
+        embeddings: List[List[float]],
+        documents: List[str],
+        metadatas: List[Dict[str, Any]],
+        ids: List[str]
+    ):
+        """
+        Добавление векторов (как chromadb Collection.add)
+
+        Уже существующие id пропускаются, как в Chroma: повтор пачки после сбоя безопасен.
+        """
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        if len(vectors) == 0:
+            return
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._set_info("dim", self.dim)
+                self._set_info("dtype", self.dtype.name)
+                self._set_info("rescore", self.rescore)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(
+                    f"Embedding dimension {vectors.shape[1]} does not match index dimension {self.dim}"
+                )
+
+            existing = self._existing_ids(ids)
+            if existing:
+                logger.debug(f"Skipping {len(existing)} existing IDs in {self.name}")
+                keep = [i for i, id_ in enumerate(ids) if id_ not in existing]
+                vectors = vectors[keep]
+                documents = [documents[i] for i in keep]
+                metadatas = [metadatas[i] for i in keep]
+                ids = [ids[i] for i in keep]
+                if not keep:
+                    return
+
+            start = self._count
+            stored, scales = quantize(vectors, self.dtype.name)
+            norms = (dequantize(stored, scales) ** 2).sum(axis=1).astype(np.float32)
+            data = {"vectors": stored, "norms": norms, "scales": scales, "exact": vectors}
+
+            # Сначала данные, затем sidecar: строка видна только после записи вектора
+            for name, (file_path, _, _) in self._array_specs().items():
+                with open(file_path, "ab") as f:
+                    f.write(data[name].tobytes())
+
+            self._sidecar.execute("BEGIN")
+            self._sidecar.executemany(
+                "INSERT INTO rows (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                [
+                    (start + i, id_, doc, json.dumps(meta or {}, ensure_ascii=False))
+                    for i, (id_, doc, meta) in enumerate(zip(ids, documents, metadatas))
+                ]
+            )
+            self._sidecar.execute("COMMIT")
+
+            self._count += len(vectors)
+            self._deleted = np.concatenate([self._deleted, np.zeros(len(vectors), dtype=bool)])
+
+    def _existing_ids(self, ids: List[str]) -> set:
+        found = set()
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            found.update(
+                row[0] for row in self._sidecar.execute(
+                    f"SELECT id FROM rows WHERE id IN ({placeholders})", part
+                )
+            )
+        return found
+
+    def count(self) -> int:
+        """Количество живых векторов"""
+        return int(self._count - self._deleted.sum())
+
+    def query(
+        self,
+        query_embeddings: List[List[float]],
+        n_results: int = 10,
+        where: Optional[Dict[str, Any]] = None,
+        max_distance: Optional[float] = None,
+        **kwargs
+    ) -> Dict[str, List[List[Any]]]:
+        """
+        Top-k поиск по квадрату L2-расстояния (как chromadb Collection.query)
+
+        where отбирает строки по метаданным в sidecar до умножения матрицы,
+        max_distance отсекает далёкие строки до выборки документов.
+        """
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+
+        with self._lock:
+            arrays = self._load_arrays()
+            deleted = self._deleted
+            if where and arrays is not None:
+                # Строки вне фильтра исключаются так же, как удалённые
+                condition, params = where_to_sql(where)
+                matched = [r[0] for r in self._sidecar.execute(
+                    f"SELECT row FROM rows WHERE deleted = 0 AND {condition}", params
+                )]
+                deleted = np.ones(len(deleted), dtype=bool)
+                deleted[matched] = False
+
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries.reshape(1, -1)
+
+        for query in queries:
+            if arrays is None:
+                rows, distances = [], []
+            else:
+                rows, distances = self._search(arrays, deleted, query, n_results, max_distance)
+
+            ids, documents, metadatas = self._fetch_rows(rows)
+            result["ids"].append(ids)
+            result["documents"].append(documents)
+            result["metadatas"].append(metadatas)
+            result["distances"].append([float(d) for d in distances])
+
+        return result
+
+    def _search(
+        self,
+        arrays: Dict[str, np.ndarray],
+        deleted: np.ndarray,
+        query: np.ndarray,
+        k: int,
+        max_distance: Optional[float] = None
+    ):
+        """Блочное умножение матрицы на запрос и слияние top-k"""
+        matrix, norms, scales = arrays["vectors"], arrays["norms"], arrays.get("scales")
+        exact = arrays.get("exact")
+
+        # С пересчётом по float32 берём больше кандидатов из квантованной матрицы
+        final_k = k
+        if exact is not None:
+            k = k * self.rescore_factor
+
+        query_norm = float(query @ query)
+        best_rows = np.empty(0, dtype=np.int64)
+        best_dist = np.empty(0, dtype=np.float32)
+
+        for start in range(0, len(matrix), SEARCH_BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            dots = block @ query
+            if scales is not None:
+                dots *= scales[start:start + len(block)]
+            dist = norms[start:start + len(block)] + query_norm - 2.0 * dots
+            dist[deleted[start:start + len(block)]] = np.inf
+            # Квантованные расстояния приблизительны: порог — после точного пересчёта
+            if max_distance is not None and exact is None:
+                dist[dist > max_distance] = np.inf
+
+            take = min(k, len(dist))
+            idx = np.argpartition(dist, take - 1)[:take]
+            best_rows = np.concatenate([best_rows, idx + start])
+            best_dist = np.concatenate([best_dist, dist[idx]])
+
+            if len(best_rows) > k:
+                keep = np.argpartition(best_dist, k - 1)[:k]
+                best_rows, best_dist = best_rows[keep], best_dist[keep]
+
+        alive = np.isfinite(best_dist)
+        best_rows, best_dist = best_rows[alive], best_dist[alive]
+
+        # Точный пересчёт расстояний кандидатов
+        if exact is not None and len(best_rows):
+            candidates = np.asarray(exact[np.sort(best_rows)], dtype=np.float32)
+            best_rows = np.sort(best_rows)
+            best_dist = ((candidates - query) ** 2).sum(axis=1)
+            if max_distance is not None:
+                close = best_dist <= max_distance
+                best_rows, best_dist = best_rows[close], best_dist[close]
+
+        order = np.argsort(best_dist)[:final_k]
+        return best_rows[order].tolist(), np.maximum(best_dist[order], 0.0).tolist()
+
+    def _fetch_rows(self, rows: List[int]):
+        """id, документы и метаданные по номерам строк (в порядке rows)"""
+        if not rows:
+            return [], [], []
+
+        placeholders = ",".join("?" * len(rows))
+        with self._lock:
+            found = {
+                row: (id_, doc, meta)
+                for row, id_, doc, meta in self._sidecar.execute(
+                    f"SELECT row, id, document, metadata FROM rows WHERE row IN ({placeholders})",
+                    rows
+                )
+            }
+
+        ids, documents, metadatas = [], [], []
+        for row in rows:
+            id_, doc, meta = found[row]
+            ids.append(id_)
+            documents.append(doc)
+            metadatas.append(json.loads(meta) if meta else {})
+        return ids, documents, metadatas
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        **kwargs
+    ) -> Dict[str, List[Any]]:
+        """Записи по id и/или фильтру метаданных (как chromadb Collection.get)"""
+        condition, params = where_to_sql(where) if where else ("1", [])
+        with self._lock:
+            if ids is None:
+                rows = self._sidecar.execute(
+                    f"SELECT id, document, metadata FROM rows WHERE deleted = 0 AND {condition} "
+                    f"ORDER BY row LIMIT ?",
+                    (*params, limit if limit is not None else -1)
+                ).fetchall()
+            else:
+                rows = []
+                for start in range(0, len(ids), 500):
+                    part = ids[start:start + 500]
+                    placeholders = ",".join("?" * len(part))
+                    rows.extend(self._sidecar.execute(
+                        f"SELECT id, document, metadata FROM rows "
+                        f"WHERE deleted = 0 AND id IN ({placeholders}) AND {condition}",
+                        (*part, *params)
+                    ).fetchall())
+
+        return {
+            "ids": [r[0] for r in rows],
+            "documents": [r[1] for r in rows],
+            "metadatas": [json.loads(r[2]) if r[2] else {} for r in rows],
+        }
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None, **kwargs):
+        """Пометка записей удалёнными (место освобождается при compact)"""
+        with self._lock:
+            if where:
+                condition, params = where_to_sql(where)
+                matched = [r[0] for r in self._sidecar.execute(
+                    f"SELECT id FROM rows WHERE deleted = 0 AND {condition}", params
+                )]
+                ids = matched if ids is None else list(set(ids) & set(matched))
+            if not ids:
+                return
+
+            self._sidecar.execute("BEGIN")
+            for start in range(0, len(ids), 500):
+                part = ids[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = [r[0] for r in self._sidecar.execute(
+                    f"SELECT row FROM rows WHERE id IN ({placeholders})", part
+                )]
+                self._sidecar.execute(
+                    f"UPDATE rows SET deleted = 1 WHERE id IN ({placeholders})", part
+                )
+                self._deleted[rows] = True
+            self._sidecar.execute("COMMIT")
+
+    def compact(self) -> Dict[str, Any]:
+        """Перезапись матрицы без удалённых строк"""
+        with self._lock:
+            if self._count == 0 or not self._deleted.any():
+                return {"removed": 0, "bytes_reclaimed": 0}
+
+            arrays = self._load_arrays()
+            keep = np.flatnonzero(~self._deleted)
+            size_before = self._files_size()
+
+            for name, (file_path, _, _) in self._array_specs().items():
+                with open(file_path.with_suffix(".tmp"), "wb") as f:
+                    for start in range(0, len(keep), SEARCH_BLOCK_ROWS):
+                        f.write(np.asarray(arrays[name][keep[start:start + SEARCH_BLOCK_ROWS]]).tobytes())
+
+            self._arrays = None
+            del arrays
+
+            # Перенумерация строк в sidecar
+            self._sidecar.execute("BEGIN")
+            self._sidecar.execute("DELETE FROM rows WHERE deleted = 1")
+            self._sidecar.execute("""
+                CREATE TEMP TABLE renumber AS
+                SELECT row AS old_row, ROW_NUMBER() OVER (ORDER BY row) - 1 AS new_row FROM rows
+            """)
+            self._sidecar.execute("UPDATE rows SET row = -1 - row")
+            self._sidecar.execute("""
+                UPDATE rows SET row = (
+                    SELECT new_row FROM renumber WHERE old_row = -1 - rows.row
+                )
+            """)
+            self._sidecar.execute("DROP TABLE renumber")
+            for file_path, _, _ in self._array_specs().values():
+                file_path.with_suffix(".tmp").replace(file_path)
+            self._sidecar.execute("COMMIT")
+
+            removed = self._count - len(keep)
+            self._count = len(keep)
+            self._deleted = np.zeros(self._count, dtype=bool)
+            size_after = self._files_size()
+
+        logger.info(f"🗜️ Compacted {self.name}: {removed} vectors removed")
+        return {"removed": int(removed), "bytes_reclaimed": int(size_before - size_after)}
+
+    def _files_size(self) -> int:
+        return sum(
+            file_path.stat().st_size
+            for file_path, _, _ in self._array_specs().values()
+            if file_path.exists()
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Размер индекса"""
+        vectors_size = self._vectors_path.stat().st_size if self._vectors_path.exists() else 0
+        return {
+            "vectors": self.count(),
+            "rows": self._count,
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "rescore": self.rescore,
+            "size_mb": round(vectors_size / (1024 * 1024), 2),
+            "disk_size_mb": round(self._files_size() / (1024 * 1024), 2),
+        }
+
+
+def quantization_report(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    rescore_factor: int = 4
+) -> Dict[str, Any]:
+    """
+    Отчёт по квантованию на своём корпусе
+
+    Для каждого режима: память на вектор, экономия относительно float32
+    и recall@k относительно точного поиска (без пересчёта и с пересчётом float32)
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    k = min(k, len(vectors))
+
+    def top_k(matrix: np.ndarray, count: int) -> np.ndarray:
+        norms = (matrix ** 2).sum(axis=1)
+        dist = norms[None, :] - 2.0 * (queries @ matrix.T)
+        idx = np.argpartition(dist, count - 1, axis=1)[:, :count]
+        order = np.take_along_axis(dist, idx, axis=1).argsort(axis=1)
+        return np.take_along_axis(idx, order, axis=1)
+
+    def recall(found: np.ndarray, truth: np.ndarray) -> float:
+        hits = sum(len(set(f[:k]) & set(t)) for f, t in zip(found, truth))
+        return round(hits / (len(truth) * k), 4)
+
+    truth = top_k(vectors, k)
+    float32_bytes = vectors.shape[1] * 4
+
+    report = {
+        "vectors": len(vectors),
+        "queries": len(queries),
+        "k": k,
+        "modes": {},
+    }
+    for mode in STORAGE_DTYPES:
+        stored, scales = quantize(vectors, mode)
+        approx = dequantize(stored, scales)
+        bytes_per_vector = stored.shape[1] * stored.dtype.itemsize + 4 + (4 if scales is not None else 0)
+
+        candidates = top_k(approx, min(k * rescore_factor, len(vectors)))
+        rescored = []
+        for query, rows in zip(queries, candidates):
+            dist = ((vectors[rows] - query) ** 2).sum(axis=1)
+            rescored.append(rows[np.argsort(dist)[:k]])
+
+        report["modes"][mode] = {
+            "bytes_per_vector": bytes_per_vector,
+            "memory_saved": round(1 - bytes_per_vector / (float32_bytes + 4), 3),
+            "recall": recall(candidates, truth),
+            "recall_rescored": recall(np.array(rescored), truth),
+        }
+
+    return report
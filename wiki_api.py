@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+MediaWiki API Fetcher
+Пакетная загрузка plain-text выдержек статей через MediaWiki API
+с ревалидацией по lastrevid и сжатым хранением в knowledge.db
+"""
+import logging
+import threading
+import zlib
+from datetime import datetime
+from typing import Dict, Any, Iterable, List, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_URL = "https://ru.wikipedia.org/w/api.php"
+USER_AGENT = "II-Agent-Trainer/1.0 (night training; MediaWiki API)"
+
+# Лимиты API: prop=info — до 50 заголовков за запрос.
+# Полную выдержку (explaintext без exintro) TextExtracts отдаёт одну на ответ,
+# остальные заголовки пачки приходят через continue: N изменившихся статей — N запросов.
+# Пачка задаёт только цепочку continue и одну транзакцию записи.
+INFO_BATCH_TITLES = 50
+EXTRACT_BATCH_TITLES = 20
+EXTRACTS_PER_REQUEST = 1
+COMPRESSION_LEVEL = 6
+
+
+class MediaWikiFetcher:
+    """
+    Загрузчик статей Википедии
+
+    1. prop=info по пачке заголовков — дешёвая проверка lastrevid;
+    2. prop=extracts&explaintext — только для изменившихся статей;
+    3. текст хранится в wiki_articles сжатым zlib.
+    """
+
+    def __init__(self, db, api_url: str = DEFAULT_API_URL, timeout: float = 15):
+        self.db = db
+        self.api_url = api_url
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "User-Agent": USER_AGENT,
+            "Accept-Encoding": "gzip",
+        })
+
+        with self.db.transaction() as cursor:
+            self.create_tables(cursor)
+
+        self._lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "bytes_received": 0,
+            "checked": 0,
+            "unchanged": 0,
+            "updated": 0,
+            "missing": 0,
+        }
+
+    @staticmethod
+    def create_tables(cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS wiki_articles (
+                title TEXT PRIMARY KEY,
+                canonical_title TEXT,
+                pageid INTEGER,
+                lastrevid INTEGER,
+                content BLOB,
+                raw_bytes INTEGER,
+                stored_bytes INTEGER,
+                fetched_at TIMESTAMP,
+                checked_at TIMESTAMP
+            )
+        """)
+
+    # ==================== API ====================
+
+    def _api(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Запрос к API (JSON, formatversion=2)"""
+        params = dict(params, action="query", format="json", formatversion=2)
+        response = self.session.get(self.api_url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["bytes_received"] += int(
+                response.headers.get("Content-Length") or len(response.content)
+            )
+        return response.json()
+
+    @staticmethod
+    def _resolve_titles(titles: List[str], query: Dict[str, Any]) -> Dict[str, str]:
+        """Запрошенный заголовок -> каноничный (normalized + redirects)"""
+        mapping = {}
+        for step in ("normalized", "redirects"):
+            mapping[step] = {item["from"]: item["to"] for item in query.get(step, [])}
+
+        resolved = {}
+        for title in titles:
+            canonical = mapping["normalized"].get(title, title)
+            resolved[title] = mapping["redirects"].get(canonical, canonical)
+        return resolved
+
+    def _query_pages(self, titles: List[str], params: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """Страницы по запрошенным заголовкам, с обработкой continue"""
+        pages: Dict[str, Dict[str, Any]] = {}
+        resolved: Dict[str, str] = {}
+        request = dict(params, titles="|".join(titles), redirects=1)
+
+        while True:
+            data = self._api(request)
+            query = data.get("query", {})
+            resolved.update(self._resolve_titles(titles, query))
+
+            for page in query.get("pages", []):
+                merged = pages.setdefault(page["title"], {})
+                merged.update({k: v for k, v in page.items() if v is not None})
+
+            if "continue" not in data:
+                break
+            request = dict(request, **data["continue"])
+
+        return {title: pages.get(canonical, {"missing": True}) for title, canonical in resolved.items()}
+
+    # ==================== REVALIDATION ====================
+
+    def _stored_revisions(self, titles: List[str]) -> Dict[str, int]:
+        placeholders = ",".join("?" * len(titles))
+        return dict(self.db.query_all(
+            f"SELECT title, lastrevid FROM wiki_articles WHERE title IN ({placeholders})",
+            tuple(titles)
+        ))
+
+    def check_revisions(self, titles: List[str]) -> Dict[str, Optional[int]]:
+        """lastrevid изменившихся (или новых) статей; None — статьи нет"""
+        changed: Dict[str, Optional[int]] = {}
+
+        for start in range(0, len(titles), INFO_BATCH_TITLES):
+            part = titles[start:start + INFO_BATCH_TITLES]
+            stored = self._stored_revisions(part)
+            pages = self._query_pages(part, {"prop": "info"})
+
+            unchanged = []
+            for title in part:
+                page = pages.get(title, {})
+                if page.get("missing"):
+                    changed[title] = None
+                elif stored.get(title) == page.get("lastrevid"):
+                    unchanged.append(title)
+                else:
+                    changed[title] = page.get("lastrevid")
+
+            if unchanged:
+                with self.db.transaction() as cursor:
+                    cursor.executemany(
+                        "UPDATE wiki_articles SET checked_at = ? WHERE title = ?",
+                        [(datetime.now(), title) for title in unchanged]
+                    )
+
+            with self._lock:
+                self.stats["checked"] += len(part)
+                self.stats["unchanged"] += len(unchanged)
+
+        return changed
+
+    # ==================== FETCH ====================
+
+    def fetch(self, titles: Iterable[str], revalidate: bool = True) -> Dict[str, Optional[str]]:
+        """
+        Тексты изменившихся статей {title: text}
+
+        Неизменившиеся статьи в результат не попадают;
+        отсутствующие в Википедии — попадают со значением None.
+        """
+        titles = list(dict.fromkeys(titles))
+        if not titles:
+            return {}
+
+        if revalidate:
+            changed = self.check_revisions(titles)
+        else:
+            changed = {title: 0 for title in titles}
+
+        results: Dict[str, Optional[str]] = {
+            title: None for title, revid in changed.items() if revid is None
+        }
+        targets = [title for title, revid in changed.items() if revid is not None]
+
+        for start in range(0, len(targets), EXTRACT_BATCH_TITLES):
+            part = targets[start:start + EXTRACT_BATCH_TITLES]
+            pages = self._query_pages(part, {
+                "prop": "extracts|info",
+                "explaintext": 1,
+                "exsectionformat": "plain",
+                "exlimit": EXTRACTS_PER_REQUEST,
+            })
+
+            rows = []
+            for title in part:
+                page = pages.get(title, {})
+                text = page.get("extract")
+                if page.get("missing") or not text:
+                    results[title] = None
+                    continue
+
+                raw = text.encode("utf-8")
+                blob = zlib.compress(raw, COMPRESSION_LEVEL)
+                rows.append((
+                    title, page.get("title"), page.get("pageid"), page.get("lastrevid"),
+                    blob, len(raw), len(blob), datetime.now(), datetime.now()
+                ))
+                results[title] = text
+
+            if rows:
+                with self.db.transaction() as cursor:
+                    cursor.executemany("""
+                        INSERT OR REPLACE INTO wiki_articles
+                        (title, canonical_title, pageid, lastrevid, content,
+                         raw_bytes, stored_bytes, fetched_at, checked_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, rows)
+
+            with self._lock:
+                self.stats["updated"] += len(rows)
+                self.stats["missing"] += len(part) - len(rows)
+
+        with self._lock:
+            self.stats["missing"] += sum(1 for revid in changed.values() if revid is None)
+
+        logger.info(
+            f"📖 MediaWiki: {len(titles)} titles, "
+            f"{sum(1 for t in results.values() if t)} updated, "
+            f"{len(titles) - len(changed)} unchanged"
+        )
+        return results
+
+    def get_text(self, title: str) -> Optional[str]:
+        """Сохранённый текст статьи"""
+        row = self.db.query_one("SELECT content FROM wiki_articles WHERE title = ?", (title,))
+        if not row or row[0] is None:
+            return None
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def get_stats(self, include_storage: bool = True) -> Dict[str, Any]:
+        """Трафик и экономия на хранении (include_storage — агрегат по таблице)"""
+        with self._lock:
+            stats = dict(self.stats)
+        if include_storage:
+            stats.update(self.get_storage_stats())
+        return stats
+
+    def get_storage_stats(self) -> Dict[str, Any]:
+        """Число статей, объём и степень сжатия (проход по wiki_articles)"""
+        stats = {}
+        articles, raw_bytes, stored_bytes = self.db.query_one("""
+            SELECT COUNT(*), COALESCE(SUM(raw_bytes), 0), COALESCE(SUM(stored_bytes), 0)
+            FROM wiki_articles
+        """)
+        stats["articles"] = articles
+        stats["stored_mb"] = round(stored_bytes / (1024 * 1024), 2)
+        stats["compression_ratio"] = round(raw_bytes / stored_bytes, 2) if stored_bytes else 0
+        return stats
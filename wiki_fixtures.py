@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+MediaWiki Fixture Server
+Локальный сервер, имитирующий MediaWiki API (prop=info|extracts),
+для офлайн-проверки MediaWikiFetcher
+"""
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Optional
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_PAGES = {
+    "Уфа": "Уфа — город в России, столица Республики Башкортостан. "
+           "Расположен на берегах реки Белой при впадении в неё рек Уфы и Дёмы.",
+    "Git": "Git — распределённая система управления версиями. "
+           "Проект был создан Линусом Торвальдсом для управления разработкой ядра Linux.",
+    "Алгоритм": "Алгоритм — конечная совокупность точно заданных правил решения "
+                "произвольного класса задач или набор инструкций.",
+}
+
+# Сколько выдержек отдаётся за один ответ: как у TextExtracts,
+# полная выдержка — одна, вступления (exintro) — до 20
+FIXTURE_EXTRACTS_PER_RESPONSE = 1
+FIXTURE_INTRO_EXTRACTS_PER_RESPONSE = 20
+
+
+class MediaWikiFixtureServer:
+    """
+    Имитация MediaWiki API на 127.0.0.1
+
+    with MediaWikiFixtureServer({"Уфа": "текст"}) as server:
+        fetcher = MediaWikiFetcher(db, api_url=server.api_url)
+    """
+
+    def __init__(self, pages: Optional[Dict[str, str]] = None, port: int = 0):
+        self._lock = threading.Lock()
+        self._pages: Dict[str, Dict[str, Any]] = {}
+        self._next_revid = 1000
+        self.requests = 0
+
+        for title, text in (pages or SAMPLE_PAGES).items():
+            self.set_page(title, text)
+
+        self.redirects: Dict[str, str] = {}
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._make_handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def api_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/w/api.php"
+
+    def set_page(self, title: str, text: str):
+        """Создать или изменить статью (новая ревизия)"""
+        with self._lock:
+            self._next_revid += 1
+            page = self._pages.get(title)
+            self._pages[title] = {
+                "pageid": page["pageid"] if page else len(self._pages) + 1,
+                "lastrevid": self._next_revid,
+                "extract": text,
+            }
+
+    def start(self) -> "MediaWikiFixtureServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"🧪 MediaWiki fixture server at {self.api_url}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ==================== API ====================
+
+    def _query(self, params: Dict[str, str]) -> Dict[str, Any]:
+        titles = [t for t in params.get("titles", "").split("|") if t]
+        props = set(params.get("prop", "").split("|"))
+        offset = int(params.get("excontinue", 0))
+        per_response = (
+            FIXTURE_INTRO_EXTRACTS_PER_RESPONSE if params.get("exintro")
+            else FIXTURE_EXTRACTS_PER_RESPONSE
+        )
+
+        query: Dict[str, Any] = {}
+        normalized = []
+        redirects = []
+        pages = []
+
+        with self._lock:
+            self.requests += 1
+            for title in titles:
+                canonical = title.replace("_", " ")
+                if canonical != title:
+                    normalized.append({"from": title, "to": canonical})
+                if canonical in self.redirects:
+                    target = self.redirects[canonical]
+                    redirects.append({"from": canonical, "to": target})
+                    canonical = target
+
+                stored = self._pages.get(canonical) or self._pages.get(canonical.replace(" ", "_"))
+                if stored is None:
+                    pages.append({"ns": 0, "title": canonical, "missing": True})
+                    continue
+
+                page = {"pageid": stored["pageid"], "ns": 0, "title": canonical}
+                if "info" in props:
+                    page["lastrevid"] = stored["lastrevid"]
+                page["_extract"] = stored["extract"]
+                pages.append(page)
+
+        # Выдержки порциями, остальное — через continue
+        existing = [p for p in pages if not p.get("missing")]
+        served = {id(p) for p in existing[offset:offset + per_response]}
+        for page in pages:
+            extract = page.pop("_extract", None)
+            if "extracts" in props and id(page) in served:
+                page["extract"] = extract
+
+        response: Dict[str, Any] = {"batchcomplete": True, "query": query}
+        if normalized:
+            query["normalized"] = normalized
+        if redirects:
+            query["redirects"] = redirects
+        query["pages"] = pages
+
+        if "extracts" in props and offset + per_response < len(existing):
+            response["continue"] = {
+                "excontinue": offset + per_response,
+                "continue": "||info",
+            }
+        return response
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                params = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+
+                if parsed.path != "/w/api.php" or params.get("action") != "query":
+                    self.send_error(404)
+                    return
+
+                body = json.dumps(server._query(params), ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    with MediaWikiFixtureServer() as fixture:
+        print(f"Serving MediaWiki fixtures at {fixture.api_url} (Ctrl+C to stop)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Dialogue Write-Behind
+Отложенная индексация диалогов: строка коммитится сразу (вместе с пометкой
+в dialogue_embed_pending), эмбеддинг и вставка в векторное хранилище —
+в фоновом потоке батчами из ограниченной очереди.
+После сбоя незавершённые диалоги дочитываются из таблицы пометок.
+"""
+import logging
+import queue
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повтором батча после ошибки (удваивается до максимума)
+RETRY_DELAY = 2.0
+MAX_RETRY_DELAY = 120.0
+
+
+class DialogueWriteBehind:
+    """Ограниченная очередь эмбеддинга диалогов с backpressure и восстановлением"""
+
+    def __init__(
+        self,
+        rag,
+        max_queue: int = 10000,
+        batch_size: int = 64,
+        flush_interval: float = 0.5,
+        max_wait: float = 5.0
+    ):
+        self.rag = rag
+        self.db = rag.db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Сколько add() ждёт места в очереди; дольше — диалог остаётся только в таблице
+        self.max_wait = max_wait
+
+        self._queue: "queue.Queue[Tuple[int, tuple, float]]" = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+        # id из таблицы пометок, которых нет в очереди: восстановление, переполнение, ошибки
+        self._deferred: List[int] = []
+        self._deferred_lock = threading.Lock()
+        self._retry_at = 0.0
+        self._retry_delay = RETRY_DELAY
+
+        with self.db.transaction() as cursor:
+            self.create_tables(cursor)
+
+        # Всё, что осталось от прошлого запуска, обрабатывается первым
+        self._deferred = [
+            row[0] for row in self.db.query_all(
+                "SELECT dialogue_id FROM dialogue_embed_pending ORDER BY dialogue_id"
+            )
+        ]
+
+        # stats меняют и producer-потоки, и поток эмбеддинга
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "enqueued": 0,
+            "embedded": 0,
+            "batches": 0,
+            "recovered": len(self._deferred),
+            "spilled": 0,
+            "failures": 0,
+            "blocked_seconds": 0.0,
+        }
+        if self._deferred:
+            logger.info(f"♻️ Write-behind: {len(self._deferred)} dialogues pending from the last run")
+
+    @staticmethod
+    def create_tables(cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS dialogue_embed_pending (
+                dialogue_id INTEGER PRIMARY KEY,
+                enqueued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+    @staticmethod
+    def has_pending(db) -> bool:
+        """Есть неиндексированные диалоги (таблица могла ещё не существовать)"""
+        exists = db.query_one(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'dialogue_embed_pending'"
+        )
+        return bool(exists) and db.query_one("SELECT 1 FROM dialogue_embed_pending LIMIT 1") is not None
+
+    # ==================== LIFECYCLE ====================
+
+    def start(self) -> "DialogueWriteBehind":
+        self.thread = threading.Thread(target=self._loop, name="rag-write-behind", daemon=True)
+        self.thread.start()
+        return self
+
+    @property
+    def accepting(self) -> bool:
+        return self.thread is not None and not self._stop.is_set()
+
+    def close(self, timeout: float = 30) -> int:
+        """Остановка с дренажом очереди; возвращает число диалогов, оставшихся в таблице"""
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        remaining = self.db.query_one("SELECT COUNT(*) FROM dialogue_embed_pending")[0]
+        if remaining:
+            logger.warning(f"Write-behind: {remaining} dialogues left pending until next start")
+        return remaining
+
+    # ==================== PRODUCER ====================
+
+    def add(self, user_message: str, assistant_message: str, model_used: str, success_rating: float) -> int:
+        """Коммит диалога с пометкой и постановка в очередь (блокируется, если очередь полна)"""
+        row = (user_message, assistant_message, model_used, success_rating)
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO dialogues
+                (user_message, assistant_message, model_used, success_rating)
+                VALUES (?, ?, ?, ?)
+            """, row)
+            dialogue_id = cursor.lastrowid
+            cursor.execute("INSERT INTO dialogue_embed_pending (dialogue_id) VALUES (?)", (dialogue_id,))
+
+        started = time.perf_counter()
+        try:
+            self._queue.put((dialogue_id, row, time.time()), timeout=self.max_wait)
+            self._count("enqueued")
+        except queue.Full:
+            # Строка и пометка уже в базе — поток дочитает её, когда разгрузится
+            with self._deferred_lock:
+                self._deferred.append(dialogue_id)
+            self._count("spilled")
+        finally:
+            self._count("blocked_seconds", time.perf_counter() - started)
+
+        return dialogue_id
+
+    @staticmethod
+    def mark_pending(cursor, dialogue_ids: List[int]):
+        """Пометки в транзакции вызывающего (массовая запись без очереди)"""
+        cursor.executemany(
+            "INSERT OR IGNORE INTO dialogue_embed_pending (dialogue_id) VALUES (?)",
+            [(dialogue_id,) for dialogue_id in dialogue_ids]
+        )
+
+    def defer(self, dialogue_ids: List[int]):
+        """Помеченные диалоги — в отложенные: поток дочитает их из базы"""
+        with self._deferred_lock:
+            self._deferred.extend(dialogue_ids)
+
+    # ==================== CONSUMER ====================
+
+    def _next_batch(self) -> List[Tuple[int, Optional[tuple]]]:
+        """Батч из очереди (ждём добора до flush_interval), иначе из отложенных"""
+        batch: List[Tuple[int, Optional[tuple]]] = []
+        deadline = time.monotonic() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0 and not self._stop.is_set():
+                    dialogue_id, row, _ = self._queue.get(timeout=timeout)
+                else:
+                    dialogue_id, row, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append((dialogue_id, row))
+
+        # Отложенные — в свободное место батча, если не ждём паузу после ошибки
+        if len(batch) < self.batch_size and time.monotonic() >= self._retry_at:
+            with self._deferred_lock:
+                take = self._deferred[:self.batch_size - len(batch)]
+                del self._deferred[:len(take)]
+            batch.extend((dialogue_id, None) for dialogue_id in take)
+
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if self._stop.is_set():
+                    break
+                continue
+
+            try:
+                self._flush(batch)
+                self._retry_delay = RETRY_DELAY
+            except Exception as e:
+                logger.error(f"Write-behind batch failed ({len(batch)} dialogues): {e}")
+                self._count("failures")
+                with self._deferred_lock:
+                    self._deferred.extend(dialogue_id for dialogue_id, _ in batch)
+                self._retry_at = time.monotonic() + self._retry_delay
+                self._retry_delay = min(self._retry_delay * 2, MAX_RETRY_DELAY)
+                # При остановке повторы не ждём: пометки дождутся следующего запуска
+                if self._stop.is_set() and self._queue.empty():
+                    break
+
+    def _load_rows(self, ids: List[int]) -> Dict[int, tuple]:
+        placeholders = ",".join("?" * len(ids))
+        return {
+            row[0]: tuple(row[1:]) for row in self.db.query_all(f"""
+                SELECT id, user_message, assistant_message, model_used, success_rating
+                FROM dialogues WHERE id IN ({placeholders})
+            """, ids)
+        }
+
+    def _flush(self, batch: List[Tuple[int, Optional[tuple]]]):
+        """Эмбеддинг батча, вставка векторов, снятие пометок"""
+        rag = self.rag
+        ids = [dialogue_id for dialogue_id, _ in batch]
+
+        # Лексический режим (нет векторного хранилища или модели) — пометки просто снимаются;
+        # иначе недоступная коллекция или модель — ошибка: батч повторится с паузой
+        if rag.collections and rag.embedder_available:
+            collection = rag.collections.get("dialogues")
+            if collection is None:
+                raise RuntimeError("dialogues collection is not available")
+            if not rag.ensure_embedder():
+                raise RuntimeError(f"embedder is not available ({rag.embedder_state})")
+
+            # Отложенные читаются из базы (диалог мог быть удалён политикой хранения)
+            deferred = [dialogue_id for dialogue_id, row in batch if row is None]
+            loaded = self._load_rows(deferred) if deferred else {}
+            items = [
+                (dialogue_id, row if row is not None else loaded[dialogue_id])
+                for dialogue_id, row in batch
+                if row is not None or dialogue_id in loaded
+            ]
+
+            if deferred:
+                # Векторы могли быть записаны перед сбоем — повтор не должен их дублировать
+                collection.delete(where={"db_id": {"$in": deferred}})
+            if items:
+                rag._embed_dialogues([i for i, _ in items], [row for _, row in items])
+            self._count("embedded", len(items))
+
+        placeholders = ",".join("?" * len(ids))
+        with self.db.transaction() as cursor:
+            cursor.execute(f"DELETE FROM dialogue_embed_pending WHERE dialogue_id IN ({placeholders})", ids)
+
+        self._count("batches")
+        rag._bump_generation("dialogues")
+
+    def _count(self, name: str, value: float = 1):
+        with self._stats_lock:
+            self.stats[name] += value
+
+    # ==================== STATS ====================
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Глубина очереди, отложенные и пропускная способность"""
+        with self._deferred_lock:
+            deferred = len(self._deferred)
+        oldest = None
+        with self._queue.mutex:
+            if self._queue.queue:
+                oldest = self._queue.queue[0][2]
+
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["blocked_seconds"] = round(stats["blocked_seconds"], 3)
+        stats.update({
+            "queue_depth": self._queue.qsize(),
+            "max_queue": self._queue.maxsize,
+            "deferred": deferred,
+            "lag_seconds": round(time.time() - oldest, 3) if oldest is not None else 0,
+            "avg_batch": round(stats["embedded"] / stats["batches"], 1) if stats["batches"] else 0,
+            "running": self.accepting,
+        })
+        return stats